@@ -0,0 +1,1130 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+################################################################################
+#
+# Benchmarks für lmd.py, die ohne monde-diplomatique.de auskommen. Die Seiten
+# einer Ausgabe werden einmal aufgezeichnet (record) oder, wo das nicht geht,
+# synthetisch erzeugt (synth) und liegen dann in bench/corpus. Ein lokaler
+# Server spielt sie wieder ab (serve, run startet ihn selbst).
+#
+# Usage: python bench.py record [-D JJJJ-MM-TT]
+#        python bench.py synth [--articles n]
+#        python bench.py serve [-p n] [--delay s]
+#        python bench.py run [--save] [--check] [--tolerance t] [--runs n]
+#                            [--clients n] [--requests n] [--delay s]
+#        python bench.py verify
+#
+#  record          Zeichnet Index und Artikel der Ausgabe vom JJJJ-MM-TT auf,
+#                  default ist die aktuelle Ausgabe
+#  synth           Erzeugt eine Ausgabe mit n (30) Artikeln im Aufbau der Site
+#  serve           Spielt die Seiten unter http://127.0.0.1:n (8765) ab, auf
+#                  Wunsch jeweils um s Sekunden verzögert
+#  run             Misst Parsen und Rendern, make_paper() und den Durchsatz der
+#                  Routen der App bei n (8) gleichzeitigen Clients, dazu den
+#                  Speicher je Ausgabe, wenn die App zwölf Ausgaben hält. Jede
+#                  Gruppe läuft in einem eigenen Prozess, damit ihr
+#                  Spitzenverbrauch an Speicher gemessen werden kann. Alles
+#                  läuft n (3) mal, jeder Wert ist der Median der Durchgänge.
+#       --save     Speichert die Ergebnisse als neue Basis in bench/baseline.json
+#       --check    Vergleicht mit der Basis und endet mit Status 1, wenn ein Wert
+#                  um mehr als die Toleranz t (0.25) schlechter ist und der
+#                  Unterschied über dem Rauschen (noise_floor) liegt
+#  verify          Prüft mit demselben Korpus, dass lmd.py richtig arbeitet, etwa
+#                  dass gleichzeitige Anfragen eine Seite nur einmal holen. Endet
+#                  mit Status 1, wenn eine Prüfung fehlschlägt.
+#
+# Die Basis gilt nur für den Rechner und den Korpus, mit denen sie gespeichert
+# wurde.
+#
+################################################################################
+
+import argparse, os, os.path as p, sys, json, time, shutil, tempfile, threading, random, resource, logging, gc
+import BaseHTTPServer, SocketServer, httplib, zipfile, re
+import datetime as dt
+from hashlib import sha1
+from urlparse import urlparse, parse_qs
+from urllib import unquote
+from xml.etree import ElementTree
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from contextlib import contextmanager
+
+dirname_bench   = p.join( p.dirname( p.abspath( __file__ ) ), 'bench' )
+dirname_corpus  = p.join( dirname_bench, 'corpus' )
+baseline_name   = p.join( dirname_bench, 'baseline.json' )
+corpus_info     = 'corpus.json'
+
+# Das Template-Verzeichnis usw. sind in lmd.py relativ angegeben
+os.chdir( p.dirname( p.abspath( __file__ ) ) )
+import lmd
+
+log = logging.getLogger(__name__)
+
+################################################################################
+#
+# Korpus
+#
+################################################################################
+
+def index_file( date ):
+  return p.join( dirname_corpus, 'archiv-text', '%s.html' % date )
+
+def article_file( href ):
+  return p.join( dirname_corpus, 'artikel', p.basename( href ) + '.html' )
+
+def write( fname, data ):
+  if not p.isdir( p.dirname( fname ) ):
+    os.makedirs( p.dirname( fname ) )
+  with open( fname, 'wb' ) as f:
+    f.write( data )
+
+def read( fname ):
+  with open( fname, 'rb' ) as f:
+    return f.read()
+
+def load_corpus():
+  '''
+  Gibt die Beschreibung des Korpus zurück: Datum der Ausgabe, Links der
+  Artikel, ob synthetisch, und eine Prüfsumme über alle Seiten
+  '''
+  try:
+    return json.loads( read( p.join( dirname_corpus, corpus_info ) ) )
+  except IOError:
+    sys.exit( "Kein Korpus in %s, erst mit 'bench.py record' oder 'bench.py synth' anlegen" % dirname_corpus )
+
+def save_corpus( date, hrefs, synthetic ):
+  h = sha1( read( index_file( date ) ) )
+  for href in hrefs:
+    h.update( read( article_file( href ) ) )
+  info = dict( date=date, articles=hrefs, synthetic=synthetic, digest=h.hexdigest() )
+  write( p.join( dirname_corpus, corpus_info ), json.dumps( info, indent=1, sort_keys=True, separators=(',', ': ') ) )
+  print "%d Artikel der Ausgabe vom %s in %s" % ( len( hrefs ), date, dirname_corpus )
+
+def record( date ):
+  '''
+  Zeichnet Index und Artikel einer Ausgabe unverändert auf
+  '''
+  url = '%s/archiv-text?text=%s' % ( lmd.upstream_url, date )
+  html = lmd.http_client.request( url ).body
+  write( index_file( date ), html )
+  index = lmd.IndexPage()
+  index.parse( index.make_soup( html ) )
+  hrefs = [ article['href'] for article in index.get_content()['articles'] ]
+  for href in hrefs:
+    write( article_file( href ), lmd.http_client.request( '%s/%s' % ( lmd.upstream_url, href ) ).body )
+  save_corpus( date, hrefs, False )
+
+synth_words = ( u'Die der und in zu den das nicht von sie ist des sich mit dem dass er es ein '
+  u'Regierung Wirtschaft Politik Gesellschaft Bev&ouml;lkerung Verh&auml;ltnisse Gr&uuml;nde '
+  u'Stra&szlig;e Abkommen Kriege Wahlen Konzerne Arbeiter Gewerkschaften Grenzen Zukunft' ).split()
+
+def synth( articles, date='2016-05-12', seed=1 ):
+  '''
+  Erzeugt eine Ausgabe im Aufbau der Site: viel Navigation und Skripte um
+  div#content herum, darin die Absätze mit den Klassen, die ArticlePage
+  erwartet. Mit demselben seed entsteht immer derselbe Korpus.
+  '''
+  rnd = random.Random( seed )
+  sentence = lambda n : u' '.join( rnd.choice( synth_words ) for i in range( n ) ).capitalize() + u'.'
+  paragraph = lambda : u' '.join( sentence( rnd.randint( 8, 25 ) ) for i in range( rnd.randint( 3, 8 ) ) )
+  head = u'<html><head><meta charset="utf-8"/><title>LMd</title>%s</head><body>' % u''.join(
+      u'<script>var x%d = "<div>" + %d;</script>' % ( i, i ) for i in range( 20 ) )
+  nav = u'<div id="nav"><ul>%s</ul></div>' % u''.join(
+      u'<li><div class="m"><a href="/thema/%d">Thema %d</a></div></li>' % ( i, i ) for i in range( 300 ) )
+  foot = u'<div id="footer">%s</div></body></html>' % u''.join( u'<div><p>%s</p></div>' % sentence( 10 ) for i in range( 30 ) )
+  hrefs = [ 'artikel/!%d' % ( 5300000 + i ) for i in range( articles ) ]
+  items = u''.join( u'<li><a href="/%s"><strong>%s</strong></a> %s <em>von %s</em></li>' % (
+      href, sentence( 5 ), sentence( 30 ), sentence( 2 ) ) for href in hrefs )
+  page = head + nav + u'<div id="content"><strong>Ausgabe</strong><ul>%s</ul></div>' % items + foot
+  write( index_file( date ), page.encode('utf8') )
+  for href in hrefs:
+    paras = [ u'<p class="Unterzeile">%s</p>' % sentence( 8 ), u'<p class="Titel">%s</p>' % sentence( 4 ),
+        u'<p class="Korrespondent">von %s</p>' % sentence( 2 ), u'<p class="Initial">%s</p>' % paragraph() ]
+    paras += [ u'<p class="BrotO">%s</p>' % paragraph() ]
+    for i in range( rnd.randint( 15, 60 ) ):
+      css = 'Zwischentitel' if i % 12 == 11 else 'Brot'
+      paras.append( u'<p class="%s">%s <i>%s</i></p>' % ( css, paragraph(), sentence( 3 ) ) )
+    paras += [ u'<p class="Fussnote">%d %s</p>' % ( i, sentence( 12 ) ) for i in range( rnd.randint( 0, 12 ) ) ]
+    write( article_file( href ), ( head + nav + u'<div id="content">%s</div>' % u''.join( paras ) + foot ).encode('utf8') )
+  save_corpus( date, hrefs, True )
+
+################################################################################
+#
+# Replay-Server
+#
+################################################################################
+
+class ReplayHandler( BaseHTTPServer.BaseHTTPRequestHandler ):
+  '''
+  Liefert die Seiten aus bench/corpus unter den Pfaden der Site aus, mit ETag
+  und 304 wie das Original
+  '''
+  protocol_version = 'HTTP/1.1'
+  delay = 0
+  fallback = None
+
+  def do_GET( self ):
+    time.sleep( self.delay )
+    u = urlparse( self.path )
+    if u.path == '/archiv-text':
+      fname = index_file( parse_qs( u.query ).get( 'text', [''] )[0] )
+      # Alle anderen Ausgaben bekommen den aufgezeichneten Index, damit sich
+      # auch viele Ausgaben gleichzeitig messen lassen
+      if not p.isfile( fname ):
+        fname = self.fallback
+    elif u.path.startswith('/artikel/'):
+      fname = article_file( u.path )
+    else:
+      fname = None
+    if not fname or not p.isfile( fname ):
+      self.send_response( 404 )
+      self.send_header( 'Content-Length', '0' )
+      self.end_headers()
+      return
+    body = read( fname )
+    etag = '"%s"' % sha1( body ).hexdigest()
+    if self.headers.get('If-None-Match') == etag:
+      self.send_response( 304 )
+      self.send_header( 'ETag', etag )
+      self.send_header( 'Content-Length', '0' )
+      self.end_headers()
+      return
+    self.send_response( 200 )
+    self.send_header( 'Content-Type', 'text/html' )
+    self.send_header( 'ETag', etag )
+    self.send_header( 'Content-Length', str( len( body ) ) )
+    self.end_headers()
+    self.wfile.write( body )
+
+  def log_message( self, *args ):
+    pass
+
+class ReplayServer( SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer ):
+  daemon_threads = True
+  allow_reuse_address = True
+
+def start_replay( port=0, delay=0 ):
+  '''
+  Startet den Replay-Server in einem Thread und gibt ihn zurück
+  '''
+  ReplayHandler.delay = delay
+  ReplayHandler.fallback = index_file( load_corpus()['date'] )
+  server = ReplayServer( ('127.0.0.1', port), ReplayHandler )
+  thread = threading.Thread( target=server.serve_forever, name='Replay' )
+  thread.daemon = True
+  thread.start()
+  return server
+
+################################################################################
+#
+# Messungen
+#
+################################################################################
+
+def percentile( values, q ):
+  values = sorted( values )
+  return values[ min( len( values ) - 1, int( len( values ) * q ) ) ]
+
+def measure( f, args_list, repeat=7 ):
+  '''
+  Mittlere Dauer eines Aufrufs f( args ) in ms, das Minimum aus repeat
+  Durchgängen über alle args in args_list, weil alles darüber Störungen durch
+  andere Prozesse sind. args_list ist eine Funktion, weil manche Eingaben
+  (Soups) beim Messen verbraucht werden.
+  '''
+  times = []
+  for i in range( repeat ):
+    args = args_list()
+    start = time.time()
+    for a in args:
+      f( a )
+    times.append( ( time.time() - start ) * 1000 / len( args ) )
+  return min( times )
+
+def result( value, unit, better='lower' ):
+  return dict( value=round( value, 3 ), unit=unit, better=better )
+
+def fresh_http_cache():
+  '''
+  Ein leerer HTTP-Cache in einem temporären Verzeichnis, damit Messungen
+  nicht vom Cache unter ~/.cache abhängen
+  '''
+  lmd.http_cache = lmd.HttpCache( tempfile.mkdtemp( prefix='lmd-bench-' ) )
+  return lmd.http_cache.dirname
+
+re_body_para = re.compile( r'<p class="(?:Brot|Zwischentitel)">.*?</p>', re.S )
+
+def dossier( html, paragraphs=3000 ):
+  '''
+  Macht aus einem Artikel ein Dossier mit etwa paragraphs Absätzen, indem seine
+  Absätze nach dem ersten wiederholt werden
+  '''
+  paras = re_body_para.findall( html )
+  more = ''.join( paras[ i % len( paras ) ] for i in range( paragraphs - len( paras ) ) )
+  return html.replace( paras[0], paras[0] + more, 1 )
+
+def bench_pages( opts ):
+  '''
+  Parsen und Rendern von Index und Artikeln, ohne HTTP
+  '''
+  corpus = load_corpus()
+  index_html = read( index_file( corpus['date'] ) )
+  articles = [ read( article_file( href ) ) for href in corpus['articles'] ]
+  page = lmd.IndexPage()
+  results = dict(
+    soup_index = result( measure( page.make_soup, lambda : [ index_html ] * 20 ), 'ms' ),
+    soup_article = result( measure( page.make_soup, lambda : articles ), 'ms' ),
+    parse_index = result( measure( lambda soup : lmd.IndexPage().parse( soup ),
+        lambda : [ page.make_soup( index_html ) for i in range( 20 ) ] ), 'ms' ),
+    parse_article = result( measure( lambda soup : lmd.ArticlePage().parse( soup ),
+        lambda : map( page.make_soup, articles ) ), 'ms' ) )
+  # Lange Dossiers zeigen, ob parse() mit der Zahl der Absätze linear wächst
+  long_html = dossier( articles[0] )
+  results.update(
+    parse_dossier = result( measure( lambda soup : lmd.ArticlePage().parse( soup ),
+        lambda : [ page.make_soup( long_html ) ], repeat=3 ), 'ms' ) )
+  index = lmd.IndexPage()
+  index.parse( index.make_soup( index_html ) )
+  parsed = []
+  for html in articles:
+    article = lmd.ArticlePage()
+    article.parse( article.make_soup( html ) )
+    article.dic.update( issues=[], current=index.get_content(), next='', home='/' )
+    parsed.append( article )
+  feed = lmd.IndexPage( template_name='%s/rss.xml' % lmd.dirname_templates )
+  feed.parse( feed.make_soup( index_html ) )
+  feed.dic.update( logo='/logo.png', pubdate=lmd.http_date( dt.datetime( 2016, 5, 12 ) ) )
+  feed.dic.update( builtdate=feed.dic['pubdate'] )
+  results.update(
+    render_index = result( measure( lambda page : page.render_template( **page.dic ), lambda : [ index ] * 20 ), 'ms' ),
+    render_rss = result( measure( lambda page : page.render_template( **page.dic ), lambda : [ feed ] * 20 ), 'ms' ),
+    render_article = result( measure( lambda page : page.render_template( **page.dic ), lambda : parsed ), 'ms' ) )
+  return results
+
+def bench_make_paper( opts ):
+  '''
+  Die ganze Ausgabe über den Replay-Server, mit leerem und mit gefülltem Cache
+  '''
+  corpus = load_corpus()
+  cold, warm = [], []
+  for i in range( 3 ):
+    dirname = fresh_http_cache()
+    try:
+      start = time.time()
+      lmd.make_paper( None, corpus['date'], True, opts['jobs'] )
+      cold.append( time.time() - start )
+      start = time.time()
+      lmd.make_paper( None, corpus['date'], True, opts['jobs'] )
+      warm.append( time.time() - start )
+    finally:
+      shutil.rmtree( dirname )
+  return dict(
+    make_paper_cold = result( min( cold ) * 1000, 'ms' ),
+    make_paper_warm = result( min( warm ) * 1000, 'ms' ) )
+
+def load( base, paths, clients, requests ):
+  '''
+  Fragt paths reihum von clients gleichzeitigen Clients ab, insgesamt
+  requests mal. Gibt Durchsatz und Latenzen in ms zurück.
+  '''
+  u = urlparse( base )
+  latencies, errors = [], []
+
+  def client( n ):
+    conn = httplib.HTTPConnection( u.hostname, u.port, timeout=30 )
+    for i in range( n, requests, clients ):
+      start = time.time()
+      try:
+        conn.request( 'GET', paths[ i % len( paths ) ], headers={'Accept-Encoding': 'gzip'} )
+        response = conn.getresponse()
+        response.read()
+        if response.status != 200:
+          errors.append( response.status )
+      except (IOError, httplib.HTTPException) as e:
+        errors.append( e )
+        conn.close()
+        conn = httplib.HTTPConnection( u.hostname, u.port, timeout=30 )
+      latencies.append( ( time.time() - start ) * 1000 )
+    conn.close()
+
+  pool = ThreadPool( clients )
+  start = time.time()
+  try:
+    pool.map( client, range( clients ) )
+  finally:
+    pool.close()
+    pool.join()
+  elapsed = time.time() - start
+  if errors:
+    log.error( "%d of %d requests failed: %s", len( errors ), requests, errors[:3] )
+  return len( latencies ) / elapsed, latencies, len( errors )
+
+def bench_routes( opts ):
+  '''
+  Durchsatz und Latenzen der Routen bei gleichzeitigen Clients, einmal mit
+  und einmal ohne render_cache
+  '''
+  from werkzeug.serving import make_server
+  logging.getLogger('werkzeug').setLevel( logging.ERROR )
+  corpus = load_corpus()
+  paths = [ '/%s' % corpus['date'], '/rss/%s' % corpus['date'] ] + [ '/' + href for href in corpus['articles'] ]
+  results = dict()
+  dirname = fresh_http_cache()
+  try:
+    for name, entries in ( ('cached', 512), ('uncached', 0) ):
+      app = lmd.create_app( 'memory', entries, 64, 0 )
+      server = make_server( '127.0.0.1', 0, app, threaded=True )
+      thread = threading.Thread( target=server.serve_forever, name='App' )
+      thread.daemon = True
+      thread.start()
+      base = 'http://127.0.0.1:%d' % server.server_port
+      try:
+        # Einmal alles holen, damit store und HTTP-Cache gefüllt sind
+        load( base, paths, 1, len( paths ) )
+        # Der beste von drei Durchgängen, wie bei measure()
+        throughput, latencies, errors = max( load( base, paths, opts['clients'], opts['requests'] ) for i in range( 3 ) )
+      finally:
+        server.shutdown()
+      results.update( {
+        'routes_%s_throughput' % name: result( throughput, 'req/s', 'higher' ),
+        'routes_%s_p50' % name: result( percentile( latencies, 0.5 ), 'ms' ),
+        'routes_%s_p90' % name: result( percentile( latencies, 0.9 ), 'ms' ),
+        'routes_%s_p99' % name: result( percentile( latencies, 0.99 ), 'ms' ),
+        'routes_%s_errors' % name: result( errors, 'req' ) } )
+  finally:
+    shutil.rmtree( dirname )
+  return results
+
+def deep_size( obj, seen ):
+  '''
+  Speicherbedarf von obj samt allem, was es enthält, in Bytes. Was mehrfach
+  vorkommt, etwa internierte Strings, zählt nur einmal.
+  '''
+  if id( obj ) in seen:
+    return 0
+  seen.add( id( obj ) )
+  size = sys.getsizeof( obj )
+  if isinstance( obj, dict ):
+    size += sum( deep_size( k, seen ) + deep_size( v, seen ) for k, v in obj.iteritems() )
+  elif isinstance( obj, (list, tuple, set) ):
+    size += sum( deep_size( v, seen ) for v in obj )
+  elif hasattr( obj, '__slots__' ):
+    size += sum( deep_size( getattr( obj, name, None ), seen ) for name in obj.__slots__ )
+  elif hasattr( obj, '__dict__' ):
+    size += deep_size( obj.__dict__, seen )
+  return size
+
+def current_rss():
+  '''
+  Der aktuelle, nicht der höchste Speicherverbrauch in Bytes (nur Linux)
+  '''
+  with open( '/proc/self/statm' ) as f:
+    return int( f.read().split()[1] ) * resource.getpagesize()
+
+def bench_memory( opts ):
+  '''
+  Speicher je Ausgabe, wenn die App die letzten zwölf Ausgaben samt Feeds im
+  store und im render_cache hält
+  '''
+  corpus = load_corpus()
+  y, m, d = map( int, corpus['date'].split('-') )
+  dates = [ issue.strftime('%Y-%m-%d') for issue in lmd.get_issue_list( m, y ) ]
+  dirname = fresh_http_cache()
+  try:
+    app = lmd.create_app( 'memory', 512, 64, 0 )
+    client = app.test_client()
+    # Module und Templates laden, bevor gemessen wird
+    lmd.IndexPage().make( '%s/archiv-text?text=%s' % ( lmd.upstream_url, corpus['date'] ) )
+    gc.collect()
+    before = current_rss()
+    for date in dates:
+      for path in ( '/%s' % date, '/rss/%s' % date ):
+        client.get( path, buffered=True )
+    gc.collect()
+    rss = current_rss() - before
+  finally:
+    shutil.rmtree( dirname )
+  return dict(
+    memory_store_per_issue = result( deep_size( app.store.issues, set() ) / 1024.0 / len( dates ), 'KB' ),
+    memory_render_cache_per_issue = result( app.render_cache.size / 1024.0 / len( dates ), 'KB' ),
+    memory_rss_per_issue = result( rss / 1024.0 / len( dates ), 'KB' ) )
+
+benchmarks = [ ('pages', bench_pages), ('make_paper', bench_make_paper), ('routes', bench_routes), ('memory', bench_memory) ]
+
+def run_isolated( job ):
+  '''
+  Führt eine Gruppe von Messungen aus, gedacht für einen frischen Prozess.
+  Gibt die Ergebnisse einschließlich des Spitzenverbrauchs an Speicher zurück.
+  '''
+  name, opts = job
+  lmd.upstream_url = opts['upstream']
+  results = dict( benchmarks )[name]( opts )
+  # ru_maxrss ist unter Linux in KB angegeben
+  results['peak_rss_%s' % name] = result( resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss / 1024.0, 'MB' )
+  return results
+
+def run( opts ):
+  '''
+  Führt alle Gruppen runs mal aus, jede in einem frischen Prozess. Jeder Wert
+  ist der Median der Durchgänge, ein einzelner gestörter zählt also nicht.
+  '''
+  corpus = load_corpus()
+  server = start_replay( delay=opts['delay'] )
+  opts['upstream'] = 'http://127.0.0.1:%d' % server.server_port
+  runs = []
+  try:
+    for i in range( opts['runs'] ):
+      results = dict()
+      for name, f in benchmarks:
+        pool = Pool( 1 )
+        try:
+          results.update( pool.apply( run_isolated, ( (name, opts), ) ) )
+        finally:
+          pool.close()
+          pool.join()
+      runs.append( results )
+  finally:
+    server.shutdown()
+  results = dict( ( name, dict( r, value=percentile( [ each[name]['value'] for each in runs ], 0.5 ) ) )
+      for name, r in runs[0].items() )
+  return dict( corpus=corpus['digest'], synthetic=corpus['synthetic'], results=results )
+
+# Unterschiede unterhalb dieser Werte je Einheit sind Rauschen und zählen bei
+# --check nie als schlechter, egal wie groß sie relativ sind. Sonst schlagen
+# Messungen um 0.1 ms schon bei ein paar Mikrosekunden Jitter an.
+noise_floor = dict( ms=0.1, KB=4, MB=1 )
+
+def compare( run, baseline, tolerance ):
+  '''
+  Gibt die Ergebnisse neben der Basis aus und die Namen aller Werte zurück,
+  die um mehr als tolerance und mehr als ihren noise_floor schlechter sind
+  '''
+  regressions = []
+  base = baseline['results'] if baseline else {}
+  print '%-30s %16s %10s %8s' % ( 'Messung', 'Wert', 'Basis', 'Änderung' )
+  for name in sorted( run['results'] ):
+    r = run['results'][name]
+    b = base.get( name )
+    change = ''
+    if b and b['value']:
+      ratio = float( r['value'] ) / b['value'] - 1
+      change = '%+.0f%%' % ( ratio * 100 )
+      worse = ( ratio if r['better'] == 'lower' else -ratio ) > tolerance and \
+          abs( r['value'] - b['value'] ) >= noise_floor.get( r['unit'], 0 )
+    else:
+      # Gegenüber 0 gibt es kein Verhältnis, etwa bei den Fehlern
+      worse = b is not None and r['better'] == 'lower' and r['value'] > b['value']
+    if worse:
+      regressions.append( name )
+      change += ' !'
+    print '%-30s %10.2f %-5s %10s %8s' % ( name, r['value'], r['unit'], '%.2f' % b['value'] if b else '-', change )
+  return regressions
+
+################################################################################
+#
+# Prüfungen
+#
+################################################################################
+
+def get( base, path ):
+  '''
+  Holt path vom Server base, gibt (Status, Inhalt) zurück
+  '''
+  u = urlparse( base )
+  conn = httplib.HTTPConnection( u.hostname, u.port, timeout=30 )
+  try:
+    conn.request( 'GET', path )
+    response = conn.getresponse()
+    return response.status, response.read()
+  finally:
+    conn.close()
+
+@contextmanager
+def app_server( app ):
+  '''
+  Startet app in einem Thread, gibt die Basis-URL zurück
+  '''
+  from werkzeug.serving import make_server
+  logging.getLogger('werkzeug').setLevel( logging.ERROR )
+  server = make_server( '127.0.0.1', 0, app, threaded=True )
+  thread = threading.Thread( target=server.serve_forever, name='App' )
+  thread.daemon = True
+  thread.start()
+  try:
+    yield 'http://127.0.0.1:%d' % server.server_port
+  finally:
+    server.shutdown()
+
+def check_single_flight( opts ):
+  '''
+  Gleichzeitige Anfragen nach demselben, noch nicht gerenderten Artikel holen
+  und parsen ihn nur einmal, gepuffert wie gestreamt
+  '''
+  corpus = load_corpus()
+  errors = []
+  # Langsam genug, dass alle Anfragen während des ersten Abrufs ankommen
+  delay, ReplayHandler.delay = ReplayHandler.delay, 0.2
+  try:
+    for stream in ( False, True ):
+      dirname = fresh_http_cache()
+      try:
+        with app_server( lmd.create_app( 'memory', 512, 64, 0, stream=stream ) ) as base:
+          get( base, '/%s' % corpus['date'] )
+          path = '/' + corpus['articles'][0]
+          before = lmd.metrics.snapshot().get( 'fetch', [0] )[0]
+          pool = ThreadPool( 8 )
+          try:
+            responses = pool.map( lambda i : get( base, path ), range( 8 ) )
+          finally:
+            pool.close()
+            pool.join()
+          fetches = lmd.metrics.snapshot()['fetch'][0] - before
+      finally:
+        shutil.rmtree( dirname )
+      mode = 'stream' if stream else 'gepuffert'
+      if fetches != 1:
+        errors.append( '%s: %d Abrufe von %s statt einem' % ( mode, fetches, path ) )
+      if set( status for status, body in responses ) != set( [200] ) or len( set( body for status, body in responses ) ) != 1:
+        errors.append( '%s: unterschiedliche Antworten auf %s' % ( mode, path ) )
+  finally:
+    ReplayHandler.delay = delay
+  return errors
+
+ns_opf = 'http://www.idpf.org/2007/opf'
+re_entity = re.compile( r'&#?\w+;' )
+
+def check_epub( opts ):
+  '''
+  Jede Seite im epub ist wohlgeformtes XHTML, alles, worauf sie per href oder
+  src verweist, liegt im Container und steht im Manifest, und die Titel im
+  Inhaltsverzeichnis enthalten keine Entities
+  '''
+  corpus = load_corpus()
+  errors = []
+  dirname = fresh_http_cache()
+  fname = p.join( dirname, 'lmd.epub' )
+  try:
+    lmd.make_epub( fname, dt.date( *map( int, corpus['date'].split('-') ) ) )
+    book = zipfile.ZipFile( fname )
+    names = set( book.namelist() )
+    opf = ElementTree.fromstring( book.read( 'content.opf' ) )
+    manifest = dict( ( unquote( item.get('href') ), item.get('id') ) for item in opf.iter( '{%s}item' % ns_opf ) )
+    spine = [ item.get('idref') for item in opf.iter( '{%s}itemref' % ns_opf ) ]
+    pages = [ href for href, id in manifest.items() if id in spine ]
+    if len( pages ) != len( corpus['articles'] ) + 1:
+      errors.append( '%d Seiten in der Lesereihenfolge statt %d' % ( len( pages ), len( corpus['articles'] ) + 1 ) )
+    for page in pages:
+      try:
+        tree = ElementTree.fromstring( book.read( page ) )
+      except ElementTree.ParseError as e:
+        errors.append( '%s: %s' % ( page, e ) )
+        continue
+      for element in tree.iter():
+        ref = element.get('href') or element.get('src')
+        if not ref or urlparse( ref ).scheme or ref.startswith('#'):
+          continue
+        target = p.normpath( p.join( p.dirname( page ), unquote( ref.split('#')[0] ) ) )
+        if target not in names or target not in manifest:
+          errors.append( '%s: %s fehlt' % ( page, ref ) )
+    # Die Titel im Inhaltsverzeichnis sind Text, keine Entities mehr
+    for name in ( 'nav.xhtml', 'toc.ncx' ):
+      text = u''.join( ElementTree.fromstring( book.read( name ) ).itertext() )
+      if re_entity.search( text ):
+        errors.append( '%s: %s' % ( name, re_entity.search( text ).group() ) )
+  finally:
+    shutil.rmtree( dirname )
+  return errors
+
+def parsed_with( cls, parser, html ):
+  '''
+  Die Wertepaare, die cls aus html mit dem Parser parser gewinnt, als JSON
+  '''
+  page = cls()
+  page.parser = parser
+  page.parse( page.make_soup( html ) )
+  return json.dumps( page.get_content(), default=lmd.Record.as_dict, sort_keys=True )
+
+def check_parsers( opts ):
+  '''
+  Der Parser content, der nur div#content parsed, liefert für Index und
+  Artikel dieselben Wertepaare wie bs3 mit der ganzen Seite
+  '''
+  corpus = load_corpus()
+  pages = [ ( lmd.IndexPage, index_file( corpus['date'] ) ) ]
+  pages += [ ( lmd.ArticlePage, article_file( href ) ) for href in corpus['articles'] ]
+  errors = []
+  for cls, fname in pages:
+    html = read( fname )
+    if parsed_with( cls, 'content', html ) != parsed_with( cls, 'bs3', html ):
+      errors.append( '%s: content und bs3 unterscheiden sich' % p.relpath( fname, dirname_corpus ) )
+  return errors
+
+def legacy_parse_article( soup ):
+  '''
+  ArticlePage.parse() vor dem Umbau auf einen Durchgang mit find_content() und
+  rename_attrs(), als Maßstab für check_parse_identity()
+  '''
+  args = dict(charset='utf8')
+  c = soup.find('div',{'id':'content'})
+  args.update(teaser=c.find('p',{'class':'Unterzeile'}).string if c.find('p',{'class':'Unterzeile'}) else '' )
+  args.update(title=c.find('p',{'class':'Titel'}).string)
+  args.update(author=c.find('p',{'class':'Korrespondent'}).string if c.find('p',{'class':'Korrespondent'}) else '' )
+  args.update(initial=c.find('p',{'class':'Initial'}).renderContents() if c.find('p',{'class':'Initial'}) else '')
+  p_list=c.findAll('p')
+  f_list=filter(lambda p:p['class']=='Fussnote' if p.has_key('class') else False,p_list)
+  footnotes = ''
+  for f in f_list: footnotes+=str(f)
+  footnotes=footnotes.replace('\"Fussnote','\"c-image__caption')
+  args.update(footnotes=footnotes)
+  c_list=filter(lambda p:p['class']=='Brot' or p['class']=='BrotO' or p['class']=='Zwischentitel' if p.has_key('class') else False,p_list)
+  first = c_list.pop(0).renderContents()
+  args.update(first_letter = first[0])
+  re_first_word=re.compile('[\wüÜöÖäÄß-]*')
+  match = re_first_word.match(first[1:])
+  args.update(chunk = match.group())
+  args.update(first = first[1+match.end():])
+  content=''
+  for c in c_list: content+=str(c)
+  content = content.replace('\"Brot\"','\"c-article-body\"').replace('\"BrotO\"','\"c-article-body\"').replace('\"Zwischentitel\"','\"c-article-body__subheadline\"')
+  args.update(content=content)
+  return args
+
+def check_parse_identity( opts ):
+  '''
+  ArticlePage.parse() liefert für alle Artikel und ein langes Dossier dieselben
+  Wertepaare wie legacy_parse_article()
+  '''
+  corpus = load_corpus()
+  pages = [ ( href, read( article_file( href ) ) ) for href in corpus['articles'] ]
+  pages.append( ( 'dossier', dossier( pages[0][1] ) ) )
+  errors = []
+  for name, html in pages:
+    article = lmd.ArticlePage()
+    article.parse( article.make_soup( html ) )
+    new = article.get_content()
+    old = legacy_parse_article( article.make_soup( html ) )
+    differ = [ k for k in sorted( old ) if ( old[k] is None ) != ( new.get( k ) is None ) or
+        old[k] is not None and unicode( old[k] ) != unicode( new[k] ) ]
+    if differ:
+      errors.append( '%s: %s unterscheiden sich' % ( name, ', '.join( differ ) ) )
+  return errors
+
+def check_intern( opts ):
+  '''
+  intern_text() gibt für gleiche Texte dasselbe Objekt zurück, hält aber nie
+  mehr als interned_size davon fest
+  '''
+  errors = []
+  first = lmd.intern_text( u'Gr\xe9goire Cha' + u'mayou' )
+  if lmd.intern_text( u'Gr\xe9goire Chamayou' ) is not first:
+    errors.append( 'gleiche Texte nicht geteilt' )
+  for i in range( lmd.interned_size * 2 ):
+    lmd.intern_text( u'Autor %d' % i )
+  if len( lmd.interned ) > lmd.interned_size:
+    errors.append( '%d Texte festgehalten statt höchstens %d' % ( len( lmd.interned ), lmd.interned_size ) )
+  return errors
+
+def check_invalidate( opts ):
+  '''
+  /admin/invalidate verlangt das admin_token und leert den render_cache aller
+  Prozesse, die sich einen SqliteStore teilen. Zwei Apps stehen hier für zwei
+  gunicorn-Worker. create_app() hängt dabei keine Log-Dateien an.
+  '''
+  corpus = load_corpus()
+  errors = []
+  dirname = fresh_http_cache()
+  try:
+    state = 'sqlite:%s' % p.join( dirname, 'state.db' )
+    workers = [ lmd.create_app( state, 512, 64, 0, admin_token='geheim' ) for i in range( 2 ) ]
+    path = '/%s' % corpus['date']
+    for i, app in enumerate( workers ):
+      if app.test_client().get( path, buffered=True ).status_code != 200 or path not in app.render_cache.entries:
+        errors.append( 'Worker %d hat %s nicht gerendert' % ( i, path ) )
+    if any( isinstance( handler, logging.FileHandler ) for handler in workers[0].logger.handlers ):
+      errors.append( 'create_app() schreibt nach %s' % workers[0].logger.handlers[-1].baseFilename )
+    client = workers[0].test_client()
+    for headers in ( {}, { 'X-Admin-Token': 'falsch' } ):
+      status = client.post( '/admin/invalidate', data=dict( key=path ), headers=headers ).status_code
+      if status != 403:
+        errors.append( 'ohne gültiges Token %d statt 403' % status )
+    status = client.post( '/admin/invalidate', data=dict( key=path ), headers={ 'X-Admin-Token': 'geheim' } ).status_code
+    if status != 200:
+      errors.append( 'mit Token %d statt 200' % status )
+    for i, app in enumerate( workers ):
+      app.test_client().get( '/metrics' )
+      if path in app.render_cache.entries:
+        errors.append( 'Worker %d hat %s noch im render_cache' % ( i, path ) )
+  finally:
+    shutil.rmtree( dirname )
+  return errors
+
+def warmer_status( app ):
+  return json.loads( app.test_client().get( '/admin/warmer' ).data )
+
+def check_warmer( opts ):
+  '''
+  Von zwei Apps mit demselben SqliteStore wärmt nur eine vor, die andere
+  wartet. Die Sperre dafür lässt sich erst nach ihrem Ablauf übernehmen.
+  '''
+  errors = []
+  dirname = fresh_http_cache()
+  try:
+    state = 'sqlite:%s' % p.join( dirname, 'state.db' )
+    store = lmd.make_store( state )
+    if not store.lease( 'probe', 'a', 0.2 ) or store.lease( 'probe', 'b', 0.2 ):
+      errors.append( 'Sperre nicht exklusiv' )
+    time.sleep( 0.3 )
+    if not store.lease( 'probe', 'b', 0.2 ):
+      errors.append( 'abgelaufene Sperre nicht übernommen' )
+    workers = [ lmd.create_app( state, 512, 64, 2 ) for i in range( 2 ) ]
+    deadline = time.time() + 300
+    while time.time() < deadline:
+      states = sorted( warmer_status( app )['state'] for app in workers )
+      if 'waiting' in states:
+        break
+      time.sleep( 0.5 )
+    if states != [ 'standby', 'waiting' ]:
+      errors.append( 'Zustände der Warmer %s statt standby und waiting' % ', '.join( states ) )
+    pages = sorted( warmer_status( app )['pages_done'] for app in workers )
+    if pages[0] != 0:
+      errors.append( 'beide Warmer haben Seiten geholt: %s' % pages )
+  finally:
+    shutil.rmtree( dirname )
+  return errors
+
+def check_calendar( opts ):
+  '''
+  Ein issue_calendar, dessen Ende schon vorbei ist, wie in einem Prozess, der
+  über den Jahreswechsel läuft, rechnet weiter wie ein neuer, die Routen
+  darauf antworten. /issues legt für Seiten hinter der letzten und unbekannte
+  Jahre nichts im render_cache ab, Ausgaben und Feeds nichts für Tage ohne
+  erschienene Ausgabe.
+  '''
+  errors = []
+  fresh = lmd.IssueCalendar()
+  stale = lmd.IssueCalendar( end=( 2016, 12 ) )
+  calendar, lmd.issue_calendar = lmd.issue_calendar, stale
+  try:
+    if stale.published() != fresh.published():
+      errors.append( 'published() weicht nach dem Jahreswechsel ab' )
+    if stale.entries != fresh.entries[ :len( stale.entries ) ]:
+      errors.append( 'Einträge weichen nach dem Jahreswechsel ab' )
+    # Bis März 2014 freitags, seitdem donnerstags, immer zwischen dem 7. und 13.
+    for issue in fresh.dates:
+      weekday = 3 if ( issue.year, issue.month ) >= ( 2014, 4 ) else 4
+      if issue.weekday() != weekday or not 7 <= issue.day <= 13:
+        errors.append( 'Ausgabe am %s (%s)' % ( issue, issue.strftime('%A') ) )
+    # Ein aufgezeichneter Korpus stammt von einer echten Ausgabe
+    if fresh.find( load_corpus()['date'] ) is None:
+      errors.append( 'keine Ausgabe am %s' % load_corpus()['date'] )
+    app = lmd.create_app( 'memory', 512, 64, 0 )
+    client = app.test_client()
+    year = lmd.get_current_issue_date().year
+    for path in ( '/', '/archiv/%d' % year, '/issues', '/issues?year=%d' % year ):
+      status = client.get( path, buffered=True ).status_code
+      if status != 200:
+        errors.append( '%s: %d statt 200' % ( path, status ) )
+    per_page = json.loads( client.get( '/issues?per_page=100000' ).data )['per_page']
+    if per_page != 120:
+      errors.append( 'per_page %d statt höchstens 120' % per_page )
+    entries = len( app.render_cache.entries )
+    for path in ( '/issues?page=100000', '/issues?year=1900', '/issues?year=%d&page=3' % year,
+        '/issues/0001-01-01', '/issues/1995-05-01', '/issues/kein-datum' ):
+      status = client.get( path ).status_code
+      if status != 404:
+        errors.append( '%s: %d statt 404' % ( path, status ) )
+    next_issue = lmd.issue_calendar.dates[ lmd.issue_calendar.find( lmd.get_current_issue_date() ) + 1 ]
+    for path in ( '/junk1', '/rss/junk2', '/2016-05-13', '/%s' % next_issue, '/rss/%s' % next_issue ):
+      status = client.get( path ).status_code
+      if status != 404:
+        errors.append( '%s: %d statt 404' % ( path, status ) )
+    if len( app.render_cache.entries ) != entries or app.store.get_issue( 'junk1' ):
+      errors.append( 'ungültige Anfragen landen im render_cache oder store' )
+  finally:
+    lmd.issue_calendar = calendar
+  return errors
+
+class ClosingHandler( BaseHTTPServer.BaseHTTPRequestHandler ):
+  '''
+  Antwortet mit keep-alive, schließt die Verbindung danach aber doch, wie ein
+  Server, dessen Timeout für ruhende Verbindungen abgelaufen ist
+  '''
+  protocol_version = 'HTTP/1.1'
+
+  def do_GET( self ):
+    self.send_response( 200 )
+    self.send_header( 'Content-Length', '2' )
+    self.end_headers()
+    self.wfile.write( 'ok' )
+    self.close_connection = 1
+
+  def log_message( self, *args ):
+    pass
+
+def check_keep_alive( opts ):
+  '''
+  Hat der Server eine Verbindung aus dem Pool geschlossen, holt der HttpClient
+  die Seite gleich über eine neue, ohne Wartezeit und ohne dass es als
+  Fehlschlag für den circuit breaker zählt
+  '''
+  errors = []
+  server = ReplayServer( ('127.0.0.1', 0), ClosingHandler )
+  thread = threading.Thread( target=server.serve_forever, name='Closing' )
+  thread.daemon = True
+  thread.start()
+  try:
+    client = lmd.HttpClient( retries=0, max_failures=1 )
+    url = 'http://127.0.0.1:%d/' % server.server_port
+    for i in range( 3 ):
+      try:
+        client.request( url )
+      except IOError as e:
+        errors.append( 'Anfrage %d: %s' % ( i + 1, e ) )
+    if client.failures or client.open_until:
+      errors.append( 'geschlossene Verbindungen zählen als Fehlschlag' )
+  finally:
+    server.shutdown()
+  return errors
+
+re_local_ref = re.compile( r'''(?:href|src)="(/[^"#?]*)''' )
+
+def check_export( opts ):
+  '''
+  Alles, worauf die mit export_site() geschriebene Index-Seite der Ausgabe
+  verweist (CSS, Logo, Artikel), liegt auch in der exportierten Site
+  '''
+  corpus = load_corpus()
+  errors = []
+  dirname = fresh_http_cache()
+  target = p.join( dirname, 'site' )
+  try:
+    app = lmd.create_app( 'memory', 512, 64, 0 )
+    lmd.export_site( app, target, [ dt.date( *map( int, corpus['date'].split('-') ) ) ], jobs=4 )
+    html = read( p.join( target, corpus['date'] ) )
+    for ref in sorted( set( re_local_ref.findall( html ) ) ):
+      fname = p.join( target, unquote( ref ).lstrip('/') )
+      if not p.isfile( fname ) and not p.isfile( p.join( fname, 'index.html' ) ):
+        errors.append( '%s fehlt' % ref )
+  finally:
+    shutil.rmtree( dirname )
+  return errors
+
+def check_search_index( opts ):
+  '''
+  update_search_index() liest und zerlegt nur Artikel, deren Seite sich im
+  Archiv geändert hat, und schreibt search.idx nur dann neu
+  '''
+  corpus = load_corpus()
+  errors = []
+  dirname = fresh_http_cache()
+  saved = lmd.archive
+  try:
+    archive = lmd.open_archive( p.join( dirname, 'archive.db' ) )
+    lmd.sync_archive( [ dt.date( *map( int, corpus['date'].split('-') ) ) ], 4 )
+    first = lmd.update_search_index()
+    if first['added'] != len( corpus['articles'] ):
+      errors.append( '%d Artikel indiziert statt %d' % ( first['added'], len( corpus['articles'] ) ) )
+    fname = lmd.search_index_name()
+    mtime = os.stat( fname ).st_mtime
+    time.sleep( 0.05 )
+    before = lmd.metrics.snapshot().get( 'fetch', [0] )[0]
+    again = lmd.update_search_index()
+    fetches = lmd.metrics.snapshot().get( 'fetch', [0] )[0] - before
+    if fetches or again['unchanged'] != first['added'] or os.stat( fname ).st_mtime != mtime:
+      errors.append( 'unveränderter Lauf: %d Seiten gelesen, %s, search.idx %s' % ( fetches, again,
+          'neu geschrieben' if os.stat( fname ).st_mtime != mtime else 'unverändert' ) )
+    key = corpus['articles'][0].lstrip('/')
+    raw = archive.get( key ).replace( '<p class="Brot">', '<p class="Brot">Zusatz ', 1 )
+    archive.put( key, raw, corpus['date'] )
+    changed = lmd.update_search_index()
+    if changed['updated'] != 1 or changed['unchanged'] != first['added'] - 1 or os.stat( fname ).st_mtime == mtime:
+      errors.append( 'nach einer Änderung: %s' % changed )
+  finally:
+    lmd.archive = saved
+    shutil.rmtree( dirname )
+  return errors
+
+def write_cache_entries( dirname ):
+  '''
+  Schreibt im Prozess-Pool immer wieder denselben Eintrag in den http_cache
+  dirname, gibt die Fehler dabei zurück
+  '''
+  cache = lmd.HttpCache( dirname )
+  try:
+    for i in range( 200 ):
+      cache.write( 'gleich', str( os.getpid() ) * 1000, dict( pid=os.getpid(), i=i ) )
+  except Exception as e:
+    return '%s: %s' % ( e.__class__.__name__, e )
+
+def check_http_cache( opts ):
+  '''
+  Mehrere Prozesse können denselben Eintrag gleichzeitig schreiben, ohne dass
+  halbe Dateien oder Reste übrig bleiben. Löscht ein anderer Prozess einen
+  Eintrag, gilt er als nicht im Cache. Nur die Artikel der aktuellen Ausgabe
+  haben die kurze Lebensdauer.
+  '''
+  corpus = load_corpus()
+  errors = []
+  dirname = fresh_http_cache()
+  try:
+    pool = Pool( 4 )
+    try:
+      errors += filter( None, pool.map( write_cache_entries, [ dirname ] * 4 ) )
+    finally:
+      pool.close()
+      pool.join()
+    with open( lmd.http_cache.path( 'gleich', '.json' ) ) as f:
+      json.load( f )
+    if read( lmd.http_cache.path( 'gleich', '.body' ) ).strip( '0123456789' ):
+      errors.append( 'Inhalt zerstückelt' )
+    if sorted( os.listdir( dirname ) ) != [ 'gleich.body', 'gleich.json' ]:
+      errors.append( 'Reste im Cache: %s' % ', '.join( sorted( os.listdir( dirname ) ) ) )
+    url = lmd.upstream_url + '/archiv-text?text=%s' % corpus['date']
+    key = sha1( url ).hexdigest()
+    lmd.http_cache.get( url )
+    for ext in ('.body', '.json'):
+      os.remove( lmd.http_cache.path( key, ext ) )
+    if lmd.http_cache.touch( key ) or key in lmd.http_cache.entries:
+      errors.append( 'gelöschter Eintrag gilt noch als im Cache' )
+    # Erscheint eine neue Ausgabe, gelten die Artikel der alten als archiviert
+    cache = lmd.HttpCache( dirname )
+    current = lmd.get_current_issue_date()
+    following = lmd.issue_calendar.dates[ lmd.issue_calendar.find( current ) + 1 ]
+    old, new = lmd.upstream_url + '/artikel/!1', lmd.upstream_url + '/artikel/!2'
+    cache.mark_current( current.strftime('%Y-%m-%d'), [ 'artikel/!1' ] )
+    if cache.ttl_for( old ) != cache.ttl_current:
+      errors.append( 'Artikel der aktuellen Ausgabe mit langer Lebensdauer' )
+    get_current, lmd.get_current_issue_date = lmd.get_current_issue_date, lambda : following
+    try:
+      if cache.ttl_for( old ) != cache.ttl_archive:
+        errors.append( 'Artikel der vorigen Ausgabe noch mit kurzer Lebensdauer' )
+      cache.mark_current( following.strftime('%Y-%m-%d'), [ 'artikel/!2' ] )
+      if cache.ttl_for( new ) != cache.ttl_current or len( cache.current ) != 1:
+        errors.append( 'Artikel früherer Ausgaben nicht vergessen' )
+    finally:
+      lmd.get_current_issue_date = get_current
+  finally:
+    shutil.rmtree( dirname )
+  return errors
+
+def expire_cached( url, body=None ):
+  '''
+  Lässt den Eintrag von url im http_cache ablaufen und vergisst sein ETag,
+  damit der Server die Seite ganz schickt. body ersetzt den Inhalt im Cache.
+  '''
+  key = sha1( url ).hexdigest()
+  with open( lmd.http_cache.path( key, '.json' ) ) as f:
+    meta = json.load( f )
+  meta.update( fetched=0, etag=None )
+  lmd.http_cache.write( key, body or read( lmd.http_cache.path( key, '.body' ) ), meta )
+
+def check_last_modified( opts ):
+  '''
+  Last-Modified einer Ausgabe ist nicht ihr Erscheinungsdatum, sondern der
+  Zeitpunkt, zu dem sich ihre Quelle geändert hat: Kommt sie unverändert
+  wieder, bleibt es bei 304, mit geändertem Inhalt gibt es die neue Seite.
+  '''
+  corpus = load_corpus()
+  errors = []
+  dirname = fresh_http_cache()
+  path = '/%s' % corpus['date']
+  url = lmd.upstream_url + '/archiv-text?text=%s' % corpus['date']
+  def fetch( since=None ):
+    client = lmd.create_app( 'memory', 512, 64, 0 ).test_client()
+    headers = { 'If-Modified-Since': since } if since else {}
+    return client.get( path, headers=headers, buffered=True )
+  try:
+    response = fetch()
+    since = response.headers.get('Last-Modified')
+    if not since or response.last_modified <= lmd.issue_datetime( corpus['date'] ):
+      errors.append( 'Last-Modified %s ist das Erscheinungsdatum' % since )
+      return errors
+    time.sleep( 1.1 )
+    expire_cached( url )
+    response = fetch( since )
+    if response.status_code != 304:
+      errors.append( 'unveränderte Quelle: %d statt 304' % response.status_code )
+    expire_cached( url, read( lmd.http_cache.path( sha1( url ).hexdigest(), '.body' ) ) + '<!-- alt -->' )
+    response = fetch( since )
+    if response.status_code != 200 or response.headers.get('Last-Modified') == since:
+      errors.append( 'geänderte Quelle: %d mit Last-Modified %s' % ( response.status_code, response.headers.get('Last-Modified') ) )
+  finally:
+    shutil.rmtree( dirname )
+  return errors
+
+checks = [ ('single_flight', check_single_flight), ('epub', check_epub), ('parsers', check_parsers),
+  ('parse_identity', check_parse_identity), ('intern', check_intern), ('invalidate', check_invalidate),
+  ('warmer', check_warmer), ('calendar', check_calendar), ('last_modified', check_last_modified),
+  ('keep_alive', check_keep_alive), ('http_cache', check_http_cache),
+  ('export', check_export), ('search_index', check_search_index) ]
+
+def verify( opts ):
+  '''
+  Führt alle Prüfungen gegen den Replay-Server aus und gibt die Anzahl der
+  fehlgeschlagenen zurück
+  '''
+  server = start_replay( delay=opts['delay'] )
+  lmd.upstream_url = 'http://127.0.0.1:%d' % server.server_port
+  failed = 0
+  try:
+    for name, f in checks:
+      try:
+        errors = f( opts )
+      except Exception as e:
+        errors = [ '%s: %s' % ( e.__class__.__name__, e ) ]
+      print '%-30s %s' % ( name, 'FEHLER' if errors else 'ok' )
+      for error in errors:
+        print '  ' + error
+      failed += bool( errors )
+  finally:
+    server.shutdown()
+  return failed
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser( description="Benchmarks für lmd.py mit aufgezeichneten Seiten" )
+  parser.add_argument( "command", choices=['record', 'synth', 'serve', 'run', 'verify'] )
+  parser.add_argument( "-D", "--date", help="record: Datum der Ausgabe JJJJ-MM-TT", default=None )
+  parser.add_argument( "--articles", help="synth: Anzahl der Artikel", type=int, default=30 )
+  parser.add_argument( "-p", "--port", help="serve: Port des Replay-Servers", type=int, default=8765 )
+  parser.add_argument( "--delay", help="Verzögerung jeder abgespielten Seite in Sekunden", type=float, default=0 )
+  parser.add_argument( "-j", "--jobs", help="run: Anzahl gleichzeitig geholter Artikel in make_paper()", type=int, default=8 )
+  parser.add_argument( "--clients", help="run: Anzahl gleichzeitiger Clients für die Routen", type=int, default=8 )
+  parser.add_argument( "--requests", help="run: Anzahl Anfragen je Durchgang", type=int, default=400 )
+  parser.add_argument( "--save", help="run: Ergebnisse als neue Basis speichern", action='store_true' )
+  parser.add_argument( "--check", help="run: mit Status 1 enden, wenn ein Wert schlechter als die Basis ist", action='store_true' )
+  parser.add_argument( "--tolerance", help="run: erlaubte Verschlechterung, 0.25 sind 25%%", type=float, default=0.25 )
+  parser.add_argument( "--runs", help="run: Anzahl Durchgänge, gemessen wird der Median", type=int, default=3 )
+  args = parser.parse_args()
+  logging.basicConfig( format='%(asctime)s[%(name)s]%(levelname)s: %(message)s', level=logging.ERROR )
+
+  if args.command == 'record':
+    record( args.date or lmd.get_current_issue_date().strftime('%Y-%m-%d') )
+  elif args.command == 'synth':
+    synth( args.articles )
+  elif args.command == 'serve':
+    server = start_replay( args.port, args.delay )
+    print "Spiele %s unter http://127.0.0.1:%d ab" % ( dirname_corpus, args.port )
+    try:
+      while True:
+        time.sleep( 3600 )
+    except KeyboardInterrupt:
+      server.shutdown()
+  elif args.command == 'verify':
+    failed = verify( vars( args ) )
+    if failed:
+      sys.exit( "%d Prüfungen fehlgeschlagen" % failed )
+  else:
+    results = run( vars( args ) )
+    baseline = json.loads( read( baseline_name ) ) if p.exists( baseline_name ) else None
+    if baseline and baseline['corpus'] != results['corpus']:
+      print "Die Basis wurde mit einem anderen Korpus gemessen und wird nicht verglichen"
+      baseline = None
+    regressions = compare( results, baseline, args.tolerance )
+    if args.save:
+      write( baseline_name, json.dumps( results, indent=1, sort_keys=True, separators=(',', ': ') ) )
+      print "Neue Basis in %s gespeichert" % baseline_name
+    if args.check:
+      if not baseline:
+        sys.exit( "Keine passende Basis in %s" % baseline_name )
+      if regressions:
+        sys.exit( "Schlechter als die Basis: %s" % ", ".join( regressions ) )
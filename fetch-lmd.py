@@ -1,33 +1,186 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
-import argparse, subprocess as sp,re, shlex, os, sys, os.path as p, tarfile, logging
+import argparse, subprocess as sp,re, shlex, os, sys, os.path as p, tarfile, logging, zipfile, time, cProfile
 from datetime import date
+from multiprocessing import Pool
 from uuid import uuid4
-from lmd import make_paper, get_issue_date, get_current_issue_date
+from lmd import make_paper, make_epub, get_issue_date, get_current_issue_date, get_issue_range, http_cache, http_client, metrics, open_archive, year_month
 
 
 dirname_output      = "epub"            # Unterverzeichnis für die erzeugten epubs
 dirname_ressources  = "epub-ressources" # Das Verzeichnis mit der komprimierten vorgefertigten Struktur
 tarfile_name        = "res.tar.gz"      # Die komprimierte Struktur
-    
+cover_url           = 'https://dl.taz.de/titel/%Y/lmd_%Y_%m_%d.120.jpg' # strftime-Muster
+
+log = logging.getLogger(__name__)
+
+def make_epub_calibre( target, issue_date, is_online, jobs ):
+  '''
+  Erzeugt das epub wie früher über ein temporäres Verzeichnis und
+  ebook-convert aus calibre.
+  '''
+  datestring = issue_date.strftime('%Y-%m-%d')
+
+  # Erzeuge Verzeichnisstruktur für das zu erzeugende epub einschließlich stylesheets etc.
+  dirname = '%s/.%s' % ( p.expanduser('~'), uuid4() )
+  tzip = tarfile.open( '%s/%s' % (dirname_ressources, tarfile_name) )
+  tzip.extractall( dirname )
+  log.debug( "Verzeichnisstruktur für epub in %s erzeugt.", dirname )
+
+  # Hole Seiten und parse in ein für calibre verwertbares Format
+  make_paper( dirname, datestring, is_online, jobs )
+  log.debug( "XHTML-Dateien zur Erzeugung des epub in %s fertiggestellt.", dirname )
+
+  # in ein ebook konvertieren...
+  src = dirname + '/index.html'
+  cover = issue_date.strftime( cover_url )
+  cmd = '/usr/bin/ebook-convert %(src)s %(target)s --cover=%(cover)s --chapter-mark=none --dont-split-on-page-breaks --page-breaks-before "/"'
+  args = shlex.split( cmd % dict( src=src, target=target ,cover=cover ) )
+  process = sp.Popen( args , stdout=sp.PIPE, stderr=sp.STDOUT )
+  log.debug("Erzeuge epub...\n")
+  while process.poll() is None:
+    sys.stdout.write(process.stdout.readline())
+
+  # Aufräumen...
+  for root, dnames, fnames in os.walk( dirname, topdown=False ):
+    for name in fnames:
+      log.debug("removing %s/%s..." % (root, name))
+      os.remove( '%s/%s' % (root, name) )
+    for name in dnames:
+      log.debug("removing %s/%s..." % (root, name))
+      os.rmdir( '%s/%s' % (root, name) )
+  
+  os.rmdir( dirname )
+  log.debug( "Temporäres Verzeichnis %s wieder gelöscht", dirname )
+
+def epub_name( issue_date ):
+  return '%s/lmd%s.epub' % ( dirname_output, issue_date.strftime('%Y%m%d') )
+
+def is_valid_epub( fname ):
+  '''
+  True, wenn fname ein vollständig geschriebenes epub ist
+  '''
+  if not zipfile.is_zipfile( fname ):
+    return False
+  z = zipfile.ZipFile( fname )
+  try:
+    return z.namelist()[:1] == ['mimetype'] and z.read('mimetype') == 'application/epub+zip' \
+        and z.testzip() is None
+  finally:
+    z.close()
+
+def build_issue( job ):
+  '''
+  Erzeugt das epub einer Ausgabe, gedacht für den Prozess-Pool. Gibt ein Tupel
+  (Ausgabedatum, Status, Dauer in Sekunden, Laufzeiten je Schritt) zurück,
+  Status ist 'built', 'skipped' oder 'failed'.
+  job: Tupel (Ausgabedatum, is_online, jobs, backend, profile), bei profile
+       wird ein cProfile nach profile.JJJJ-MM-TT geschrieben
+  '''
+  issue_date, is_online, jobs, backend, profile = job
+  target = epub_name( issue_date )
+  if p.exists( target ) and is_valid_epub( target ):
+    log.debug( "%s existiert bereits, übersprungen", target )
+    return issue_date, 'skipped', 0, {}
+  before = metrics.snapshot()
+  start = time.time()
+  profiler = cProfile.Profile() if profile else None
+  if profiler:
+    profiler.enable()
+  try:
+    if backend == 'calibre':
+      make_epub_calibre( target, issue_date, is_online, jobs )
+    else:
+      # Erst unter anderem Namen, damit ein abgebrochenes epub nicht als fertig gilt
+      make_epub( target + '.part', issue_date, is_online, jobs, issue_date.strftime( cover_url ) )
+      os.rename( target + '.part', target )
+    status = 'built'
+    log.debug( "%s erzeugt", target )
+  except Exception:
+    log.exception( "Ausgabe vom %s fehlgeschlagen", issue_date.strftime('%d.%m.%Y') )
+    status = 'failed'
+  finally:
+    if profiler:
+      profiler.disable()
+      profiler.dump_stats( '%s.%s' % ( profile, issue_date.strftime('%Y-%m-%d') ) )
+  # Nur die Laufzeiten dieser Ausgabe, ein Prozess des Pools baut mehrere
+  stages = dict( ( stage, [ n - before.get( stage, [0, 0] )[0], total - before.get( stage, [0, 0] )[1], longest ] )
+      for stage, ( n, total, longest ) in metrics.snapshot().items() )
+  return issue_date, status, time.time() - start, stages
+
+def build_issues( issues, is_online, jobs, backend, processes, profile=None ):
+  '''
+  Erzeugt die epubs mehrerer Ausgaben parallel in einem Prozess-Pool und gibt
+  eine Zusammenfassung aus.
+  '''
+  start = time.time()
+  pool = Pool( max( 1, min( processes, len( issues ) ) ) )
+  try:
+    results = pool.map( build_issue, [ (issue, is_online, jobs, backend, profile) for issue in issues ], 1 )
+  finally:
+    pool.close()
+    pool.join()
+  elapsed = time.time() - start
+  count = lambda status : len( [ r for r in results if r[1] == status ] )
+  for issue_date, status, seconds, stages in results:
+    metrics.merge( stages )
+    if status == 'failed':
+      print "Fehlgeschlagen: Ausgabe vom %s" % issue_date.strftime('%d.%m.%Y')
+  built = count('built')
+  print "%d Ausgaben erzeugt, %d übersprungen, %d fehlgeschlagen in %.1f s (%.1f Ausgaben/min, %.1f s je Ausgabe)" % (
+      built, count('skipped'), count('failed'), elapsed, built * 60 / elapsed if elapsed else 0,
+      sum( r[2] for r in results if r[1] == 'built' ) / built if built else 0 )
+
 if __name__ == '__main__':
   parser = argparse.ArgumentParser(description="Holt LMD Ausgabe aus Jahr y und Monat m")
-  parser.add_argument("-l", "--fetch_local_files", help="Falls die Ressourcen lokal vorhanden sind", action='store_true')
+  parser.add_argument("-l", "--fetch_local_files", help="Holt die Seiten nur aus dem lokalen Archiv (siehe lmd.py sync)", action='store_true')
   parser.add_argument("-m", "--month", help="Nummer des Monats", type=int, default=None)
   parser.add_argument("-y", "--year", help="vierstellige Jahreszahl", type=int, default=None)
   parser.add_argument("-d", "--debug", help="schaltet Debug-Modus ein", action='store_true' )
+  parser.add_argument("-j", "--jobs", help="Anzahl gleichzeitig geholter Artikel", type=int, default=8)
+  parser.add_argument("-b", "--backend", help="native schreibt das epub selbst, calibre nutzt ebook-convert", choices=['native', 'calibre'], default='native')
+  parser.add_argument("--from", dest="start", help="Erzeugt alle Ausgaben ab Monat JJJJ-MM", type=year_month, default=None)
+  parser.add_argument("--to", dest="end", help="...bis einschließlich Monat JJJJ-MM, default ist die aktuelle Ausgabe", type=year_month, default=None)
+  parser.add_argument("--last", help="Erzeugt die letzten n Ausgaben", type=int, default=None)
+  parser.add_argument("-P", "--processes", help="Anzahl parallel erzeugter Ausgaben bei --from/--last", type=int, default=4)
+  parser.add_argument("--pool-size", help="Anzahl offener Verbindungen zu monde-diplomatique.de", type=int, default=8)
+  parser.add_argument("--connect-timeout", help="Timeout für den Verbindungsaufbau in Sekunden", type=float, default=5)
+  parser.add_argument("--read-timeout", help="Timeout für das Lesen einer Seite in Sekunden", type=float, default=30)
+  parser.add_argument("--archive", help="Pfad des lokalen Archivs, default ~/.local/share/lmd/archive.db", default=None)
+  parser.add_argument("-s", "--stats", help="Gibt am Ende die Laufzeiten je Schritt aus", action='store_true')
+  parser.add_argument("--profile", help="Schreibt ein cProfile nach PROFILE, bei --from/--last je Ausgabe nach PROFILE.JJJJ-MM-TT", default=None)
   args = parser.parse_args()
+  http_client.configure( pool_size=args.pool_size, connect_timeout=args.connect_timeout, read_timeout=args.read_timeout )
   y, m, is_online = args.year, args.month, not args.fetch_local_files
+  if args.archive:
+    open_archive( args.archive )
 
   log_level=logging.DEBUG if args.debug else logging.ERROR
-  log = logging.getLogger(__name__)
   logging.basicConfig( 
       name = __name__,
       format='%(asctime)s[%(name)s][%(threadName)s]%(levelname)s: %(message)s',
       level=log_level )
 
 
+  if args.start or args.last:
+    # Mehrere Ausgaben, die noch nicht erschienene wird ausgelassen
+    current = get_current_issue_date()
+    end = args.end or ( current.year, current.month )
+    if args.last:
+      y, m0 = divmod( end[0] * 12 + end[1] - args.last, 12 )
+      start = ( y, m0 + 1 )
+    else:
+      start = args.start
+    issues = filter( lambda issue : issue <= current, get_issue_range( start, end ) )
+    log.debug( "Erzeuge %d Ausgaben von %s bis %s", len( issues ), start, end )
+    if not p.isdir( dirname_output ):
+      os.makedirs( dirname_output )
+    build_issues( issues, is_online, args.jobs, args.backend, args.processes, args.profile )
+    if args.stats:
+      print metrics.summary()
+    sys.exit()
+
   # Berechne Erscheinungsdatum...
   issue_date = get_issue_date(y,m)
   log.debug( "Das gewählte Erscheinungsdatum ist der %s", issue_date.strftime('%d.%m.%Y') )
@@ -43,42 +196,20 @@ if __name__ == '__main__':
 
   if issue_date:
     log.debug( "Erzeuge epub der Ausgabe vom %s", issue_date.strftime('%d.%m.%Y') )
-    datestring = issue_date.strftime('%Y-%m-%d')
-  
-    # Erzeuge Verzeichnisstruktur für das zu erzeugende epub einschließlich stylesheets etc.
-    dirname = '%s/.%s' % ( p.expanduser('~'), uuid4() )
-    tzip = tarfile.open( '%s/%s' % (dirname_ressources, tarfile_name) )
-    tzip.extractall( dirname )
-    log.debug( "Verzeichnisstruktur für epub in %s erzeugt.", dirname )
-
-    # Hole Seiten und parse in ein für calibre verwertbares Format
-    make_paper( dirname, datestring, is_online )
-    log.debug( "XHTML-Dateien zur Erzeugung des epub in %s fertiggestellt.", dirname )
-
-    # in ein ebook konvertieren...
-    src = dirname + '/index.html'
-#    src = 'http://localhost:5000/%s' % datestring
-    target_name = 'lmd%s.epub' % issue_date.strftime('%Y%m%d')
-    target      = '%s/%s' % ( dirname_output, target_name )
-    cover = issue_date.strftime('https://dl.taz.de/titel/%Y/lmd_%Y_%m_%d.120.jpg')
-    cmd = '/usr/bin/ebook-convert %(src)s %(target)s --cover=%(cover)s --chapter-mark=none --dont-split-on-page-breaks --page-breaks-before "/"'
-    args = shlex.split( cmd % dict( src=src, target=target ,cover=cover ) )
-    process = sp.Popen( args , stdout=sp.PIPE, stderr=sp.STDOUT )
-    log.debug("Erzeuge epub...\n")
-    while process.poll() is None:
-      sys.stdout.write(process.stdout.readline())
+    target = '%s/lmd%s.epub' % ( dirname_output, issue_date.strftime('%Y%m%d') )
+    if not p.isdir( dirname_output ):
+      os.makedirs( dirname_output )
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+      profiler.enable()
+    if args.backend == 'calibre':
+      make_epub_calibre( target, issue_date, is_online, args.jobs )
+    else:
+      make_epub( target, issue_date, is_online, args.jobs, issue_date.strftime( cover_url ) )
+    if profiler:
+      profiler.disable()
+      profiler.dump_stats( args.profile )
+    log.debug( "HTTP-Cache: %(hits)d Treffer, %(revalidated)d revalidiert, %(misses)d geholt", http_cache.stats )
+    if args.stats:
+      print metrics.summary()
     log.debug("Fertig!")
-    
-    # Aufräumen...
-    for root, dnames, fnames in os.walk( dirname, topdown=False ):
-      for name in fnames:
-        log.debug("removing %s/%s..." % (root, name))
-        os.remove( '%s/%s' % (root, name) )
-      for name in dnames:
-        log.debug("removing %s/%s..." % (root, name))
-        os.rmdir( '%s/%s' % (root, name) )
-    
-    os.rmdir( dirname )
-    log.debug( "Temporäres Verzeichnis %s wieder gelöscht", dirname )
-    
-
@@ -4,29 +4,88 @@
 #
 # Die Klassen Page mit ihren Unterklassen dienen der Erzeugung von Web content.
 # Die Funktion make_paper() dient der Erzeugung der XHTML-Dateien zur 
-# Konvertierung in ein epub durch calibre.
+# Konvertierung in ein epub durch calibre, make_epub() schreibt sie ohne
+# calibre direkt in ein epub.
 # Einige Hilfsfunktionen dienen zB der Berechnung des Ausgabedatums einer
 # LeMondeDiplo-Ausgabe, also letztendlich der Berechnung der URLs.
 # Die Flask-App schließlich wird nur gebraucht, wenn der Appserver gestartet
-# wird. Dies kann mit folgenden Optionen erfolgen. 
+# wird, create_app() erzeugt sie. Dies kann mit folgenden Optionen erfolgen. 
 # 
-# Usage: python lmd.py [-p n] [--options 'key1=value1,...'] [-d] [-o]
+# Usage: python lmd.py [serve] [-p n] [--options 'key1=value1,...'] [-d] [-o]
+#                      [--cache-entries n] [--cache-size mb] [--state url]
+#                      [--warm n] [--stream] [--admin-token t]
+#        python lmd.py export [--target dir] [--from JJJJ-MM] [-j n] [--force]
+#        python lmd.py assets
+#        python lmd.py sync [--from JJJJ-MM] [--to JJJJ-MM] [-j n] [--archive db]
 #
 #  -p,  --port n      n ist Port des Servers, default ist 8000
-#       --options kv  Weitere Flask-Server-Optionen als kommaseparierte kv-Paare
+#       --options kv  Weitere Flask-Server-Optionen als kommaseparierte kv-Paare,
+#                     außerdem die Optionen des HTTP-Clients für monde-diplomatique.de:
+#                     pool_size, connect_timeout, read_timeout, retries, backoff,
+#                     max_failures, cooldown (siehe HttpClient)
 #  -d,  --debug       Schaltet debug mode ein
 #  -o,  --open        Öffnet den Server für LAN und ggf. WAN
+#       --cache-entries n  Maximale Anzahl gerenderter Seiten im Cache (512)
+#       --cache-size mb    Maximale Größe des Seiten-Caches in MB (64)
+#       --state url        Zustand der App: memory (default) oder sqlite:<Pfad>,
+#                          letzteres für mehrere Prozesse, siehe create_app()
+#       --warm n           Wärmt die letzten Ausgaben mit n gleichzeitigen Anfragen
+#                          im Hintergrund vor (2), 0 schaltet das ab
+#       --stream           Schickt noch nicht zwischengespeicherte Seiten schon
+#                          während des Renderns, siehe create_app()
+#       --admin-token t    Geheimnis für /admin/invalidate, default ist
+#                          $LMD_ADMIN_TOKEN (siehe create_app())
+#
+#  export schreibt die Seiten der Ausgaben statt dessen als statische Dateien,
+#  die ein Webserver ohne Python ausliefern kann, siehe export_site().
+#       --target dir       Zielverzeichnis (site)
+#       --from JJJJ-MM     Exportiert alle Ausgaben ab diesem Monat, default sind
+#                          die letzten zwölf
+#  -j,  --jobs n           Anzahl gleichzeitig erzeugter Seiten (8)
+#       --force            Erzeugt auch schon exportierte Artikel neu
+#
+#  sync spiegelt die Ausgaben ab --from (default die letzten zwölf) bis --to
+#  (default die aktuelle) ins lokale Archiv, siehe sync_archive(), und bringt
+#  den Suchindex für /search auf den neuen Stand. Gibt es das Archiv, lesen die
+#  App, export und fetch-lmd.py die Seiten von dort.
+#       --archive db       Pfad des Archivs (~/.local/share/lmd/archive.db oder
+#                          $LMD_ARCHIVE), gilt auch für serve und export
+#       --offline          serve/export: Seiten nur aus dem Archiv, nie aus dem Netz
+#
+#  assets baut die Dateien unterhalb template_ressources verkleinert, komprimiert
+#  und mit Hash im Namen nach assets, siehe build_assets(). Die App liefert sie
+#  dann unter /assets aus, nach jedem Bauen muss sie neu gestartet werden.
 #
 ################################################################################
 
-import re, shlex, sys, os.path as p, datetime as dt
-from calendar import Calendar
+import re, shlex, sys, os, os.path as p, datetime as dt, time, json, logging, sqlite3, zlib, errno, tempfile
+from calendar import Calendar, timegm, THURSDAY, FRIDAY
+from collections import OrderedDict
+from hashlib import sha1
 from BeautifulSoup import BeautifulSoup as BS
-from urllib import urlopen
-from urlparse import urlparse
-from jinja2 import Template
-import threading, locale
+from urllib import urlopen, quote
+import httplib, socket, random
+from Queue import Queue, Empty, Full
+from urlparse import urlparse, urljoin
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, Template, escape
+import threading, zipfile, tarfile, shutil, hmac
+from email.utils import formatdate
+from uuid import uuid5, NAMESPACE_URL
+from multiprocessing.pool import ThreadPool
 from contextlib import contextmanager
+from functools import wraps
+from argparse import ArgumentTypeError
+import gzip, mimetypes
+from cStringIO import StringIO
+import mmap, struct, math, heapq
+from itertools import izip
+from array import array
+from HTMLParser import HTMLParser
+from htmlentitydefs import name2codepoint
+try:
+  import brotli
+except ImportError:
+  brotli = None
 
 dirname_templates     = "templates"
 dirname_tpl_res       = "template_ressources"
@@ -34,6 +93,283 @@ tpl_entry_page        = "%s/entry-page.html" % dirname_templates
 tpl_index             = "%s/index.html" % dirname_templates
 tpl_article_web       = "%s/article-web.html" % dirname_templates
 tpl_article_book      = "%s/article-book.html" % dirname_templates
+dirname_http_cache    = p.join( p.expanduser('~'), '.cache', 'lmd', 'http' )
+dirname_jinja_cache   = p.join( p.expanduser('~'), '.cache', 'lmd', 'jinja' )
+dirname_assets        = "assets"            # Ausgabe von build_assets()
+# Quelle aller Seiten, für Benchmarks etwa der Replay-Server aus bench.py
+upstream_url          = os.environ.get( 'LMD_UPSTREAM', "http://monde-diplomatique.de" )
+asset_manifest_name   = "manifest.json"
+stream_chunk_size     = 16 * 2**10          # Mindestgröße der Stücke von stream_template()
+
+log = logging.getLogger(__name__)
+
+def make_template_env():
+  '''
+  Erzeugt die Jinja-Umgebung, über die alle Seiten ihre Templates beziehen. Jedes
+  Template wird nur einmal kompiliert und erst dann neu geladen, wenn sich seine
+  Datei geändert hat. Der kompilierte Bytecode landet zusätzlich auf der Platte,
+  damit auch ein frisch gestarteter Prozess nicht neu kompilieren muss.
+  '''
+  bytecode_cache = None
+  try:
+    if not p.isdir( dirname_jinja_cache ):
+      os.makedirs( dirname_jinja_cache )
+    bytecode_cache = FileSystemBytecodeCache( dirname_jinja_cache )
+  except OSError:
+    log.error( "Could not create %s, templates will not be cached on disk", dirname_jinja_cache )
+  return Environment(
+      loader = FileSystemLoader( dirname_templates ),
+      bytecode_cache = bytecode_cache,
+      auto_reload = True )
+
+template_env = make_template_env()
+
+class Metrics:
+  '''
+  Sammelt die Laufzeiten der einzelnen Schritte (holen, parsen, rendern,
+  speichern...) und einfache Zähler, etwa für Fehler beim Holen. Die Werte
+  gelten je Prozess.
+
+  with metrics.timer('render'):
+    ...
+  metrics.count( 'upstream_errors' )
+  '''
+
+  def __init__( self ):
+    self.stages = dict()   # Schritt -> [Anzahl, Summe, Maximum] in Sekunden
+    self.counters = dict() # (Name, ((Label, Wert), ...)) -> Zählerstand
+    self.lock = threading.Lock()
+
+  @contextmanager
+  def timer( self, stage ):
+    start = time.time()
+    try:
+      yield
+    finally:
+      self.observe( stage, time.time() - start )
+
+  def observe( self, stage, seconds ):
+    with self.lock:
+      entry = self.stages.setdefault( stage, [0, 0.0, 0.0] )
+      entry[0] += 1
+      entry[1] += seconds
+      entry[2] = max( entry[2], seconds )
+
+  def count( self, name, n=1, **labels ):
+    key = ( name, tuple( sorted( labels.items() ) ) )
+    with self.lock:
+      self.counters[key] = self.counters.get( key, 0 ) + n
+
+  def snapshot( self ):
+    '''
+    Kopie der Laufzeiten, etwa um sie aus einem anderen Prozess zu übergeben
+    '''
+    with self.lock:
+      return dict( ( stage, list( entry ) ) for stage, entry in self.stages.items() )
+
+  def merge( self, stages ):
+    '''
+    Übernimmt die Laufzeiten aus snapshot() eines anderen Prozesses
+    '''
+    with self.lock:
+      for stage, ( n, total, longest ) in stages.items():
+        entry = self.stages.setdefault( stage, [0, 0.0, 0.0] )
+        entry[0] += n
+        entry[1] += total
+        entry[2] = max( entry[2], longest )
+
+  def summary( self ):
+    '''
+    Die Laufzeiten als Tabelle zum Ausgeben
+    '''
+    lines = [ '%-10s %8s %10s %10s %10s' % ( 'Schritt', 'Anzahl', 'Summe s', 'Mittel ms', 'Max ms' ) ]
+    for stage, ( n, total, longest ) in sorted( self.snapshot().items(), key=lambda item : -item[1][1] ):
+      lines.append( '%-10s %8d %10.2f %10.1f %10.1f' % ( stage, n, total, total * 1000 / n, longest * 1000 ) )
+    return '\n'.join( lines )
+
+  def prometheus( self, counters=(), gauges=() ):
+    '''
+    Alle Werte im Textformat von Prometheus. Zusätzliche Zähler und Messwerte
+    können als Tupel (Name, Labels, Wert) übergeben werden.
+    '''
+    def sample( name, labels, value ):
+      labels = ','.join( '%s="%s"' % ( k, str( v ).replace('\\', '\\\\').replace('"', '\\"') ) for k, v in sorted( labels ) )
+      return '%s%s %s' % ( name, '{%s}' % labels if labels else '', repr( float( value ) ) if isinstance( value, float ) else value )
+
+    stages = self.snapshot()
+    lines = [ '# HELP lmd_stage_seconds Time spent per processing stage',
+              '# TYPE lmd_stage_seconds summary' ]
+    for stage, ( n, total, longest ) in sorted( stages.items() ):
+      lines += [ sample( 'lmd_stage_seconds_count', [('stage', stage)], n ),
+                 sample( 'lmd_stage_seconds_sum', [('stage', stage)], total ) ]
+    lines.append( '# TYPE lmd_stage_seconds_max gauge' )
+    lines += [ sample( 'lmd_stage_seconds_max', [('stage', stage)], entry[2] ) for stage, entry in sorted( stages.items() ) ]
+    with self.lock:
+      samples = [ ( name, labels, value ) for ( name, labels ), value in self.counters.items() ]
+    for kind, entries in ( ('counter', samples + list( counters )), ('gauge', gauges) ):
+      for name in sorted( set( entry[0] for entry in entries ) ):
+        lines.append( '# TYPE lmd_%s %s' % ( name, kind ) )
+        lines += [ sample( 'lmd_' + name, labels, value ) for n, labels, value in sorted( entries ) if n == name ]
+    return '\n'.join( lines ) + '\n'
+
+metrics = Metrics()
+
+def timed( stage ):
+  '''
+  Decorator, der die Laufzeit einer Methode als Schritt stage misst
+  '''
+  def decorate( f ):
+    @wraps( f )
+    def wrapper( *args, **kwargs ):
+      with metrics.timer( stage ):
+        return f( *args, **kwargs )
+    return wrapper
+  return decorate
+
+# Sowohl die Übersichts- als auch die Artikelseiten werden nur innerhalb von
+# div#content ausgewertet. Statt die ganze Seite in einen Baum zu verwandeln,
+# wird dieser Teil deshalb vorher herausgeschnitten.
+re_content_tags = re.compile( r'<!--.*?-->|<script\b.*?</script\s*>|<(/?)div\b[^>]*>', re.I | re.S )
+re_content_id   = re.compile( r'''\bid\s*=\s*["']?content["'\s/>]''', re.I )
+re_charset      = re.compile( r'''<meta\b[^>]*\bcharset\s*=\s*["']?([\w-]+)''', re.I )
+
+def extract_content( html ):
+  '''
+  Gibt den Quelltext von div#content einschließlich des div-Tags zurück, oder
+  None, wenn es nicht gefunden wird. Dazu werden nur die öffnenden und
+  schließenden div-Tags gezählt, Kommentare und Skripte übersprungen.
+  '''
+  start = None
+  for tag in re_content_tags.finditer( html ):
+    if tag.group(1) is None:
+      continue
+    if start is None:
+      if not tag.group(1) and re_content_id.search( tag.group() ):
+        start, depth = tag.start(), 1
+      continue
+    depth += -1 if tag.group(1) else 1
+    if depth == 0:
+      return html[ start:tag.end() ]
+  return None
+
+def parse_bs3( html ):
+  '''
+  Parsed die ganze Seite mit BeautifulSoup
+  '''
+  return BS( html )
+
+def parse_content( html ):
+  '''
+  Parsed nur div#content mit BeautifulSoup. Die Kodierung wird dabei aus dem
+  meta-Tag der ganzen Seite übernommen. Wird div#content nicht gefunden, wird
+  wie bisher die ganze Seite geparsed.
+  '''
+  content = extract_content( html )
+  if content is None:
+    return parse_bs3( html )
+  charset = re_charset.search( html )
+  return BS( content, fromEncoding = charset.group(1) if charset else None )
+
+parsers = dict( bs3 = parse_bs3, content = parse_content )
+
+# Autoren usw. kommen in vielen Ausgaben vor und werden nur einmal gespeichert.
+# Höchstens interned_size verschiedene, die zuletzt gesehenen, damit ein lange
+# laufender Prozess, der durch das ganze Archiv geht, nicht alle für immer hält.
+# unicode lässt keine schwachen Referenzen zu, intern() nimmt nur str.
+interned = OrderedDict()
+interned_size = 4096
+interned_lock = threading.Lock()
+
+def intern_text( text ):
+  '''
+  Wie intern(), aber auch für unicode. Aus einem NavigableString wird dabei ein
+  einfacher String, der den Baum von BeautifulSoup nicht mehr festhält.
+  '''
+  if text is None:
+    return None
+  text = unicode( text )
+  with interned_lock:
+    text = interned.pop( text, text )
+    interned[text] = text
+    if len( interned ) > interned_size:
+      interned.popitem( last=False )
+  return text
+
+def plain( text ):
+  '''
+  text ohne Bezug zum Baum, falls es ein NavigableString ist
+  '''
+  return unicode( text ) if text is not None else None
+
+class Record( object ):
+  '''
+  Kompakter Datensatz: die Felder stehen in __slots__ statt in einem dict je
+  Objekt. Sie lassen sich auch wie bei einem dict lesen (record['title'],
+  record.get('title')), Templates und der übrige Code sehen also keinen
+  Unterschied. Nicht übergebene Felder sind None, unbekannte werden ignoriert.
+
+  json.dumps( record, default=Record.as_dict ) und Klasse.from_dict() für den
+  Weg in die Datenbank und zurück. Gespeichert werden nur die Felder in
+  fields, weitere __slots__ sind daraus abgeleitet.
+  '''
+  __slots__ = ()
+  fields = ()
+
+  def __init__( self, **fields ):
+    for name in self.fields:
+      setattr( self, name, fields.get( name ) )
+
+  # Ohne Umweg über Python, die Templates lesen jedes Feld auf diesem Weg. Ein
+  # unbekanntes Feld gibt deshalb AttributeError statt KeyError, das fängt
+  # Jinja genauso ab.
+  __getitem__ = object.__getattribute__
+
+  def get( self, name, default=None ):
+    return getattr( self, name, default )
+
+  def as_dict( self ):
+    return dict( ( name, getattr( self, name ) ) for name in self.fields )
+
+  @classmethod
+  def from_dict( cls, values ):
+    return cls( **dict( ( str( k ), v ) for k, v in values.items() ) )
+
+  def __repr__( self ):
+    return '%s(%s)' % ( self.__class__.__name__, ', '.join( '%s=%r' % ( name, getattr( self, name ) ) for name in self.fields ) )
+
+class Article( Record ):
+  '''
+  Ein Eintrag im Inhaltsverzeichnis einer Ausgabe
+  '''
+  fields = ( 'href', 'title', 'author', 'abstract', 'description' )
+  __slots__ = fields + ( 'guid', )
+  re_guid = re.compile( r'(\d+)' )
+
+  def __init__( self, **fields ):
+    Record.__init__( self, **fields )
+    self.author = intern_text( self.author )
+    # Die Nummer des Artikels, für die Feeds. Einmal hier statt bei jedem
+    # Rendern, die Felder werden nicht mehr geändert.
+    match = self.re_guid.search( self.href or '' )
+    self.guid = match.group(1) if match else ''
+
+class Issue( Record ):
+  '''
+  Eine Ausgabe, wie die App sie im store für die Navigation der Artikel hält
+  '''
+  __slots__ = fields = ( 'date', 'title', 'logo', 'articles' )
+
+  def __init__( self, **fields ):
+    Record.__init__( self, **fields )
+    self.title = intern_text( self.title )
+    self.logo = intern_text( self.logo )
+    self.articles = self.articles or []
+
+  @classmethod
+  def from_dict( cls, values ):
+    issue = super( Issue, cls ).from_dict( values )
+    issue.articles = [ Article.from_dict( entry ) for entry in issue.articles ]
+    return issue
 
 class Page:
   '''
@@ -55,6 +391,9 @@ class Page:
   direkt übergeben werden.
   '''
 
+  parser = 'content' # Schlüssel in parsers, mit dem geholte Seiten geparsed werden
+  changed = None     # Zeitpunkt (time.time()), zu dem sich die zuletzt geholte Seite geändert hat
+
   def __init__( self, pname=None, template_name=None, **args):
     '''
     pname: Name der Datei, in welche eine zu erzeugende Seite gespeichert werden soll
@@ -82,43 +421,155 @@ class Page:
     if args:
       self.dic.update(**args)
     if fname:
-      soup = self.fetch_soup( fname )
-      self.parse( soup )
+      self.load( fname )
     response = self.render_template(**self.dic)
     if self.page_name:
       self.dump( response )
     return response
+
+  def make_stream( self, fname=None, **args ):
+    '''
+    Wie make(), gibt die Seite aber stückweise zurück, während sie gerendert
+    wird, siehe stream_template(). Holen und Parsen sind schon erledigt, wenn
+    make_stream() zurückkehrt. Mit page_name wird jedes Stück gleich in die
+    Datei geschrieben statt erst die ganze Seite.
+    '''
+    if args:
+      self.dic.update(**args)
+    if fname:
+      self.load( fname )
+    chunks = self.stream_template(**self.dic)
+    if self.page_name:
+      chunks = self.dump_stream( chunks )
+    return chunks
     
+  def last_modified( self ):
+    '''
+    Zeitpunkt der letzten Änderung als datetime (UTC): der Quelle, die load()
+    zuletzt geholt hat, oder des Templates, je nachdem was später war. None,
+    wenn nicht bekannt ist, wann sich die Quelle geändert hat.
+    '''
+    if self.changed is None:
+      return None
+    changed = self.changed
+    if self.template.filename and p.exists( self.template.filename ):
+      changed = max( changed, p.getmtime( self.template.filename ) )
+    return dt.datetime.utcfromtimestamp( int( changed ) )
+
   def load_template( self, fname ):
     '''
-    Lädt ein Template.
-    fname: Dateipfaddes zu ladenden Templates
+    Lädt ein Template aus der gemeinsamen template_env.
+    fname: Dateipfad des zu ladenden Templates
     '''
-    f=open( fname )
-    s = f.read()
-    f.close()
-    self.template = Template( s.decode('utf8') )
+    self.template = template_env.get_template( p.relpath( fname, dirname_templates ) )
 
-  def fetch_soup( self, fname ):
+  @timed('fetch')
+  def fetch( self, fname ):
     '''
-    Holt eine Seite und gibt diese als BeautifulSoup zurück
-    fname: URL der zu parsenden Seite
+    Holt eine Seite und gibt sie ungeparsed zurück, None falls das nicht
+    gelingt. Seiten von monde-diplomatique.de kommen aus dem Archiv, falls es
+    sie dort gibt, sonst über den http_cache.
+    fname: URL der zu holenden Seite, mit archive:/ statt upstream_url nur aus
+           dem Archiv
     '''
+    key = archive_key( fname )
+    self.changed = None
+    if archive and key:
+      raw = archive.get( key )
+      if raw is not None:
+        self.changed = archive.get_changed( key )
+        return raw
+    if fname.startswith('archive:'):
+      log.error( "%s is not in the archive %s", key or fname, archive.fname if archive else fname_archive )
+      return None
     try:
+      if fname.startswith('http'):
+        html = http_cache.get( fname )
+        self.changed = http_cache.changed( fname )
+        return html
       f=urlopen( fname )
+      p=f.read()
+      f.close()
+      return p
     except Exception:
       log.error( "Could not fetch %s", fname )
-      return
-    p=f.read()
-    f.close()
-    return BS( p )
+
+  @timed('soup')
+  def make_soup( self, html ):
+    '''
+    Parsed eine geholte Seite mit dem Parser self.parser
+    '''
+    if html is not None:
+      return parsers[ self.parser ]( html )
+
+  def fetch_soup( self, fname ):
+    '''
+    Holt eine Seite und gibt diese als BeautifulSoup zurück.
+    fname: URL der zu parsenden Seite
+    '''
+    return self.make_soup( self.fetch( fname ) )
+
+  def load( self, fname ):
+    '''
+    Holt und parsed die Seite fname und gibt ihren Quelltext zurück. Liegen
+    die geparsten Wertepaare schon im Archiv, werden sie von dort übernommen,
+    sonst nach dem Parsen dort abgelegt.
+    '''
+    self.url = fname
+    html = self.fetch( fname )
+    key = archive_key( fname )
+    kind = self.__class__.__name__
+    parsed = archive.get_parsed( key, kind ) if archive and key and html is not None else None
+    if parsed is not None:
+      self.dic.update( self.restore( parsed ) )
+      return html
+    # Nur die Wertepaare von parse() archivieren, nicht die von außen übergebenen
+    given, self.dic = self.dic, dict()
+    soup = self.make_soup( html )
+    try:
+      self.parse( soup )
+      parsed = self.dic
+    finally:
+      self.dic = given
+      # Der Baum ist voller Zyklen (parent, next...), ohne decompose() gäbe
+      # erst der Garbage Collector ihn irgendwann frei
+      if soup is not None:
+        soup.decompose()
+    self.dic.update( parsed )
+    if archive and key and html is not None:
+      archive.put_parsed( key, kind, parsed )
+    return html
     
+  @timed('render')
   def render_template( self, **args):
     """
     rendered ein Template auf Basis der übergebenen Wertepaare
     """
     return self.template.render(**args).encode('utf8')
+
+  def stream_template( self, **args ):
+    """
+    rendered ein Template wie render_template(), gibt das Ergebnis aber als
+    Folge von UTF-8-Stücken mit mindestens stream_chunk_size Bytes zurück
+    """
+    chunk, size, spent = [], 0, 0.0
+    start = time.time()
+    for text in self.template.generate(**args):
+      data = text.encode('utf8')
+      chunk.append( data )
+      size += len( data )
+      if size >= stream_chunk_size:
+        spent += time.time() - start
+        yield ''.join( chunk )
+        chunk, size = [], 0
+        start = time.time()
+    spent += time.time() - start
+    if chunk:
+      yield ''.join( chunk )
+    # Nur die Zeit im Template zählt, nicht die Wartezeit auf den Empfänger
+    metrics.observe( 'render', spent )
   
+  @timed('dump')
   def dump( self, text ):
     """
     Speichert text in eine Datei. Der Pfad zu dieser Datei sollte bekannt sein
@@ -126,16 +577,41 @@ class Page:
     g = open( self.page_name, 'w' )
     g.write( text )
     g.close()
+
+  def dump_stream( self, chunks ):
+    """
+    Schreibt die Stücke chunks nacheinander in die Datei page_name und reicht
+    sie dabei weiter. Erst wenn alle geschrieben sind, bekommt die Datei ihren
+    Namen, eine halb geschriebene Seite ersetzt also nie eine vollständige.
+    """
+    part = self.page_name + '.part'
+    try:
+      with open( part, 'wb' ) as g:
+        for chunk in chunks:
+          g.write( chunk )
+          yield chunk
+    except BaseException:
+      os.remove( part )
+      raise
+    os.rename( part, self.page_name )
   
   def parse( self, soup ):
     '''
     Extrahiert aus einer wundervollen Suppe die zur Erzeugung eines Templates
     erforderlichen Wertepaare und speichert diese in self.dic zwischen. Muss 
-    in Unterklasse erledigt werden.
+    in Unterklasse erledigt werden. Nichts davon darf auf den Baum verweisen,
+    er wird danach zerlegt.
     soup: BeautifulSoup-Objekt. In der Regel von einer geholten Seite.
     '''
     pass
 
+  def restore( self, values ):
+    '''
+    Macht aus den im Archiv als JSON abgelegten Wertepaaren wieder die von
+    parse(), etwa Datensätze statt dicts
+    '''
+    return values
+
 class IndexPage( Page ):
   """
   Template für die Indexseite.
@@ -143,14 +619,14 @@ class IndexPage( Page ):
 
   template_name = '%s/index.html' % dirname_templates
 
+  @timed('parse')
   def parse( self, soup ):
     '''
     Parsed die Übersichtsseite mit den Artikel-Links
     '''
     args = dict(
       title='Le Monde Diplomatique',
-      charset='utf8',
-      builtdate = dt.datetime.now().strftime('%c'))
+      charset='utf8')
     articles = []
     c = soup.find('div',{'id':'content'})
 #    date = c.strong.string
@@ -159,23 +635,37 @@ class IndexPage( Page ):
     for item in toc.findAll('li'):                  
       if item.a:
         url = urlparse( item.a['href'] ).path
-        article = dict(
-          href = url.replace('/','',1) if url.startswith('/') else url,
-          guid = re.search('(\d+)', url).group(1) if re.search('(\d+)', url) else '',
-          title = item.a.strong.string.strip() )
+        title = item.a.strong.string.strip()
         item.a.strong.extract()
-        article.update(abstract=item.renderContents())
+        abstract = item.renderContents()
         author = ''
         for entry in item.findAll('em'):
           author += entry.string
           entry.extract()
-        article.update(
+        articles.append( Article(
+          href = url.replace('/','',1) if url.startswith('/') else url,
+          title = title,
           author = author,
-          description = item.text )
-        articles.append( article )
+          abstract = abstract,
+          description = item.text ) )
     args.update(articles=articles)
+    # Artikel der aktuellen Ausgabe können noch korrigiert werden und bekommen
+    # deshalb im Cache eine kurze Lebensdauer
+    url = getattr( self, 'url', '' )
+    if http_cache.is_current( url ):
+      http_cache.mark_current( re_issue_date.search( url ).group(1), map( lambda entry : entry['href'], articles ) )
     self.dic.update(**args)
 
+  def restore( self, values ):
+    values['articles'] = [ Article.from_dict( entry ) for entry in values.get( 'articles', [] ) ]
+    return values
+
+  def issue( self, date=None ):
+    '''
+    Die geparste Ausgabe als Issue, ohne die übrigen Wertepaare des Templates
+    '''
+    return Issue( date=date, title=self.dic.get('title'), logo=self.dic.get('logo'), articles=self.dic.get('articles') )
+
 class ArticlePage( Page ):
   '''
   Template für eine Artikelseite. Default ist die Web-Darstellung
@@ -183,55 +673,134 @@ class ArticlePage( Page ):
 
   template_name = '%s/article-web.html' % dirname_templates
 
+  # Absätze des Artikeltextes und ihre CSS-Klassen im Template
+  body_classes = {
+    'Brot': 'c-article-body',
+    'BrotO': 'c-article-body',
+    'Zwischentitel': 'c-article-body__subheadline' }
+  head_classes = ('Unterzeile', 'Titel', 'Korrespondent', 'Initial')
+  re_first_word = re.compile('[\wüÜöÖäÄß-]*')
+
+  @timed('parse')
   def parse( self, soup ):
     '''
-    Parsed eine Artikelseite
+    Parsed eine Artikelseite. Die Absätze werden in einem Durchgang nach Kopf,
+    Text und Fußnoten sortiert, die CSS-Klassen direkt an den Tags umbenannt.
     '''
     args = dict(charset='utf8')
-    c = soup.find('div',{'id':'content'})
-    args.update(teaser=c.find('p',{'class':'Unterzeile'}).string if c.find('p',{'class':'Unterzeile'}) else '' )
-    args.update(title=c.find('p',{'class':'Titel'}).string)
-    args.update(author=c.find('p',{'class':'Korrespondent'}).string if c.find('p',{'class':'Korrespondent'}) else '' )
-    args.update(initial=c.find('p',{'class':'Initial'}).renderContents() if c.find('p',{'class':'Initial'}) else '')
-    p_list=c.findAll('p')
-    f_list=filter(lambda p:p['class']=='Fussnote' if p.has_key('class') else False,p_list)
-    footnotes = ''
-    for f in f_list: footnotes+=str(f)
-    footnotes=footnotes.replace('\"Fussnote','\"c-image__caption')
-    args.update(footnotes=footnotes)
-    c_list=filter(lambda p:p['class']=='Brot' or p['class']=='BrotO' or p['class']=='Zwischentitel' if p.has_key('class') else False,p_list)
-    first = c_list.pop(0).renderContents()
+    c = find_content( soup )
+    head, body, footnotes = dict(), [], []
+    for para in c.findAll('p'):
+      css = dict( para.attrs ).get('class')
+      if css in self.body_classes:
+        body.append( para )
+      elif css == 'Fussnote':
+        footnotes.append( para )
+      elif css in self.head_classes and css not in head:
+        head[css] = para
+    args.update(teaser=plain( head['Unterzeile'].string ) if 'Unterzeile' in head else '' )
+    args.update(title=plain( head['Titel'].string ))
+    args.update(author=intern_text( head['Korrespondent'].string ) if 'Korrespondent' in head else '' )
+    args.update(initial=head['Initial'].renderContents() if 'Initial' in head else '')
+    for f in footnotes:
+      rename_attrs( f, lambda v : 'c-image__caption' + v[8:] if v.startswith('Fussnote') else v )
+    args.update(footnotes=''.join( map( str, footnotes ) ))
+    first = body.pop(0).renderContents()
     args.update(first_letter = first[0])
-    re_first_word=re.compile('[\wüÜöÖäÄß-]*')
-    match = re_first_word.match(first[1:])
+    match = self.re_first_word.match(first[1:])
     args.update(chunk = match.group())
     args.update(first = first[1+match.end():])    
-    content=''
-    for c in c_list: content+=str(c)
-    content = content.replace('\"Brot\"','\"c-article-body\"').replace('\"BrotO\"','\"c-article-body\"').replace('\"Zwischentitel\"','\"c-article-body__subheadline\"')
-    args.update(content=content)
+    for b in body:
+      rename_attrs( b, lambda v : self.body_classes.get( v, v ) )
+    args.update(content=''.join( map( str, body ) ))
     self.dic.update(**args)
 
-def make_paper( target, date, is_online=True ):
+def find_content( soup ):
+  '''
+  Gibt div#content zurück. Die Attribute werden dabei direkt über attrs
+  gelesen: BeautifulSoup sucht sonst beim ersten Zugriff auf die Attribute eines
+  Tags dessen ganzen Teilbaum nach einem Tag namens attrMap ab.
+  '''
+  for tag in soup.recursiveChildGenerator():
+    if getattr( tag, 'name', None ) == 'div' and dict( tag.attrs ).get('id') == 'content':
+      return tag
+
+def rename_attrs( tag, rename ):
+  '''
+  Ersetzt die Attributwerte von tag und aller darin enthaltenen Tags durch
+  rename( Wert ).
+  '''
+  for t in [tag] + tag.findAll(True):
+    t.attrs = [ ( key, rename( value ) ) for key, value in t.attrs ]
+    t.attrMap = None
+
+manifest_name = '.manifest.json'
+
+def digest( data ):
+  return sha1( data or '' ).hexdigest()
+
+def file_digest( fname ):
+  '''
+  SHA1 des Inhalts der Datei fname, None falls es sie nicht gibt
+  '''
+  if p.exists( fname ):
+    with open( fname, 'rb' ) as f:
+      return digest( f.read() )
+
+def make_paper( target, date, is_online=True, jobs=8 ):
   '''
   Produziert die komplette Ausgabe als xhtml. Baustelle: Das richtige Handling der Links.
-  target:     Verzeichnis, in welchem das generierte xhtml abgelegt werden soll
+  Gibt die Seiten als Liste von Tupeln (Pfad relativ zu target, xhtml, Titel)
+  zurück, die Indexseite zuerst, danach die Artikel in der Reihenfolge der Ausgabe.
+
+  In target wird ein Manifest mit den Hashes von Quelle, Template, next-Link und
+  erzeugter Seite abgelegt. Bei einem erneuten Lauf werden nur die Seiten neu
+  erzeugt und geschrieben, bei denen sich davon etwas geändert hat.
+
+  target:     Verzeichnis, in welchem das generierte xhtml abgelegt werden soll.
+              Bei None werden die Seiten nur zurückgegeben.
   date:     Datum der zu erzeugenden Ausgabe im Format, in welchem es abgefufen werden kann
-  is_online: True, wenn inline abgerufen werden soll 
+  is_online: True, wenn online abgerufen werden soll, sonst nur aus dem Archiv
+            (siehe sync_archive())
+  jobs:     Anzahl der Artikel, die gleichzeitig geholt und geparsed werden
   '''
-  local = "monde-diplomatique.de"
-  # Falls offline nehme lokale Dateien:
-  src_root_url = "http://monde-diplomatique.de" if is_online else local 
+  # Falls offline nur aus dem Archiv
+  src_root_url = upstream_url if is_online else 'archive:'
   src_index_path = "%s/archiv-text?text=%s" % (src_root_url,date) # url des Index der gewünschten Ausgbe
+  manifest, old_manifest, skipped = dict(), dict(), []
+  if target and p.exists( '%s/%s' % (target, manifest_name) ):
+    with open( '%s/%s' % (target, manifest_name) ) as f:
+      old_manifest = json.load( f )
+
+  def make_page( page, src_url, href, **state ):
+    '''
+    Holt und parsed eine Seite und erzeugt sie, falls sich seit dem letzten Lauf
+    etwas geändert hat. Ansonsten wird sie aus target gelesen.
+    '''
+    html = page.load( src_url )
+    state.update( source = digest( html ), template = file_digest( page.template.filename ) )
+    old = old_manifest.get( href, {} )
+    if target and all( old.get( k ) == v for k, v in state.items() ) \
+        and file_digest( page.page_name ) == old.get('output'):
+      with open( page.page_name, 'rb' ) as f:
+        response = f.read()
+      skipped.append( href )
+    else:
+      response = page.make()
+    state.update( output = digest( response ) )
+    manifest[href] = state
+    return response
+
   # Als erstes die Indexseite machen...
-  target_index = IndexPage('%s/index.html' % target )
-  target_index.make( src_index_path, stylesheet = 'res/index_styles.css', logo = 'res/logo.png' )
+  target_index = IndexPage('%s/index.html' % target if target else None )
+  target_index.dic.update( stylesheet = 'res/index_styles.css', logo = 'res/logo.png' )
+  index = make_page( target_index, src_index_path, 'index.html' )
   # ...und dann die Links zu den Artikeln extrahieren und die Artikelseiten machen
   article_refs = map( lambda entry : entry['href'], target_index.get_content()['articles'] )
-  i=0
-  while i < len(article_refs):
+
+  def make_article( i ):
     src_url = '%s/%s' % (src_root_url,article_refs[i])
-    target_path = '%s/%s' % (target,article_refs[i])
+    target_path = '%s/%s' % (target,article_refs[i]) if target else None
     next_path = '%s/%s' % (src_root_url,article_refs[ (i+1) % len(article_refs) ])
     next_target = '%s' % (p.basename( next_path )) 
     article=ArticlePage( target_path, tpl_article_book, 
@@ -239,8 +808,232 @@ def make_paper( target, date, is_online=True ):
       date = date,
       home = "../index.html",
       next=next_target )
-    article.make( src_url )
-    i+=1
+    response = make_page( article, src_url, article_refs[i], next = next_target )
+    return article_refs[i], response, article.get_content()['title']
+
+  # Die Artikel sind unabhängig voneinander, die Wartezeit auf den Server
+  # dominiert. Deshalb werden sie von einem begrenzten Thread-Pool geholt.
+  pool = ThreadPool( max( 1, min( jobs, len(article_refs) ) ) )
+  try:
+    articles = pool.map( make_article, range( len(article_refs) ) )
+  finally:
+    pool.close()
+    pool.join()
+  if target:
+    with open( '%s/%s' % (target, manifest_name), 'w' ) as f:
+      json.dump( manifest, f, indent=1, sort_keys=True )
+    log.debug( "%d of %d pages unchanged, skipped: %s", len( skipped ), len( manifest ), ", ".join( skipped ) )
+  return [ ('index.html', index, u'Inhalt') ] + articles
+
+################################################################################
+#
+# epub
+#
+################################################################################
+
+dirname_epub_res      = "epub-ressources"
+epub_res_tarfile      = "%s/res.tar.gz" % dirname_epub_res
+
+# Was die Indexseite aus template_ressources braucht, aber nicht in
+# epub_res_tarfile liegt: Pfad im epub -> Pfad unterhalb dirname_tpl_res
+epub_extra_res = OrderedDict( [
+  ( 'res/index_styles.css', 'css/index_styles.css' ),
+  ( 'res/fonts/SZSans-Bold.otf', 'css/fonts/SZSans-Bold.otf' ) ] )
+
+epub_media_types = {
+  '.css': 'text/css',
+  '.png': 'image/png',
+  '.jpg': 'image/jpeg',
+  '.otf': 'application/vnd.ms-opentype',
+  '.eot': 'application/vnd.ms-fontobject',
+  '.woff': 'application/font-woff',
+  '.woff2': 'font/woff2' }
+
+epub_container = '''<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+'''
+
+epub_opf = Template(u'''<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="uid">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="uid">{{ uid }}</dc:identifier>
+    <dc:title>{{ title }}</dc:title>
+    <dc:creator>Le Monde diplomatique</dc:creator>
+    <dc:publisher>taz, die Tageszeitung</dc:publisher>
+    <dc:language>de</dc:language>
+    <dc:date>{{ date }}</dc:date>
+    <meta property="dcterms:modified">{{ modified }}</meta>
+    {% if cover %}<meta name="cover" content="cover-image"/>{% endif %}
+  </metadata>
+  <manifest>
+    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>
+    <item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>
+    {% if cover %}<item id="cover-image" href="cover.jpg" media-type="image/jpeg" properties="cover-image"/>
+    <item id="cover" href="cover.xhtml" media-type="application/xhtml+xml"/>{% endif %}
+    {% for item in items %}<item id="{{ item.id }}" href="{{ item.href }}" media-type="{{ item.media_type }}"/>
+    {% endfor %}
+  </manifest>
+  <spine toc="ncx">
+    {% if cover %}<itemref idref="cover" linear="no"/>{% endif %}
+    {% for item in spine %}<itemref idref="{{ item.id }}"/>
+    {% endfor %}
+  </spine>
+  {% if cover %}<guide><reference type="cover" title="Cover" href="cover.xhtml"/></guide>{% endif %}
+</package>
+''', autoescape=True)
+
+epub_ncx = Template(u'''<?xml version="1.0" encoding="UTF-8"?>
+<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">
+  <head><meta name="dtb:uid" content="{{ uid }}"/></head>
+  <docTitle><text>{{ title }}</text></docTitle>
+  <navMap>
+    {% for item in spine %}<navPoint id="nav{{ loop.index }}" playOrder="{{ loop.index }}">
+      <navLabel><text>{{ item.title }}</text></navLabel><content src="{{ item.href }}"/>
+    </navPoint>
+    {% endfor %}
+  </navMap>
+</ncx>
+''', autoescape=True)
+
+epub_nav = Template(u'''<?xml version="1.0" encoding="UTF-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" xml:lang="de">
+<head><title>{{ title }}</title></head>
+<body>
+  <nav epub:type="toc"><h1>{{ title }}</h1><ol>
+    {% for item in spine %}<li><a href="{{ item.href }}">{{ item.title }}</a></li>
+    {% endfor %}
+  </ol></nav>
+</body>
+</html>
+''', autoescape=True)
+
+epub_cover = '''<?xml version="1.0" encoding="UTF-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="de">
+<head><title>Cover</title></head>
+<body><div style="text-align: center;"><img src="cover.jpg" alt="Cover" style="max-width: 100%; height: 100%;"/></div></body>
+</html>
+'''
+
+class EpubWriter:
+  '''
+  Schreibt ein epub direkt in den zip-Container, ohne Umweg über ein
+  temporäres Verzeichnis und ebook-convert.
+
+  book = EpubWriter( 'lmd20160512.epub', u'Ausgabe vom 12.05.2016', '2016-05-12' )
+  book.add_ressources( epub_res_tarfile )
+  book.add_page( 'index.html', xhtml, u'Inhalt' )
+  book.close()
+  '''
+
+  def __init__( self, fname, title, date ):
+    self.title = title
+    self.date = date
+    self.items = []  # alles außer mimetype, META-INF und den Verzeichnissen
+    self.spine = []  # Seiten in Lesereihenfolge
+    self.cover = False
+    self.zip = zipfile.ZipFile( fname, 'w', zipfile.ZIP_DEFLATED )
+    # mimetype muss als erste Datei unkomprimiert im Container liegen
+    self.zip.writestr( zipfile.ZipInfo('mimetype'), 'application/epub+zip', zipfile.ZIP_STORED )
+    self.zip.writestr( 'META-INF/container.xml', epub_container )
+
+  def add( self, path, data, media_type=None ):
+    '''
+    Legt data unter path im Container ab und nimmt es ins Manifest auf
+    '''
+    if not media_type:
+      media_type = epub_media_types.get( p.splitext( path )[1].lower(), 'application/octet-stream' )
+    item = dict( id='item%d' % len( self.items ), href=quote( path, safe='/!' ), media_type=media_type )
+    self.items.append( item )
+    self.zip.writestr( path, data )
+    return item
+
+  def add_page( self, path, xhtml, title ):
+    '''
+    Legt eine xhtml-Seite ab und hängt sie an die Lesereihenfolge an. HTML-Entities
+    werden dabei ersetzt, siehe to_xml().
+    '''
+    item = self.add( path, to_xml( xhtml ), 'application/xhtml+xml' )
+    # Die Titel kommen mit den Entities des Originals, OPF, NCX und nav
+    # escapen sie selbst
+    item.update( title = html_parser.unescape( title or u'' ) )
+    self.spine.append( item )
+
+  def add_cover( self, data ):
+    self.zip.writestr( 'cover.jpg', data )
+    self.zip.writestr( 'cover.xhtml', epub_cover )
+    self.cover = True
+
+  def add_ressources( self, fname ):
+    '''
+    Übernimmt Stylesheets, Fonts und Bilder aus einem tar-Archiv
+    '''
+    tar = tarfile.open( fname )
+    try:
+      for member in tar:
+        if member.isfile():
+          self.add( member.name, tar.extractfile( member ).read() )
+    finally:
+      tar.close()
+
+  def close( self ):
+    '''
+    Schreibt OPF, NCX und nav und schließt den Container
+    '''
+    values = dict( uid = 'urn:uuid:%s' % uuid5( NAMESPACE_URL, 'lmd:%s' % self.date ),
+        title = self.title, date = self.date, cover = self.cover,
+        modified = dt.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'),
+        items = self.items, spine = self.spine )
+    self.zip.writestr( 'content.opf', epub_opf.render( **values ).encode('utf8') )
+    self.zip.writestr( 'toc.ncx', epub_ncx.render( **values ).encode('utf8') )
+    self.zip.writestr( 'nav.xhtml', epub_nav.render( **values ).encode('utf8') )
+    self.zip.close()
+
+re_entity = re.compile( r'&(?:(#[0-9]+|#[xX][0-9a-fA-F]+)|(\w+));|&' )
+xml_entities = ( 'amp', 'lt', 'gt', 'quot', 'apos' )
+
+def to_xml( xhtml ):
+  '''
+  Macht aus einer Seite mit HTML-Entities (aus dem Original oder den Templates)
+  wohlgeformtes XML: benannte Entities wie &auml; werden zu Zeichen, wie es
+  BeautifulSoup mit convertEntities täte, ein einzelnes & zu &amp;.
+  xhtml: UTF-8
+  '''
+  def replace( match ):
+    name = match.group(2)
+    if match.group(1) or name in xml_entities:
+      return match.group()
+    if name in name2codepoint:
+      return unichr( name2codepoint[name] ).encode('utf8')
+    return '&amp;' + match.group()[1:]
+  return re_entity.sub( replace, xhtml )
+
+def make_epub( fname, issue_date, is_online=True, jobs=8, cover_url=None ):
+  '''
+  Erzeugt das epub der Ausgabe vom issue_date (datetime.date) in der Datei
+  fname. Die Seiten kommen direkt aus make_paper(), die Ressourcen aus
+  epub_res_tarfile, das Titelbild wird von cover_url geholt, falls angegeben.
+  '''
+  datestring = issue_date.strftime('%Y-%m-%d')
+  pages = make_paper( None, datestring, is_online, jobs )
+  book = EpubWriter( fname, issue_date.strftime(u'Le Monde diplomatique vom %d.%m.%Y'), datestring )
+  try:
+    if cover_url:
+      try:
+        book.add_cover( http_cache.get( cover_url ) )
+      except Exception:
+        log.error( "Could not fetch cover %s", cover_url )
+    book.add_ressources( epub_res_tarfile )
+    for path, src in epub_extra_res.items():
+      with open( p.join( dirname_tpl_res, src ), 'rb' ) as f:
+        book.add( path, f.read() )
+    for path, xhtml, title in pages:
+      book.add_page( path, xhtml, title )
+  finally:
+    book.close()
 
 cal = Calendar()
     
@@ -248,9 +1041,7 @@ def get_current_issue_date():
   '''
   Gibt das Ausgabedatum der aktuellem Ausgabe als datetime.date-Objekt zurück.
   '''
-  dc = get_issue_date()
-  dp = get_issue_date( m = -1 )
-  return dc if dc < dt.date.today() else dp
+  return issue_calendar.current()
 
 def get_issue_date(y=None,m=None):
   '''
@@ -268,18 +1059,26 @@ def get_issue_date(y=None,m=None):
     m=today.month-1
     if m==0:
       m,y = 12,y-1
-  # Liste die Mittwoche bzw. Donnerstage eines Monats
+  return issue_calendar.month( y, m )
+
+def compute_issue_date( y, m ):
+  '''
+  Berechnet das Datum der Ausgabe im Monat m des Jahres y, siehe IssueCalendar
+  '''
+  # Liste die Freitage bzw. Donnerstage eines Monats (0 in Wochen, die ihn
+  # nicht enthalten)
   dates= map(lambda w:w[get_wd(y,m)],cal.monthdayscalendar(y,m))
-  # Herausgegeben wird in der Regel am zweiten Mittwoch bzw. Donnerstag eines
-  # Monats, frühestens aber am 7. eines Monats.
+  # Herausgegeben wird am ersten Freitag bzw. Donnerstag ab dem 7. eines
+  # Monats, also immer zwischen dem 7. und 13.
   d = dates[1] if dates[1] > 6 else dates[2]
   return dt.date(y,m,d)
 
 def get_wd(y,m):
   '''
-  Der Erscheinungstag war vor April 2014 immer der Mittwoch, seitdem der Donnerstag
+  Der Erscheinungstag als Index in die Wochen von cal (Montag ist 0): vor April
+  2014 erschien die Ausgabe freitags, seitdem donnerstags
   '''
-  return 3 if y > 2014 or y == 2014 and m > 3 else 4
+  return THURSDAY if y > 2014 or y == 2014 and m > 3 else FRIDAY
 
 def get_issue_list( month, year ):
   '''
@@ -295,184 +1094,2147 @@ def get_issue_list( month, year ):
     issues.append( get_issue_date( year-1, 12 - i ) )
   return issues
 
-LOCALE_LOCK = threading.Lock()
+def get_issue_range( start, end ):
+  '''
+  Gibt die Ausgabedaten (datetime.date-Objekte) aller Monate von start bis
+  einschließlich end zurück, die älteste Ausgabe zuerst. Der Erscheinungstag
+  wird dabei für jeden Monat einzeln nach get_wd() bestimmt.
+  start, end: Tupel (Jahr, Monat)
+  '''
+  issues = list()
+  y, m = start
+  while (y, m) <= tuple( end ):
+    issues.append( get_issue_date( y, m ) )
+    y, m = (y, m+1) if m < 12 else (y+1, 1)
+  return issues
 
-# RSS-Dateien wollen das Datum in einem bestimmten Format, das nicht dem deutschen
-# entspricht. Deshalb für das temporäre Umschalten der Sprachungebung diese Funktion.
-@contextmanager
-def setlocale(name):
+def year_month( s ):
   '''
-  Zum Einschalten der Sprachumgebung name
-  name= en_US oder de_De
+  Wandelt 'JJJJ-MM' in ein Tupel (Jahr, Monat), als type für argparse
   '''
-  with LOCALE_LOCK:
-    saved = locale.setlocale(locale.LC_ALL)
-    try:
-      yield locale.setlocale(locale.LC_ALL, name)
-    finally:
-      locale.setlocale(locale.LC_ALL, saved)
+  try:
+    y, m = map( int, s.split('-') )
+  except ValueError:
+    raise ArgumentTypeError( "%s ist nicht im Format JJJJ-MM" % s )
+  if not 1 <= m <= 12:
+    raise ArgumentTypeError( "%s ist kein gültiger Monat" % s )
+  return y, m
 
-################################################################################
-#
-# Die lMd-Webapp
-#
-################################################################################
+first_issue = ( 1995, 5 ) # Monat der ersten deutschen Ausgabe
 
-if __name__=='__main__':
+class IssueCalendar:
   '''
-  Webapp definieren und Appserver starten
+  Die Ausgabedaten aller Monate von der ersten Ausgabe (first_issue) bis zum
+  Ende des nächsten Jahres, einmal berechnet. Monat -> Ausgabe, Tag ->
+  Ausgabe und Ausgabe -> Nachbarn sind damit nur noch Indexrechnungen, auch
+  die Links und Texte für die App liegen fertig bereit. Läuft ein Prozess
+  über das Jahresende hinaus, wird bei Bedarf das nächste Jahr dazu berechnet.
+  Monate davor und weiter in der Zukunft werden wie bisher einzeln berechnet.
+
+  issue_calendar.month( 2016, 5 )                       # date(2016, 5, 12)
+  issue_calendar.issue_for( dt.date( 2016, 5, 20 ) )    # dieselbe
+  issue_calendar.neighbors( '2016-05-12' )              # April- und Juni-Ausgabe
   '''
-  from flask import Flask, request, url_for, send_from_directory, redirect
-  from os import path
-  
-  curdir = path.abspath('.')
-  src_root = "http://monde-diplomatique.de"
-  font_folder = '%s/%s/fonts' % ( curdir, dirname_tpl_res )
-  pubdate = ' '
-  app = Flask('LMd',static_folder= '%s/%s' % ( curdir, dirname_tpl_res))
-  content=dict() # App cache initialisieren
-  # Liste der letzten zwölf Ausgaben finden und zwischenspeichern
-  d = get_current_issue_date()
-  issues = get_issue_list( d.month, d.year )
-  issue_link_list = list()
-  for issue in issues:
-    datestring = issue.strftime('%Y-%m-%d') # ...für den link
-    date = issue.strftime('%d. %B %Y')      # ...für den Text
-    href = '/'+datestring     
-    issue_link_list.append( dict(href=href, date=date) )
-  content['issues'] = issue_link_list 
-  
-  @app.route('/')
-  def index():
+
+  def __init__( self, start=first_issue, end=None ):
+    self.start = start
+    self.dates = list()
+    # Position jeder Ausgabe, als date und als JJJJ-MM-TT
+    self.positions = dict()
+    # Links für entry-page.html und Einträge für /issues
+    self.links = list()
+    self.entries = list()
+    self.lock = threading.Lock()
+    self.extend( end or ( dt.date.today().year + 1, 12 ) )
+
+  def extend( self, end ):
     '''
-    Die Überblicksseite mit den links zu den Ausgaben
+    Berechnet die Ausgaben bis einschließlich Monat end (Tupel JJJJ, MM) dazu.
+    Die Listen werden nur verlängert, Leser in anderen Threads sehen also
+    immer einen gültigen Stand.
     '''
-    issues_page = Page(
-        template_name = tpl_entry_page,
-        charset = "utf8",
-        stylesheet = url_for('static',filename='css/index_styles.css'), 
-        logo = url_for('static',filename='logo.png'),
-        articles = content['issues'] )
-    response = issues_page.make()
-    return response
+    with self.lock:
+      n = len( self.dates )
+      y, m = self.start[0] + ( self.start[1] - 1 + n ) // 12, ( self.start[1] - 1 + n ) % 12 + 1
+      while (y, m) <= end:
+        issue = compute_issue_date( y, m )
+        iso = issue.strftime('%Y-%m-%d')
+        link = dict( href='/' + iso, date=issue.strftime('%d. %B %Y') )
+        if self.entries:
+          self.entries[-1]['next'] = iso
+        self.entries.append( dict( date=iso, title=link['date'], href=link['href'], rss='/rss/' + iso,
+            previous=self.dates[-1].strftime('%Y-%m-%d') if self.dates else None, next=None ) )
+        self.links.append( link )
+        self.dates.append( issue )
+        self.positions[issue] = self.positions[iso] = len( self.dates ) - 1
+        y, m = (y, m+1) if m < 12 else (y+1, 1)
 
-  @app.route('/res/<path>')
-  def static_proxy(path):
+  def position( self, y, m ):
+    return ( y - self.start[0] ) * 12 + m - self.start[1]
+
+  def month( self, y, m ):
     '''
-    Alles unterhalb template_ressources
+    Das Datum der Ausgabe im Monat m des Jahres y
     '''
-    # send_static_file will guess the correct MIME type
-    return app.send_static_file( path )
-  
-  @app.route('/rss/<date>')
-  def get_rss(date):
+    i = self.position( y, m )
+    # Nur bis zum Ende des nächsten Jahres, sonst könnte jede Anfrage nach
+    # einem fernen Datum die Listen beliebig wachsen lassen
+    horizon = dt.date.today().year + 1
+    if i >= len( self.dates ) and y <= horizon:
+      self.extend( ( horizon, 12 ) )
+    return self.dates[i] if 0 <= i < len( self.dates ) else compute_issue_date( y, m )
+
+  def find( self, issue ):
     '''
-    Gibt einen Feed zurück
+    Position der Ausgabe issue (date oder 'JJJJ-MM-TT') in dates, None wenn an
+    dem Tag keine erschienen ist
     '''
-    pubdate = date
-    logo = url_for('static',filename='logo.png')
-    issue_path = "%s/archiv-text?text=%s" % (src_root, date)
-    issue = IndexPage(template_name='%s/rss.xml' % dirname_templates )
-    with setlocale( 'en_US.UTF-8' ):
-      pubdate = dt.datetime.now().strftime('%a, %d %b %Y %H:%M:%S GMT')
-    response = issue.make( issue_path, logo = logo, pubdate = pubdate )
-    return response
-  
-  @app.route('/<date>')
-  def get_issue(date):
+    return self.positions.get( issue )
+
+  def issue_for( self, day ):
     '''
-    Gibt die Indexseite der Ausgabe mit Datum date zurück
+    Die Ausgabe, die am Tag day (date) aktuell ist, also die letzte, die bis
+    dahin erschienen ist, None vor der ersten Ausgabe
     '''
-    pubdate = date
-    stylesheet = url_for('static',filename='css/index_styles.css')
-    logo = url_for('static',filename='logo.png')
-    issue_path = "%s/archiv-text?text=%s" % (src_root, date)
-    issue = IndexPage()
-    content['current']=issue.get_content()
-    i=0
-    response = issue.make( issue_path, stylesheet = stylesheet, logo = logo )
-    article_refs = map( lambda entry : entry['href'], issue.get_content()['articles'] )
-    while i < len(article_refs):
-      next_target = article_refs[ (i+1) % len(article_refs) ]
-      next_path = p.basename( next_target )
-      content[article_refs[i]] = next_path
-      i+=1
-    return response
-  
-  @app.route('/artikel/<article>')
-  def get_article(article):
+    if day < self.dates[0]:
+      return None
+    issue = self.month( day.year, day.month )
+    if issue <= day:
+      return issue
+    return self.month( day.year, day.month - 1 ) if day.month > 1 else self.month( day.year - 1, 12 )
+
+  def current( self ):
+    # Am Tag ihres Erscheinens ist eine Ausgabe noch nicht online
+    return self.issue_for( dt.date.today() - dt.timedelta( 1 ) )
+
+  def neighbors( self, issue ):
     '''
-    Liefert eine Artikelseite aus
+    Tupel (vorige, nächste Ausgabe) zur Ausgabe issue, None wenn es die
+    Ausgabe nicht gibt
     '''
-    stylesheet = url_for('static',filename='css/article_styles.css')
-    stylesheet_content = url_for('static',filename='css/index_styles.css')
-    stylesheet_foundation = url_for('static',filename='css/foundation.css')
-    js_foundation = url_for('static',filename='js/vendor/foundation.js')
-    js_jquery = url_for('static',filename='js/vendor/jquery.js')
-    js_what_input = url_for('static',filename='js/vendor/what-input.js')
-    js_app = url_for('static',filename='js/app.js')
-    article_path = "%s/artikel/%s" % (src_root,article)
-    article_i = ArticlePage( )   
-    return article_i.make(article_path,
-        logo = url_for('static', filename="logofficiel-enlong.png"),
-        issues = content['issues'],
-        current = content[ 'current' ],
-        next=content[ 'artikel/' + article ],
-        home = url_for('index',filename = pubdate),
-        stylesheet = stylesheet,
-        stylesheet_content = stylesheet_content,
-        stylesheet_foundation = stylesheet_foundation,
-        js_foundation = js_foundation,
-        js_jquery = js_jquery,
-        js_what_input = js_what_input,
-        js_app = js_app )
-  
-  @app.route('/fonts/<fname>')
-  def get_fonts(fname):
-    return send_from_directory( font_folder, fname )
+    i = self.find( issue )
+    if i is None:
+      return None
+    return self.dates[i-1] if i > 0 else None, self.dates[i+1] if i + 1 < len( self.dates ) else None
 
-  # configure Flask logging
-  from logging import FileHandler, DEBUG, ERROR
-  logger = FileHandler('error.log')
-  app.logger.setLevel(ERROR)
-  app.logger.addHandler(logger)
-    
-  # allow for server options
-  import argparse
-    
-  server = argparse.ArgumentParser(description="Startet den Appserver")
-  server.add_argument("-p", "--port", help="Port des Servers", type=int, default=8000)
-  server.add_argument("--options", help="Weitere Flask-Server-Optionen als kommaseparierte key=value-Paare", type=str, default=None)
-  server.add_argument("-d", "--debug", help="Schaltet debug mode ein", action='store_true')
-  server.add_argument("-o", "--open", help="Öffnet den Server für LAN und ggf. WAN", action='store_true')
-  opts = server.parse_args()
-  server_opts = dict(debug=opts.debug,port=opts.port)
-  port = opts.port
-  if opts.debug:
-    app.logger.setLevel( DEBUG )
-  if opts.open: 
-    server_opts.update(host='0.0.0.0')
-  if opts.options:
-    key_value_pattern = re.compile('[a-zA-Z0-9_]*=.*')
-    kvs=opts.options.split(',')
+  def published( self, year=None ):
+    '''
+    Die Einträge aller bis heute erschienenen Ausgaben, mit year nur die
+    eines Jahres, die neueste zuerst
+    '''
+    last = self.find( self.current() )
+    if last is None:
+      return []
+    lo, hi = 0, last + 1
+    if year is not None:
+      lo, hi = max( lo, self.position( year, 1 ) ), min( hi, self.position( year, 12 ) + 1 )
+    entries = self.entries[ lo:hi ][::-1] if lo < hi else []
+    # Die nächste Ausgabe der aktuellen ist noch nicht erschienen
+    if hi == last + 1 and entries:
+      entries[0] = dict( entries[0], next=None )
+    return entries
+
+  def years( self ):
+    '''
+    Alle Jahre mit Ausgaben bis heute, das neueste zuerst
+    '''
+    return range( self.current().year, self.start[0] - 1, -1 )
+
+issue_calendar = IssueCalendar()
+
+class HttpClient:
+  '''
+  HTTP-Client für die Seiten von monde-diplomatique.de. Je Host wird ein Pool
+  von höchstens pool_size offenen Verbindungen gehalten und wiederverwendet
+  (keep-alive). Verbindungsaufbau und Lesen haben eigene Timeouts in Sekunden.
+  Fehlgeschlagene Anfragen werden bis zu retries mal mit zufällig gestreuter,
+  exponentiell wachsender Wartezeit wiederholt. Scheitert eine Anfrage über
+  eine wiederverwendete Verbindung, hat der Server sie meist nur inzwischen
+  geschlossen: Sie wird dann gleich über eine neue wiederholt und zählt nicht
+  als Fehlschlag.
+
+  Schlagen max_failures Anfragen in Folge fehl, wird der Server für cooldown
+  Sekunden nicht mehr gefragt (circuit breaker), request() wirft dann sofort
+  einen IOError. Der http_cache liefert in dieser Zeit veraltete Seiten aus.
+  '''
+
+  redirects = (301, 302, 303, 307, 308)
+  options = ('pool_size', 'connect_timeout', 'read_timeout', 'retries', 'backoff', 'max_failures', 'cooldown')
+
+  def __init__( self, pool_size=8, connect_timeout=5, read_timeout=30, retries=2,
+      backoff=0.5, max_failures=5, cooldown=60 ):
+    self.pools = dict() # (scheme, host) -> (Semaphore, Queue freier Verbindungen)
+    self.lock = threading.Lock()
+    self.failures = 0
+    self.open_until = 0
+    self.configure( pool_size=pool_size, connect_timeout=connect_timeout,
+        read_timeout=read_timeout, retries=retries, backoff=backoff,
+        max_failures=max_failures, cooldown=cooldown )
+
+  def configure( self, **opts ):
+    '''
+    Setzt die Optionen aus __init__, etwa aus der Kommandozeile. Die Werte
+    dürfen auch Strings sein.
+    '''
+    for key, value in opts.items():
+      if key not in self.options:
+        raise TypeError( "unknown option %s" % key )
+      setattr( self, key, float( value ) if key in ('connect_timeout', 'read_timeout', 'backoff', 'cooldown') else int( value ) )
+    with self.lock:
+      self.pools = dict()
+
+  def pool( self, scheme, host ):
+    with self.lock:
+      if (scheme, host) not in self.pools:
+        self.pools[(scheme, host)] = ( threading.BoundedSemaphore( self.pool_size ), Queue( self.pool_size ) )
+      return self.pools[(scheme, host)]
+
+  def fetch( self, scheme, host, path, headers ):
+    '''
+    Eine einzelne Anfrage über eine Verbindung aus dem Pool. Gibt die
+    httplib-Antwort mit bereits gelesenem Inhalt in body zurück. Scheitert
+    sie über eine wiederverwendete Verbindung, gleich noch einmal über eine
+    neue.
+    '''
+    slots, idle = self.pool( scheme, host )
+    cls = httplib.HTTPSConnection if scheme == 'https' else httplib.HTTPConnection
+    with slots:
+      try:
+        conn, reused = idle.get_nowait(), True
+      except Empty:
+        conn, reused = cls( host, timeout=self.connect_timeout ), False
+      while True:
+        try:
+          if conn.sock is None:
+            conn.connect()
+            conn.sock.settimeout( self.read_timeout )
+          conn.request( 'GET', path, headers=headers )
+          response = conn.getresponse()
+          response.body = response.read()
+          break
+        except (IOError, socket.error, httplib.HTTPException):
+          conn.close()
+          if not reused:
+            raise
+          # Keep-alive-Verbindung vom Server geschlossen (BadStatusLine o.ä.)
+          metrics.count( 'upstream_stale_connections_total' )
+          conn, reused = cls( host, timeout=self.connect_timeout ), False
+        except Exception:
+          conn.close()
+          raise
+      if response.will_close:
+        conn.close()
+      else:
+        try:
+          idle.put_nowait( conn )
+        except Full:
+          conn.close()
+      return response
+
+  def follow( self, url, headers ):
+    '''
+    Holt url und folgt dabei bis zu fünf Weiterleitungen
+    '''
+    for hop in range( 5 ):
+      u = urlparse( url )
+      response = self.fetch( u.scheme, u.netloc, u.path + ( '?' + u.query if u.query else '' ), headers )
+      if response.status not in self.redirects:
+        break
+      url = urljoin( url, response.getheader('Location') )
+    return response
+
+  def request( self, url, headers=None ):
+    '''
+    Holt url und gibt die httplib-Antwort zurück, deren Inhalt in body steht.
+    Wirft IOError, wenn der Server nicht erreichbar ist oder mit einem Fehler
+    antwortet.
+    '''
+    if time.time() < self.open_until:
+      metrics.count( 'upstream_rejected_total' )
+      raise IOError( "circuit open, not fetching %s" % url )
+    headers = dict( headers or {}, **{'User-Agent': 'lmd', 'Accept-Encoding': 'identity'} )
+    for attempt in range( self.retries + 1 ):
+      if attempt:
+        metrics.count( 'upstream_retries_total' )
+        time.sleep( random.uniform( 0, self.backoff * 2 ** attempt ) )
+      try:
+        with metrics.timer( 'upstream' ):
+          response = self.follow( url, headers )
+      except (IOError, socket.error, httplib.HTTPException) as e:
+        metrics.count( 'upstream_responses_total', status='error' )
+        error = e
+        continue
+      metrics.count( 'upstream_responses_total', status=response.status )
+      if response.status < 500:
+        break
+      error = "HTTP %d" % response.status
+    else:
+      metrics.count( 'upstream_errors_total' )
+      with self.lock:
+        self.failures += 1
+        if self.failures >= self.max_failures and time.time() >= self.open_until:
+          self.open_until = time.time() + self.cooldown
+          log.error( "%d failed requests in a row, pausing upstream for %ds", self.failures, self.cooldown )
+      raise IOError( "Could not fetch %s: %s" % ( url, error ) )
+    with self.lock:
+      self.failures = 0
+    if response.status >= 400:
+      metrics.count( 'upstream_errors_total' )
+      raise IOError( "Could not fetch %s: HTTP %d" % ( url, response.status ) )
+    return response
+
+http_client = HttpClient()
+
+re_issue_date = re.compile('text=(\d{4}-\d{2}-\d{2})')
+
+class HttpCache:
+  '''
+  Plattencache für die von monde-diplomatique.de geholten Seiten. Die Antworten
+  werden roh unter dem SHA1 der URL abgelegt, daneben die Metadaten (ETag,
+  Last-Modified, Zeitpunkt des Holens und der letzten Änderung) als JSON. Ist die Lebensdauer eines
+  Eintrags abgelaufen, wird beim Server mit If-None-Match/If-Modified-Since
+  nachgefragt. Übersteigt der Cache max_size Bytes, werden die am längsten
+  nicht benutzten Einträge gelöscht.
+
+  Archivierte Ausgaben ändern sich nicht mehr und bekommen ttl_archive, die
+  aktuelle Ausgabe und ihre Artikel nur ttl_current (jeweils in Sekunden).
+  '''
+
+  def __init__( self, dirname=dirname_http_cache, max_size=256*2**20,
+      ttl_archive=30*24*3600, ttl_current=3600 ):
+    self.dirname = dirname
+    self.max_size = max_size
+    self.ttl_archive = ttl_archive
+    self.ttl_current = ttl_current
+    self.current = dict() # JJJJ-MM-TT -> Pfade der Artikel der aktuellen Ausgabe
+    self.stats = dict( hits=0, revalidated=0, misses=0, stale=0 )
+    self.lock = threading.Lock()
+    self.entries = None   # key -> Größe, in der Reihenfolge der Benutzung
+    self.size = 0
+
+  def path( self, key, ext='' ):
+    return p.join( self.dirname, key + ext )
+
+  def load_entries( self ):
+    '''
+    Liest beim ersten Zugriff den Bestand des Cache-Verzeichnisses ein. Die
+    Reihenfolge der Benutzung ergibt sich aus den Änderungszeiten der Dateien.
+    '''
+    try:
+      os.makedirs( self.dirname )
+    except OSError as e:
+      # Etwa wenn die Prozesse von fetch-lmd.py gleichzeitig starten
+      if e.errno != errno.EEXIST:
+        raise
+    entries = []
+    for fname in os.listdir( self.dirname ):
+      if fname.endswith('.body'):
+        st = os.stat( p.join( self.dirname, fname ) )
+        entries.append( ( st.st_mtime, fname[:-5], st.st_size ) )
+    entries.sort()
+    self.entries = OrderedDict( ( key, size ) for mtime, key, size in entries )
+    self.size = sum( self.entries.values() )
+
+  def touch( self, key, size=None ):
+    '''
+    Markiert einen Eintrag als zuletzt benutzt und räumt ggf. auf. Gibt False
+    zurück, wenn ein anderer Prozess den Eintrag inzwischen gelöscht hat.
+    size: Größe eines neu geschriebenen Eintrags
+    '''
+    with self.lock:
+      if self.entries is None:
+        self.load_entries()
+      old = self.entries.pop( key, None )
+      if size is None:
+        size = old or 0
+        try:
+          os.utime( self.path( key, '.body' ), None )
+        except OSError as e:
+          if e.errno != errno.ENOENT:
+            raise
+          self.size -= size
+          return False
+      self.size += size - ( old or 0 )
+      self.entries[key] = size
+      while self.size > self.max_size and len( self.entries ) > 1:
+        victim, vsize = self.entries.popitem( last=False )
+        self.size -= vsize
+        for ext in ('.body', '.json'):
+          try:
+            os.remove( self.path( victim, ext ) )
+          except OSError as e:
+            if e.errno != errno.ENOENT:
+              raise
+    return True
+
+  def count( self, stat ):
+    with self.lock:
+      self.stats[stat] += 1
+
+  def is_current( self, url ):
+    '''
+    True, wenn url auf den Index der aktuellen Ausgabe (oder einer noch nicht
+    erschienenen) verweist
+    '''
+    m = re_issue_date.search( url )
+    return bool( m ) and m.group(1) >= get_current_issue_date().strftime('%Y-%m-%d')
+
+  def mark_current( self, date, paths ):
+    '''
+    Merkt sich die Pfade der Artikel der aktuellen Ausgabe vom date
+    (JJJJ-MM-TT). Die früherer Ausgaben werden dabei vergessen, sie sind jetzt
+    archiviert.
+    '''
+    current = get_current_issue_date().strftime('%Y-%m-%d')
+    with self.lock:
+      self.current[date] = set( paths )
+      for old in [ d for d in self.current if d < current ]:
+        del self.current[old]
+
+  def ttl_for( self, url ):
+    '''
+    Lebensdauer eines Eintrags in Sekunden
+    '''
+    if self.is_current( url ):
+      return self.ttl_current
+    # Auch wenn noch niemand den Index der neuen Ausgabe geholt hat, gelten die
+    # Artikel der alten schon als archiviert
+    path = urlparse( url ).path.lstrip('/')
+    current = get_current_issue_date().strftime('%Y-%m-%d')
+    with self.lock:
+      if any( path in paths for date, paths in self.current.items() if date >= current ):
+        return self.ttl_current
+    return self.ttl_archive
+
+  def write( self, key, body, meta ):
+    '''
+    Schreibt Inhalt und Metadaten. Über den Umweg einer temporären Datei mit
+    eindeutigem Namen, damit parallel laufende Threads und Prozesse nie eine
+    halbe Datei lesen oder sich gegenseitig überschreiben.
+    '''
+    for ext, data in ( ('.body', body), ('.json', json.dumps( meta )) ):
+      fd, tmp = tempfile.mkstemp( prefix=key + ext + '.', dir=self.dirname )
+      try:
+        with os.fdopen( fd, 'wb' ) as f:
+          f.write( data )
+        os.rename( tmp, self.path( key, ext ) )
+      except Exception:
+        os.remove( tmp )
+        raise
+
+  def get( self, url ):
+    '''
+    Gibt den Inhalt der Seite url zurück, aus dem Cache oder frisch geholt
+    '''
+    key = sha1( url ).hexdigest()
+    with self.lock:
+      if self.entries is None:
+        self.load_entries()
+      cached = key in self.entries
+    meta = None
+    if cached:
+      try:
+        with open( self.path( key, '.json' ) ) as f:
+          meta = json.load( f )
+        with open( self.path( key, '.body' ), 'rb' ) as f:
+          body = f.read()
+      except (IOError, ValueError):
+        meta = None
+    if meta and time.time() - meta['fetched'] < self.ttl_for( url ):
+      if self.touch( key ):
+        self.count('hits')
+        return body
+      # Ein anderer Prozess hat den Eintrag eben gelöscht
+      meta = None
+    headers = dict()
+    if meta and meta.get('etag'):
+      headers['If-None-Match'] = meta['etag']
+    if meta and meta.get('last_modified'):
+      headers['If-Modified-Since'] = meta['last_modified']
+    try:
+      response = http_client.request( url, headers )
+    except IOError:
+      if not meta:
+        raise
+      # Server nicht erreichbar, dann eben die veraltete Seite
+      log.error( "Could not fetch %s, serving stale copy", url )
+      self.count('stale')
+      return body
+    if response.status == 304 and meta:
+      self.count('revalidated')
+      meta.setdefault( 'changed', meta['fetched'] )
+      meta.update( fetched=time.time() )
+      self.write( key, body, meta )
+      self.touch( key, len( body ) )
+      return body
+    self.count('misses')
+    now = changed = time.time()
+    # Ohne 304 kommt oft doch derselbe Inhalt, dann hat sich nichts geändert
+    if meta and body == response.body:
+      changed = meta.get( 'changed', meta['fetched'] )
+    body = response.body
+    meta = dict( url=url, fetched=now, changed=changed,
+        etag=response.getheader('ETag'), last_modified=response.getheader('Last-Modified') )
+    self.write( key, body, meta )
+    self.touch( key, len( body ) )
+    return body
+
+  def changed( self, url ):
+    '''
+    Zeitpunkt (time.time()), zu dem sich der Inhalt der Seite url zuletzt
+    geändert hat, None wenn sie nicht im Cache ist
+    '''
+    try:
+      with open( self.path( sha1( url ).hexdigest(), '.json' ) ) as f:
+        meta = json.load( f )
+    except (IOError, ValueError):
+      return None
+    return meta.get( 'changed', meta['fetched'] )
+
+http_cache = HttpCache()
+
+################################################################################
+#
+# Lokales Archiv
+#
+################################################################################
+
+re_archive_key = re.compile( r'^(?:archiv-text\?text=(\d{4}-\d{2}-\d{2})|artikel/!?(\d+))$' )
+
+# Ändert sich, was parse() liefert, muss die Version erhöht werden, damit die
+# geparsten Einträge im Archiv nicht mehr benutzt werden
+archive_parser_version = 1
+
+def archive_key( url ):
+  '''
+  Schlüssel einer Seite im Archiv, ihr Pfad ohne upstream_url, also etwa
+  archiv-text?text=2016-05-12 oder artikel/!5301234. URLs mit archive:/ statt
+  upstream_url werden nur aus dem Archiv gelesen. None für alle anderen URLs.
+  '''
+  for root in ( 'archive:', upstream_url ):
+    if url.startswith( root + '/' ):
+      key = url[ len( root ) + 1: ]
+      return key if re_archive_key.match( key ) else None
+  return None
+
+class Archive:
+  '''
+  Lokale Kopie der Seiten von monde-diplomatique.de in einer SQLite-Datenbank,
+  gefüllt von sync_archive(). Zu jeder Seite liegen der rohe Quelltext und die
+  von parse() gelieferten Wertepaare, beide mit zlib komprimiert, und das ETag
+  für die nächste Synchronisierung. Die Seiten sind nach dem Datum der Ausgabe
+  und der Nummer der Artikel indiziert.
+
+  Gibt es das Archiv, lesen Page.fetch() und damit make_paper() und die Routen
+  der App zuerst dort. Wie bei SqliteStore bekommt jeder Thread und jeder
+  Prozess seine eigene Verbindung.
+  '''
+
+  def __init__( self, fname ):
+    self.fname = fname
+    self.local = threading.local()
+    if not p.isdir( p.dirname( p.abspath( fname ) ) ):
+      os.makedirs( p.dirname( p.abspath( fname ) ) )
+    db = self.db()
+    db.execute( '''create table if not exists pages (key text primary key, date text, article text,
+        raw blob, digest text, etag text, parsed blob, parser text, fetched real, changed real)''' )
+    if 'changed' not in [ row[1] for row in db.execute( 'pragma table_info(pages)' ) ]:
+      db.execute( 'alter table pages add column changed real' )
+    db.execute( 'create index if not exists pages_date on pages (date)' )
+    db.execute( 'create index if not exists pages_article on pages (article)' )
+    db.commit()
+
+  def db( self ):
+    if getattr( self.local, 'pid', None ) != os.getpid():
+      self.local.db = sqlite3.connect( self.fname, timeout=30 )
+      self.local.db.execute( 'pragma journal_mode=wal' )
+      self.local.db.execute( 'pragma synchronous=normal' )
+      self.local.pid = os.getpid()
+    return self.local.db
+
+  def get( self, key ):
+    '''
+    Der rohe Quelltext der Seite key, None wenn sie nicht im Archiv ist
+    '''
+    row = self.db().execute( 'select raw from pages where key = ?', ( key, ) ).fetchone()
+    return zlib.decompress( row[0] ) if row else None
+
+  def get_etag( self, key ):
+    row = self.db().execute( 'select etag from pages where key = ?', ( key, ) ).fetchone()
+    return row[0] if row else None
+
+  def get_changed( self, key ):
+    '''
+    Zeitpunkt (time.time()), zu dem sich der Quelltext der Seite key zuletzt
+    geändert hat, bei älteren Archiven der des letzten Holens
+    '''
+    row = self.db().execute( 'select coalesce(changed, fetched) from pages where key = ?', ( key, ) ).fetchone()
+    return row[0] if row else None
+
+  def put( self, key, raw, date, etag=None ):
+    '''
+    Speichert eine Seite. Die geparsten Wertepaare bleiben nur erhalten, wenn
+    sich der Quelltext nicht geändert hat.
+    date: Datum der Ausgabe, zu der die Seite gehört
+    '''
+    m = re_archive_key.match( key )
+    digest = sha1( raw ).hexdigest()
+    db = self.db()
+    with db:
+      db.execute( 'update pages set parsed = null, parser = null where key = ? and digest != ?', ( key, digest ) )
+      db.execute( '''insert or ignore into pages (key) values (?)''', ( key, ) )
+      db.execute( '''update pages set changed = ? where key = ? and (digest is null or digest != ?)''',
+          ( time.time(), key, digest ) )
+      db.execute( '''update pages set date = ?, article = ?, raw = ?, digest = ?, etag = ?, fetched = ?
+          where key = ?''', ( date, m and m.group(2), sqlite3.Binary( zlib.compress( raw ) ), digest, etag, time.time(), key ) )
+
+  def touch( self, key ):
+    '''
+    Merkt sich, dass die Seite eben unverändert bestätigt wurde
+    '''
+    db = self.db()
+    with db:
+      db.execute( 'update pages set fetched = ? where key = ?', ( time.time(), key ) )
+
+  def get_parsed( self, key, kind ):
+    '''
+    Die Wertepaare, die parse() der Klasse kind aus der Seite key gewonnen hat,
+    None wenn es keine gibt oder sie von einer anderen Version stammen
+    '''
+    row = self.db().execute( 'select parsed from pages where key = ? and parser = ?',
+        ( key, '%s/%d' % ( kind, archive_parser_version ) ) ).fetchone()
+    return json.loads( zlib.decompress( row[0] ) ) if row and row[0] else None
+
+  def put_parsed( self, key, kind, values ):
+    db = self.db()
+    with db:
+      db.execute( 'update pages set parsed = ?, parser = ? where key = ?', ( sqlite3.Binary( zlib.compress( json.dumps( values, default=Record.as_dict ) ) ),
+          '%s/%d' % ( kind, archive_parser_version ), key ) )
+
+  def articles( self, date ):
+    '''
+    Schlüssel aller archivierten Artikel der Ausgabe vom date
+    '''
+    return [ row[0] for row in self.db().execute(
+        'select key from pages where date = ? and article is not null', ( date, ) ) ]
+
+  def dates( self ):
+    '''
+    Daten aller archivierten Ausgaben
+    '''
+    return [ row[0] for row in self.db().execute(
+        "select date from pages where key like 'archiv-text%' order by date" ) ]
+
+fname_archive = os.environ.get( 'LMD_ARCHIVE', p.join( p.expanduser('~'), '.local', 'share', 'lmd', 'archive.db' ) )
+# Ohne vorheriges sync gibt es kein Archiv, dann wird immer geholt
+archive = Archive( fname_archive ) if p.exists( fname_archive ) else None
+
+def open_archive( fname=None ):
+  '''
+  Öffnet das Archiv fname (default fname_archive) oder legt es an und benutzt
+  es ab jetzt für alle Seiten
+  '''
+  global archive
+  archive = Archive( fname or fname_archive )
+  return archive
+
+def sync_archive( issues, jobs=8 ):
+  '''
+  Spiegelt die Ausgaben issues (datetime.date-Objekte) ins Archiv. Ausgaben,
+  die schon vollständig im Archiv liegen, werden übersprungen, außer der
+  aktuellen: deren Seiten werden mit If-None-Match erneut angefragt, weil sie
+  noch korrigiert werden können. Gibt die Anzahl geholter, unveränderter,
+  übersprungener und fehlgeschlagener Seiten zurück.
+  '''
+  stats = dict( fetched=0, unchanged=0, skipped=0, failed=0 )
+  lock = threading.Lock()
+  current = get_current_issue_date()
+
+  def sync_page( key, date, refresh=False ):
+    '''
+    Holt eine Seite ins Archiv und gibt ihren Quelltext zurück
+    '''
+    raw = archive.get( key )
+    if raw is not None and not refresh:
+      status = 'skipped'
+    else:
+      etag = archive.get_etag( key ) if raw is not None else None
+      try:
+        response = http_client.request( '%s/%s' % ( upstream_url, key ), { 'If-None-Match': etag } if etag else None )
+      except IOError as e:
+        log.error( "%s", e )
+        response = None
+      if response is None:
+        status = 'failed'
+      elif response.status == 304 and raw is not None:
+        archive.touch( key )
+        status = 'unchanged'
+      else:
+        raw = response.body
+        archive.put( key, raw, date, response.getheader('ETag') )
+        status = 'fetched'
+    with lock:
+      stats[status] += 1
+    return raw
+
+  pool = ThreadPool( max( 1, jobs ) )
+  try:
+    for issue in issues:
+      date = issue.strftime('%Y-%m-%d')
+      refresh = issue >= current
+      raw = sync_page( 'archiv-text?text=%s' % date, date, refresh )
+      if raw is None:
+        continue
+      index = IndexPage()
+      index.parse( index.make_soup( raw ) )
+      hrefs = [ article['href'] for article in index.get_content()['articles'] ]
+      pool.map( lambda href : sync_page( href, date, refresh ), [ href for href in hrefs if re_archive_key.match( href ) ] )
+      log.debug( "Issue %s synced: %s", date, stats )
+  finally:
+    pool.close()
+    pool.join()
+  return stats
+
+################################################################################
+#
+# Volltextsuche
+#
+################################################################################
+
+re_html_tag   = re.compile( r'<[^>]*>' )
+re_word       = re.compile( r'\w+', re.U )
+umlaut_folds  = { u'ä': u'ae', u'ö': u'oe', u'ü': u'ue', u'ß': u'ss', u'é': u'e', u'è': u'e', u'à': u'a' }
+re_umlaut     = re.compile( u'|'.join( umlaut_folds ) )
+stemming_suffixes = ( u'ern', u'em', u'en', u'er', u'es', u'e', u's', u'n' )
+stopwords = set( u'''aber als am an auch auf aus bei bin bis bist da dadurch daher darum das dass dein deine dem den der des
+  dessen deshalb die dies dieser dieses doch dort du durch ein eine einem einen einer eines er es euer eure fuer hatte hatten
+  hattest hattet hier hinter ich ihr ihre im in ist ja jede jedem jeden jeder jedes jener jenes jetzt kann kannst koennen
+  koennt machen mein meine mit muss musst muesst nach nachdem nein nicht nun oder seid sein seine sich sie sind soll sollen
+  sollst sollt sonst soweit sowie und unser unsere unter vom von vor wann warum was weiter weitere wenn wer werde werden
+  werdet weshalb wie wieder wieso wir wird wirst wo woher wohin zu zum zur ueber'''.split() )
+html_parser = HTMLParser()
+
+def tokenize( text ):
+  '''
+  Zerlegt deutschen Text in Suchbegriffe: ohne Tags und Entities, klein,
+  Umlaute und ß umschrieben (München und Muenchen finden dasselbe), ohne
+  Stoppwörter und mit abgeschnittenen häufigen Endungen.
+  '''
+  if isinstance( text, str ):
+    text = text.decode( 'utf8', 'replace' )
+  text = html_parser.unescape( re_html_tag.sub( u' ', text ) ).lower()
+  text = re_umlaut.sub( lambda m : umlaut_folds[ m.group() ], text )
+  terms = []
+  for word in re_word.findall( text ):
+    if word in stopwords or len( word ) < 2:
+      continue
+    for suffix in stemming_suffixes:
+      if word.endswith( suffix ) and len( word ) - len( suffix ) >= 4:
+        word = word[ :-len( suffix ) ]
+        break
+    terms.append( word )
+  return terms
+
+def plain_text( html ):
+  return u' '.join( html_parser.unescape( re_html_tag.sub( u' ', html.decode( 'utf8', 'replace' )
+      if isinstance( html, str ) else html ) ).split() )
+
+# Gewicht der Felder beim Zählen der Begriffe
+search_fields = ( ('title', 3), ('author', 2), ('abstract', 2), ('body', 1) )
+search_header = struct.Struct( '<4sIIf' ) # Kennung, Anzahl Begriffe, Anzahl Dokumente, mittlere Länge
+search_magic  = 'LMS1'
+
+def update_search_index( fname=None ):
+  '''
+  Bringt den Suchindex auf den Stand des Archivs. Titel, Autor und Abstract
+  kommen aus den Indexseiten, der Text aus den Artikeln, jeweils so wie parse()
+  sie liefert. Die gezählten Begriffe jedes Artikels liegen mit einer
+  Prüfsumme in der Tabelle search_docs des Archivs, dazu in source die
+  Prüfsummen der Index- und der Artikelseite, aus denen sie stammen. Gelesen
+  und neu zerlegt werden nur Artikel, bei denen sich eine der beiden Seiten
+  seitdem geändert hat, das übrige Archiv wird gar nicht erst entpackt.
+
+  Daraus wird die Datei fname (default search.idx neben dem Archiv) neu
+  geschrieben, siehe SearchIndex, aber nur, wenn sich etwas geändert hat oder
+  sie fehlt. Gibt die Anzahl neuer, geänderter und unveränderter Artikel
+  zurück.
+  '''
+  fname = fname or search_index_name()
+  db = archive.db()
+  with db:
+    db.execute( '''create table if not exists search_docs (id integer primary key, key text unique, digest text,
+        date text, title text, author text, abstract text, length integer, terms blob, source text)''' )
+    if 'source' not in [ row[1] for row in db.execute( 'pragma table_info(search_docs)' ) ]:
+      db.execute( 'alter table search_docs add column source text' )
+  stats = dict( added=0, updated=0, unchanged=0 )
+  todo = dict() # Datum -> { Schlüssel des Artikels: source }
+  for date, key, source in db.execute( '''select a.date, a.key, i.digest || a.digest from pages a
+      join pages i on i.key = 'archiv-text?text=' || a.date
+      left join search_docs s on s.key = a.key
+      where a.article is not null and ( s.source is null or s.source != i.digest || a.digest )''' ):
+    todo.setdefault( date, dict() )[key] = source
+  # Was nicht in todo ist, ist unverändert
+  stats['unchanged'] = db.execute( 'select count(*) from search_docs' ).fetchone()[0]
+  for date in sorted( todo ):
+    index = IndexPage()
+    if index.load( 'archive:/archiv-text?text=%s' % date ) is None:
+      continue
+    for entry in index.get_content()['articles']:
+      key = entry['href']
+      if key not in todo[date]:
+        continue
+      source = todo[date][key]
+      article = ArticlePage()
+      article.load( 'archive:/' + key )
+      dic = article.get_content()
+      fields = dict(
+        title = plain_text( entry.get('title') or dic.get('title') or u'' ),
+        author = plain_text( entry.get('author') or dic.get('author') or u'' ),
+        abstract = plain_text( entry.get('abstract') or dic.get('teaser') or u'' ),
+        body = plain_text( u' '.join( dic.get( k ) or u'' for k in ( 'teaser', 'initial', 'first_letter', 'chunk', 'first', 'content', 'footnotes' ) ) ) )
+      digest = sha1( json.dumps( fields, sort_keys=True ) ).hexdigest()
+      row = db.execute( 'select digest from search_docs where key = ?', ( key, ) ).fetchone()
+      if row:
+        stats['unchanged'] -= 1
+      if row and row[0] == digest:
+        with db:
+          db.execute( 'update search_docs set source = ? where key = ?', ( source, key ) )
+        stats['unchanged'] += 1
+        continue
+      tf = dict()
+      for field, weight in search_fields:
+        for term in tokenize( fields[field] ):
+          tf[term] = tf.get( term, 0 ) + weight
+      with db:
+        db.execute( 'insert or ignore into search_docs (key) values (?)', ( key, ) )
+        db.execute( '''update search_docs set digest = ?, date = ?, title = ?, author = ?, abstract = ?, length = ?, terms = ?,
+            source = ? where key = ?''', ( digest, date, fields['title'], fields['author'], fields['abstract'][:500], sum( tf.values() ),
+            sqlite3.Binary( zlib.compress( json.dumps( tf ) ) ), source, key ) )
+      stats['updated' if row else 'added'] += 1
+  if stats['added'] or stats['updated'] or not p.exists( fname ):
+    write_search_index( fname, db )
+  return stats
+
+def write_search_index( fname, db ):
+  '''
+  Schreibt den invertierten Index aus search_docs nach fname. Aufbau, alle
+  Zahlen als uint32 little-endian:
+
+    Kopf (search_header)
+    Ids der Dokumente in search_docs, ihre Längen
+    Anfang jedes Begriffs im Begriffsbereich, Anfang jeder Postingliste
+    Begriffe (utf8, sortiert), Postinglisten
+
+  Eine Postingliste besteht aus den Nummern der Dokumente (uint32) und danach
+  deren gewichteten Häufigkeiten (uint16). Feste Breiten statt varints, damit
+  sie beim Suchen mit array.fromstring statt Byte für Byte gelesen werden.
+  '''
+  ids, lengths = array( 'I' ), array( 'I' )
+  postings = dict()
+  for rowid, length, terms in db.execute( 'select id, length, terms from search_docs order by id' ):
+    pos = len( ids )
+    ids.append( rowid )
+    lengths.append( length )
+    for term, n in json.loads( zlib.decompress( terms ) ).iteritems():
+      postings.setdefault( term.encode('utf8'), array( 'I' ) ).extend( ( pos, n ) )
+  terms = sorted( postings )
+  term_offsets, post_offsets = array( 'I', [0] ), array( 'I', [0] )
+  term_area, post_area = bytearray(), bytearray()
+  for term in terms:
+    term_area += term
+    term_offsets.append( len( term_area ) )
+    entries = postings[term]
+    post_area += entries[0::2].tostring() + array( 'H', ( min( n, 0xffff ) for n in entries[1::2] ) ).tostring()
+    post_offsets.append( len( post_area ) )
+  tmp = '%s.%d' % ( fname, os.getpid() )
+  with open( tmp, 'wb' ) as f:
+    f.write( search_header.pack( search_magic, len( terms ), len( ids ), float( sum( lengths ) ) / len( ids ) if ids else 0 ) )
+    for a in ( ids, lengths, term_offsets, post_offsets ):
+      f.write( a.tostring() )
+    f.write( term_area )
+    f.write( post_area )
+  os.rename( tmp, fname )
+
+def search_index_name():
+  return p.join( p.dirname( p.abspath( archive.fname if archive else fname_archive ) ), 'search.idx' )
+
+class SearchIndex:
+  '''
+  Sucht mit BM25 in der Datei von write_search_index(). Die Datei wird nur per
+  mmap eingeblendet und bei jeder Suche binär nach den Begriffen durchsucht,
+  der Start kostet also nichts. Wurde sie neu geschrieben, wird sie bei der
+  nächsten Suche neu eingeblendet.
+
+  index = SearchIndex( 'search.idx' )
+  total, hits = index.search( u'Globalisierung Gewerkschaften' )
+  '''
+
+  k1, b = 1.2, 0.75
+
+  def __init__( self, fname ):
+    self.fname = fname
+    self.stat = None
+    self.lock = threading.Lock()
+
+  def open( self ):
+    '''
+    Blendet die Datei ein, falls sie neu ist. Gibt False zurück, wenn es sie
+    nicht gibt.
+    '''
+    try:
+      st = os.stat( self.fname )
+    except OSError:
+      return False
+    with self.lock:
+      if self.stat and ( st.st_ino, st.st_mtime ) == self.stat:
+        return True
+      with open( self.fname, 'rb' ) as f:
+        mm = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+      magic, n_terms, n_docs, avgdl = search_header.unpack_from( mm, 0 )
+      if magic != search_magic:
+        raise ValueError( "%s is not a search index" % self.fname )
+      base = search_header.size
+      self.ids, base = base, base + 4 * n_docs
+      self.lengths, base = base, base + 4 * n_docs
+      self.term_offsets, base = base, base + 4 * ( n_terms + 1 )
+      self.post_offsets, base = base, base + 4 * ( n_terms + 1 )
+      self.terms = base
+      self.postings = base + struct.unpack_from( '<I', mm, self.term_offsets + 4 * n_terms )[0]
+      self.mm, self.n_terms, self.n_docs, self.avgdl = mm, n_terms, n_docs, avgdl
+      # Der von der Länge abhängige Teil von BM25, einmal je Dokument
+      lengths = array( 'I', mm[ self.lengths:self.lengths + 4 * n_docs ] )
+      self.norms = [ self.k1 * ( 1 - self.b + self.b * dl / avgdl ) for dl in lengths ]
+      self.stat = ( st.st_ino, st.st_mtime )
+    return True
+
+  def term( self, i ):
+    start, end = struct.unpack_from( '<II', self.mm, self.term_offsets + 4 * i )
+    return self.mm[ self.terms + start:self.terms + end ]
+
+  def lookup( self, term ):
+    '''
+    Die Postingliste des Begriffs als zwei Arrays, Dokumente und Häufigkeiten
+    '''
+    term = term.encode('utf8')
+    lo, hi = 0, self.n_terms
+    while lo < hi:
+      mid = ( lo + hi ) // 2
+      if self.term( mid ) < term:
+        lo = mid + 1
+      else:
+        hi = mid
+    if lo == self.n_terms or self.term( lo ) != term:
+      return array( 'I' ), array( 'H' )
+    start, end = struct.unpack_from( '<II', self.mm, self.post_offsets + 4 * lo )
+    split = self.postings + start + ( end - start ) // 6 * 4
+    return array( 'I', self.mm[ self.postings + start:split ] ), array( 'H', self.mm[ split:self.postings + end ] )
+
+  def search( self, query, limit=20, offset=0 ):
+    '''
+    Gibt die Anzahl der Treffer und die Treffer limit ab offset als Liste von
+    (Id in search_docs, Punkte) zurück, die besten zuerst
+    '''
+    if not self.open():
+      return 0, []
+    scores = dict()
+    norms = self.norms
+    for term in set( tokenize( query ) ):
+      docs, tfs = self.lookup( term )
+      if not docs:
+        continue
+      weight = math.log( 1 + ( self.n_docs - len( docs ) + 0.5 ) / ( len( docs ) + 0.5 ) ) * ( self.k1 + 1 )
+      for doc, tf in izip( docs, tfs ):
+        scores[doc] = scores.get( doc, 0 ) + weight * tf / ( tf + norms[doc] )
+    ranked = heapq.nlargest( offset + limit, scores.iteritems(), key=lambda item : item[1] )[offset:]
+    return len( scores ), [ ( struct.unpack_from( '<I', self.mm, self.ids + 4 * doc )[0], score ) for doc, score in ranked ]
+
+def measure( value ):
+  '''
+  Schätzt den Speicherbedarf eines Cache-Eintrags anhand der enthaltenen Strings
+  '''
+  if isinstance( value, basestring ):
+    return len( value )
+  if isinstance( value, dict ):
+    return sum( measure( k ) + measure( v ) for k, v in value.iteritems() )
+  if isinstance( value, (list, tuple) ):
+    return sum( measure( v ) for v in value )
+  return 8
+
+class RenderCache:
+  '''
+  Hält fertig gerenderte Seiten der Webapp im Speicher, begrenzt durch die
+  Anzahl der Einträge und ihre geschätzte Größe in Bytes (LRU). Fragen mehrere
+  Threads gleichzeitig nach einem fehlenden Eintrag, erzeugt ihn nur der erste,
+  die anderen warten auf dessen Ergebnis.
+
+  rc = RenderCache()
+  response = rc.get( '/artikel/!123', lambda: ArticlePage().make( url ) )
+  '''
+
+  def __init__( self, max_entries=512, max_size=64*2**20 ):
+    self.max_entries = max_entries
+    self.max_size = max_size
+    self.entries = OrderedDict() # key -> (Wert, Größe)
+    self.pending = dict()        # key -> laufende Erzeugung
+    self.size = 0
+    self.stats = dict( hits=0, misses=0, shared=0 )
+    self.lock = threading.Lock()
+
+  def get( self, key, build ):
+    '''
+    Gibt den Eintrag key zurück und erzeugt ihn falls nötig mit build()
+    '''
+    value, flight = self.claim( key )
+    if flight is None:
+      return value
+    try:
+      value = build()
+    except Exception as e:
+      self.finish( key, flight, error=e )
+      raise
+    self.finish( key, flight, value )
+    return value
+
+  def claim( self, key ):
+    '''
+    Wie get(), aber ohne build(): gibt ein Tupel (Eintrag, None) zurück, wenn
+    der Eintrag im Cache liegt oder gerade von einem anderen Thread erzeugt
+    wurde (darauf wird gewartet). Sonst (None, flight), dann muss der Aufrufer
+    den Eintrag erzeugen und in jedem Fall finish() aufrufen, die anderen
+    Threads warten so lange.
+    '''
+    while True:
+      with self.lock:
+        if key in self.entries:
+          self.stats['hits'] += 1
+          entry = self.entries.pop( key )
+          self.entries[key] = entry
+          return entry[0], None
+        flight = self.pending.get( key )
+        if flight is None:
+          self.stats['misses'] += 1
+          flight = self.pending[key] = dict( done=threading.Event() )
+          return None, flight
+        self.stats['shared'] += 1
+      flight['done'].wait()
+      if 'error' in flight:
+        raise flight['error']
+      if flight['value'] is not None:
+        return flight['value'], None
+      # Abgebrochen, etwa weil der Browser nicht zu Ende gelesen hat
+
+  def finish( self, key, flight, value=None, error=None ):
+    '''
+    Schließt eine Erzeugung aus claim() ab: mit value wird der Eintrag
+    gespeichert, mit error bekommen die Wartenden den Fehler, ohne beides gilt
+    sie als abgebrochen und der nächste Wartende versucht es selbst. Nur der
+    erste Aufruf je flight zählt.
+    '''
+    size = measure( value ) if value is not None else 0
+    with self.lock:
+      if self.pending.get( key ) is not flight:
+        return
+      if value is not None:
+        self.insert( key, value, size )
+      del self.pending[key]
+    if error is not None:
+      flight['error'] = error
+    flight['value'] = value
+    flight['done'].set()
+
+  def put( self, key, value ):
+    size = measure( value )
+    with self.lock:
+      self.insert( key, value, size )
+
+  def insert( self, key, value, size ):
+    # Nur mit self.lock aufrufen
+    if key in self.entries:
+      self.size -= self.entries.pop( key )[1]
+    self.entries[key] = ( value, size )
+    self.size += size
+    while self.entries and ( self.size > self.max_size or len( self.entries ) > self.max_entries ):
+      self.size -= self.entries.popitem( last=False )[1][1]
+
+  def invalidate( self, prefix='' ):
+    '''
+    Entfernt alle Einträge, deren Schlüssel mit prefix beginnt. Gibt die
+    entfernten Schlüssel zurück.
+    '''
+    with self.lock:
+      keys = [ key for key in self.entries if key.startswith( prefix ) ]
+      for key in keys:
+        self.size -= self.entries.pop( key )[1]
+    return keys
+
+def rendered( text, last_modified=None ):
+  '''
+  Macht aus einer gerenderten Seite einen Eintrag für den RenderCache, damit
+  Prüfsumme und Kompression nur einmal pro Seite berechnet werden.
+  last_modified: datetime der letzten Änderung oder None
+  '''
+  body = text.encode('utf8') if isinstance( text, unicode ) else text
+  packed = gzip_bytes( body )
+  return dict( body=body, etag=sha1( body ).hexdigest(),
+      gzip=packed if len( packed ) < len( body ) * 0.9 else None, last_modified=last_modified )
+
+def issue_datetime( date ):
+  '''
+  Erscheinungsdatum JJJJ-MM-TT als datetime (0 Uhr UTC), None wenn date kein
+  Datum ist
+  '''
+  try:
+    return dt.datetime.strptime( date, '%Y-%m-%d' )
+  except ValueError:
+    return None
+
+# RSS-Dateien wollen das Datum nach RFC 822 mit englischen Namen, unabhängig
+# von der Sprachumgebung des Servers
+def http_date( when ):
+  return formatdate( timegm( when.timetuple() ), usegmt=True )
+
+################################################################################
+#
+# Zustand der Webapp
+#
+################################################################################
+
+class MemoryStore:
+  '''
+  Hält die Inhalte der Ausgaben (als Issue) und die Links zum
+  jeweils nächsten Artikel im Speicher des Prozesses. Reicht für einen
+  einzelnen Prozess mit beliebig vielen Threads.
+  '''
+
+  def __init__( self ):
+    self.issues = dict() # Datum -> Issue
+    self.links = dict()  # artikel/<id> -> (Datum, nächster Artikel)
+    self.prefixes = []   # invalidierte Präfixe, Generation n ist prefixes[n-1]
+    self.leases = dict() # Name -> (Besitzer, gültig bis)
+    self.lock = threading.Lock()
+
+  def put_issue( self, date, issue, links ):
+    '''
+    Speichert eine Ausgabe.
+    date:   Datum der Ausgabe im Format JJJJ-MM-TT
+    issue:  Issue, siehe IndexPage.issue()
+    links:  dict artikel/<id> -> Dateiname des nächsten Artikels
+    '''
+    with self.lock:
+      self.issues[date] = issue
+      for href, next_article in links.items():
+        self.links[href] = ( date, next_article )
+
+  def get_issue( self, date ):
+    return self.issues.get( date )
+
+  def get_article( self, href ):
+    '''
+    Gibt für einen Artikel das Tupel (Datum der Ausgabe, nächster Artikel)
+    zurück, None wenn die Ausgabe noch nicht gespeichert ist.
+    '''
+    return self.links.get( href )
+
+  def invalidate( self, prefix ):
+    '''
+    Merkt sich, dass alle gerenderten Seiten unter prefix veraltet sind, und
+    gibt die neue Generation zurück. Jeder Prozess holt das mit
+    invalidated_since() ab und leert seinen render_cache entsprechend.
+    '''
+    with self.lock:
+      self.prefixes.append( prefix )
+      return len( self.prefixes )
+
+  def generation( self ):
+    return len( self.prefixes )
+
+  def invalidated_since( self, generation ):
+    '''
+    Gibt ein Tupel (aktuelle Generation, seit generation invalidierte Präfixe)
+    zurück
+    '''
+    prefixes = self.prefixes[generation:]
+    return generation + len( prefixes ), prefixes
+
+  def lease( self, name, owner, seconds ):
+    '''
+    Gibt True zurück, wenn owner die Sperre name für die nächsten seconds
+    Sekunden hält: sie war frei, abgelaufen oder gehörte ihm schon. So wird
+    etwa unter allen Workern einer zum Vorwärmen bestimmt.
+    '''
+    now = time.time()
+    with self.lock:
+      holder, until = self.leases.get( name, ( None, 0 ) )
+      if holder != owner and until >= now:
+        return False
+      self.leases[name] = ( owner, now + seconds )
+      return True
+
+class SqliteStore:
+  '''
+  Wie MemoryStore, aber in einer SQLite-Datenbank im WAL-Modus, damit mehrere
+  Prozesse (zB gunicorn-Worker) denselben Zustand sehen. Jeder Thread bekommt
+  seine eigene Verbindung.
+  '''
+
+  def __init__( self, fname ):
+    self.fname = fname
+    self.local = threading.local()
+    db = self.db()
+    db.execute( 'create table if not exists issues (date text primary key, content text)' )
+    db.execute( 'create table if not exists links (href text primary key, date text, next text)' )
+    db.execute( 'create table if not exists invalidations (generation integer primary key autoincrement, prefix text)' )
+    db.execute( 'create table if not exists leases (name text primary key, owner text, until real)' )
+    db.commit()
+
+  def db( self ):
+    # Nach einem fork darf die Verbindung des Elternprozesses nicht benutzt werden
+    if getattr( self.local, 'pid', None ) != os.getpid():
+      self.local.db = sqlite3.connect( self.fname, timeout=30 )
+      self.local.db.execute( 'pragma journal_mode=wal' )
+      self.local.db.execute( 'pragma synchronous=normal' )
+      self.local.pid = os.getpid()
+    return self.local.db
+
+  def put_issue( self, date, issue, links ):
+    db = self.db()
+    with db:
+      db.execute( 'insert or replace into issues values (?, ?)', ( date, json.dumps( issue, default=Record.as_dict ) ) )
+      db.executemany( 'insert or replace into links values (?, ?, ?)',
+          [ ( href, date, next_article ) for href, next_article in links.items() ] )
+
+  def get_issue( self, date ):
+    row = self.db().execute( 'select content from issues where date = ?', ( date, ) ).fetchone()
+    return Issue.from_dict( json.loads( row[0] ) ) if row else None
+
+  def get_article( self, href ):
+    row = self.db().execute( 'select date, next from links where href = ?', ( href, ) ).fetchone()
+    return tuple( row ) if row else None
+
+  def invalidate( self, prefix ):
+    db = self.db()
+    with db:
+      return db.execute( 'insert into invalidations (prefix) values (?)', ( prefix, ) ).lastrowid
+
+  def generation( self ):
+    return self.db().execute( 'select max(generation) from invalidations' ).fetchone()[0] or 0
+
+  def invalidated_since( self, generation ):
+    rows = self.db().execute( 'select generation, prefix from invalidations where generation > ? order by generation',
+        ( generation, ) ).fetchall()
+    return ( rows[-1][0] if rows else generation ), [ prefix for g, prefix in rows ]
+
+  def lease( self, name, owner, seconds ):
+    now = time.time()
+    db = self.db()
+    # Beide Anweisungen in einer Transaktion, ein anderer Prozess kann nicht
+    # dazwischen schreiben
+    with db:
+      db.execute( 'insert or ignore into leases values (?, ?, 0)', ( name, owner ) )
+      return db.execute( 'update leases set owner = ?, until = ? where name = ? and ( owner = ? or until < ? )',
+          ( owner, now + seconds, name, owner, now ) ).rowcount == 1
+
+class Warmer( threading.Thread ):
+  '''
+  Holt und rendert im Hintergrund die Seiten der letzten Ausgaben, damit schon
+  der erste Leser sie aus dem Cache bekommt: zuerst Index, Feed und Artikel der
+  aktuellen Ausgabe, dann die älteren. Die Seiten werden über den test_client
+  der App angefragt und landen so im render_cache und im store.
+
+  Danach wartet der Warmer auf das nächste berechnete Erscheinungsdatum und
+  prüft ab dann stündlich, ob eine neue Ausgabe erschienen ist. Ist das so,
+  wird on_new_issue() aufgerufen und neu vorgewärmt.
+
+  Teilen sich mehrere Worker den store, wärmt je Ausgabe nur einer vor, der
+  die Sperre warmer:<Datum> im store bekommt, die übrigen warten (standby).
+  Stirbt er dabei, läuft seine Sperre nach lease_time Sekunden ab und ein
+  anderer übernimmt.
+
+  app:          die Flask-App
+  store:        Zustand der App, liefert die Artikel einer Ausgabe
+  issues:       Funktion, die die Ausgabedaten liefert, neueste zuerst
+  on_new_issue: Funktion, die bei einer neuen Ausgabe aufgerufen wird
+  concurrency:  Anzahl gleichzeitiger Anfragen
+  '''
+
+  def __init__( self, app, store, issues, on_new_issue=None, concurrency=2, interval=3600, lease_time=300 ):
+    threading.Thread.__init__( self, name='Warmer' )
+    self.daemon = True
+    self.app = app
+    self.store = store
+    self.issues = issues
+    self.on_new_issue = on_new_issue
+    self.concurrency = concurrency
+    self.interval = interval
+    self.lease_time = lease_time
+    self.owner = '%s:%d:%x' % ( socket.gethostname(), os.getpid(), id( self ) )
+    # Die Zähler werden von den Threads des Pools erhöht und von
+    # /admin/warmer gelesen, nur mit self.lock
+    self.lock = threading.Lock()
+    self.progress = dict( state='starting', issue=None, issues_done=0, issues_total=0,
+        pages_done=0, pages_total=0, errors=0, next_check=None )
+
+  def update( self, **values ):
+    with self.lock:
+      self.progress.update( values )
+
+  def add( self, key, n=1 ):
+    with self.lock:
+      self.progress[key] += n
+
+  def status( self ):
+    '''
+    Kopie des Fortschritts, für /admin/warmer
+    '''
+    with self.lock:
+      return dict( self.progress )
+
+  def get( self, path ):
+    # buffered, damit auch gestreamte Seiten ganz gerendert im render_cache landen
+    response = self.app.test_client().get( path, buffered=True )
+    if response.status_code != 200:
+      log.error( "Warming %s failed with %d", path, response.status_code )
+      self.add( 'errors' )
+    self.add( 'pages_done' )
+
+  def warm( self, lease ):
+    '''
+    Wärmt alle Ausgaben vor, die neueste zuerst, und verlängert dabei nach
+    jeder Ausgabe die Sperre lease
+    '''
+    issues = self.issues()
+    self.update( state='warming', issues_done=0, issues_total=len( issues ), errors=0 )
+    pool = ThreadPool( max( 1, self.concurrency ) )
+    try:
+      for issue in issues:
+        date = issue.strftime('%Y-%m-%d')
+        self.update( issue=date, pages_done=0, pages_total=2 )
+        pool.map( self.get, [ '/%s' % date, '/rss/%s' % date ] )
+        content = self.store.get_issue( date ) or Issue()
+        paths = [ '/' + article['href'] for article in content['articles'] ]
+        self.add( 'pages_total', len( paths ) )
+        pool.map( self.get, paths )
+        self.add( 'issues_done' )
+        self.store.lease( lease, self.owner, self.lease_time )
+    finally:
+      pool.close()
+      pool.join()
+
+  def run( self ):
+    while True:
+      current = get_current_issue_date()
+      y, m = ( current.year, current.month + 1 ) if current.month < 12 else ( current.year + 1, 1 )
+      release = get_issue_date( y, m )
+      lease = 'warmer:%s' % current.isoformat()
+      while get_current_issue_date() == current:
+        if self.store.lease( lease, self.owner, self.lease_time ):
+          try:
+            self.warm( lease )
+          except Exception:
+            log.exception( "Warming failed" )
+          # Fertig, bis zur nächsten Ausgabe braucht es keinen anderen
+          until_release = ( dt.datetime.combine( release, dt.time() ) - dt.datetime.now() ).total_seconds()
+          self.store.lease( lease, self.owner, max( self.lease_time, until_release + self.interval ) )
+          break
+        self.update( state='standby' )
+        time.sleep( self.lease_time / 2.0 )
+      # Bis zum nächsten Erscheinungsdatum schlafen, dann stündlich nachsehen
+      self.update( state='waiting', next_check=release.isoformat() )
+      while get_current_issue_date() == current:
+        time.sleep( max( self.interval, ( dt.datetime.combine( release, dt.time() ) - dt.datetime.now() ).total_seconds() ) )
+      if self.on_new_issue:
+        self.on_new_issue()
+
+def make_store( url ):
+  '''
+  Erzeugt den Speicher für den Zustand der Webapp.
+  url: 'memory' oder 'sqlite:<Pfad der Datenbank>'
+  '''
+  if url == 'memory':
+    return MemoryStore()
+  if url.startswith('sqlite:'):
+    return SqliteStore( url[len('sqlite:'):] )
+  raise ValueError( "unknown state store %s" % url )
+
+################################################################################
+#
+# Statische Ressourcen
+#
+################################################################################
+
+re_css_comment = re.compile( r'/\*.*?\*/', re.S )
+re_css_space   = re.compile( r'\s*([{};,])\s*' )
+re_css_url     = re.compile( r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)' )
+
+def minify_css( css ):
+  '''
+  Entfernt Kommentare und überflüssigen Leerraum. Absichtlich vorsichtig: um
+  ':' bleibt Leerraum stehen, weil 'a :hover' etwas anderes ist als 'a:hover'.
+  '''
+  css = re_css_comment.sub( '', css )
+  css = re_css_space.sub( r'\1', ' '.join( css.split() ) )
+  return css.replace( ';}', '}' ).strip()
+
+def gzip_bytes( data ):
+  buf = StringIO()
+  # mtime=0, damit gleicher Inhalt auch dieselbe .gz-Datei ergibt
+  with gzip.GzipFile( filename='', mode='wb', compresslevel=9, fileobj=buf, mtime=0 ) as f:
+    f.write( data )
+  return buf.getvalue()
+
+def gzip_stream( chunks ):
+  '''
+  Komprimiert eine Folge von Stücken zu einer gzip-Datei, ohne sie zu sammeln.
+  Jedes Stück wird sofort weitergereicht, der Browser kann also schon anzeigen,
+  was bisher gerendert ist.
+  '''
+  packer = zlib.compressobj( 6, zlib.DEFLATED, 16 + zlib.MAX_WBITS )
+  for chunk in chunks:
+    yield packer.compress( chunk ) + packer.flush( zlib.Z_SYNC_FLUSH )
+  yield packer.flush()
+
+def compress( fname, data ):
+  '''
+  Legt neben fname fname.gz und, falls brotli installiert ist, fname.br ab,
+  sofern sich das lohnt. Schon komprimierte Formate wie woff2 oder png werden
+  so ausgelassen.
+  '''
+  variants = [ ( '.gz', gzip_bytes ) ]
+  if brotli:
+    variants.append( ( '.br', lambda data : brotli.compress( data, quality=11 ) ) )
+  for ext, compressor in variants:
+    packed = compressor( data )
+    if len( packed ) < len( data ) * 0.9:
+      with open( fname + ext, 'wb' ) as f:
+        f.write( packed )
+
+def build_assets( src=dirname_tpl_res, target=dirname_assets ):
+  '''
+  Schreibt alle Dateien unterhalb src mit dem Hash ihres Inhalts im Namen nach
+  target, zB css/article_styles.css -> css/article_styles.1a2b3c4d5e.css, und
+  legt komprimierte Varianten daneben. Weil sich der Name mit dem Inhalt
+  ändert, dürfen Browser die Dateien unbegrenzt zwischenspeichern.
+
+  CSS wird verkleinert und seine url()-Verweise auf die neuen Namen umgeschrieben,
+  deshalb kommt es erst nach allen anderen Dateien dran. Liegt neben einem
+  Skript eine .min.js-Fassung, wird diese verwendet. Die Zuordnung
+  ursprünglicher Pfad -> neuer Pfad steht in target/manifest.json, nicht mehr
+  referenzierte Dateien werden aus target entfernt.
+  '''
+  fnames = list()
+  for root, dnames, names in os.walk( src ):
+    fnames += [ p.relpath( p.join( root, name ), src ).replace( os.sep, '/' ) for name in names ]
+  manifest = dict()
+
+  def rewrite_url( css_name, m ):
+    url = m.group(2)
+    if ':' in url or url.startswith('/'):
+      return m.group(0)
+    path, sep, suffix = url.partition('#')
+    path, qsep, query = path.partition('?')
+    logical = p.normpath( p.join( p.dirname( css_name ), path ) ).replace( os.sep, '/' )
+    if logical not in manifest:
+      return m.group(0)
+    hashed = p.relpath( manifest[logical], p.dirname( css_name ) or '.' ).replace( os.sep, '/' )
+    return 'url(%s%s%s)' % ( hashed, qsep + query, sep + suffix )
+
+  for name in sorted( fnames, key=lambda name : name.endswith('.css') ):
+    root, ext = p.splitext( name )
+    if root.endswith('.min'):
+      continue
+    minified = p.join( src, root + '.min' + ext )
+    with open( minified if p.isfile( minified ) else p.join( src, name ), 'rb' ) as f:
+      data = f.read()
+    if ext == '.css':
+      data = minify_css( re_css_url.sub( lambda m : rewrite_url( name, m ), data ) )
+    hashed = '%s.%s%s' % ( root, sha1( data ).hexdigest()[:10], ext )
+    manifest[name] = hashed
+    fname = p.join( target, hashed )
+    if not p.isfile( fname ):
+      if not p.isdir( p.dirname( fname ) ):
+        os.makedirs( p.dirname( fname ) )
+      with open( fname, 'wb' ) as f:
+        f.write( data )
+      compress( fname, data )
+
+  keep = set( [ asset_manifest_name ] )
+  for hashed in manifest.values():
+    keep.update( [ hashed, hashed + '.gz', hashed + '.br' ] )
+  for root, dnames, names in os.walk( target ):
+    for name in names:
+      if p.relpath( p.join( root, name ), target ).replace( os.sep, '/' ) not in keep:
+        os.remove( p.join( root, name ) )
+  with open( p.join( target, asset_manifest_name ), 'wb' ) as f:
+    json.dump( manifest, f, indent=1, sort_keys=True )
+  return manifest
+
+def load_asset_manifest( target=dirname_assets ):
+  '''
+  Gibt das Manifest von build_assets() zurück, ein leeres dict, falls die
+  Ressourcen noch nicht gebaut wurden.
+  '''
+  try:
+    with open( p.join( target, asset_manifest_name ) ) as f:
+      return json.load( f )
+  except IOError:
+    return dict()
+
+################################################################################
+#
+# Die lMd-Webapp
+#
+################################################################################
+
+def create_app( state='memory', cache_entries=512, cache_size=64, warm=2, offline=False, stream=False, admin_token=None ):
+  '''
+  Webapp definieren. Mit mehreren Prozessen etwa so:
+
+  gunicorn -w 4 -b :8000 'lmd:create_app(state="sqlite:lmd-state.db")'
+
+  state:          Speicher für Ausgaben und Artikel-Links, siehe make_store()
+  cache_entries:  Maximale Anzahl gerenderter Seiten im Cache
+  cache_size:     Maximale Größe des Seiten-Caches in MB
+  warm:           Anzahl gleichzeitiger Anfragen beim Vorwärmen, 0 schaltet es ab
+  offline:        Liest alle Seiten nur aus dem Archiv, siehe sync_archive()
+  stream:         Schickt nicht zwischengespeicherte Ausgaben, Artikel und Feeds
+                  schon während des Renderns, siehe serve()
+  admin_token:    Geheimnis für /admin/invalidate, default ist $LMD_ADMIN_TOKEN.
+                  Ohne ist die Route abgeschaltet.
+  '''
+  from flask import Flask, Response, request, url_for, send_from_directory, redirect, abort, jsonify, g
+  from os import path
+  from logging import ERROR
+  from time import asctime
+  
+  curdir = path.abspath('.')
+  src_root = 'archive:' if offline else upstream_url
+  font_folder = '%s/%s/fonts' % ( curdir, dirname_tpl_res )
+  pubdate = ' '
+  app = Flask('LMd',static_folder= '%s/%s' % ( curdir, dirname_tpl_res))
+  content=dict() # App cache initialisieren
+
+  def update_issues():
+    '''
+    Liste der letzten zwölf Ausgaben finden und zwischenspeichern
+    '''
+    d = get_current_issue_date()
+    issues = get_issue_list( d.month, d.year )
+    # Links und Texte liegen im issue_calendar schon bereit
+    content['issues'] = [ issue_calendar.links[ issue_calendar.find( issue ) ] for issue in issues ]
+    content['issue_dates'] = issues
+  update_issues()
+
+  # Fertig gerenderte Seiten, Schlüssel ist der Pfad der Anfrage
+  render_cache = RenderCache( cache_entries, cache_size * 2**20 )
+  # Inhalte der Ausgaben und Links zwischen den Artikeln, ggf. von mehreren
+  # Prozessen geteilt
+  store = make_store( state ) if isinstance( state, basestring ) else state
+  app.store = store
+  app.render_cache = render_cache
+  app.config['ADMIN_TOKEN'] = admin_token or os.environ.get('LMD_ADMIN_TOKEN')
+  # Bis zu dieser Generation sind die Invalidierungen im store auf den
+  # render_cache angewandt, siehe apply_invalidations()
+  invalidations = dict( generation=store.generation() )
+  # Gebaute Ressourcen mit Hash im Namen, siehe build_assets()
+  asset_folder = '%s/%s' % ( curdir, dirname_assets )
+  assets = load_asset_manifest( asset_folder )
+
+  def asset_url( fname ):
+    '''
+    URL einer Datei unterhalb template_ressources, die gebaute Fassung, falls
+    vorhanden
+    '''
+    if fname in assets:
+      return '/assets/' + assets[fname]
+    return url_for( 'static', filename=fname )
+
+  def respond( entry, mimetype='text/html' ):
+    '''
+    Antwortet mit einem Eintrag von rendered(): mit gzip, wenn der Browser das
+    versteht, und nur mit 304, wenn er die Seite schon hat. Die Browser sollen
+    jedesmal nachfragen, das kostet dann aber nur die Header.
+    '''
+    if entry['gzip'] and request.accept_encodings['gzip']:
+      response = Response( entry['gzip'], mimetype=mimetype )
+      response.headers['Content-Encoding'] = 'gzip'
+      # Die komprimierte Fassung ist eine andere Darstellung, also ein anderes ETag
+      response.set_etag( entry['etag'] + '-gz' )
+    else:
+      response = Response( entry['body'], mimetype=mimetype )
+      response.set_etag( entry['etag'] )
+    if entry['last_modified']:
+      response.last_modified = entry['last_modified']
+    response.vary.add( 'Accept-Encoding' )
+    response.cache_control.no_cache = True
+    return response.make_conditional( request )
+
+  def serve( key, prepare, mimetype='text/html', cache=True ):
+    '''
+    Antwortet mit der Seite key aus dem render_cache. Fehlt sie dort, holt und
+    parsed prepare() sie und gibt ein Tupel (Page, last_modified) zurück. Mit
+    stream geht die Seite dann schon während des Renderns stückweise an den
+    Browser, ETag und Content-Length gibt es erst bei der nächsten Anfrage aus
+    dem render_cache. Wie bei render_cache.get() holt und rendert nur die erste
+    von mehreren gleichzeitigen Anfragen, die anderen warten auf die fertige
+    Seite.
+    cache: False, wenn die Seite nicht in den render_cache soll
+    '''
+    def build():
+      page, last_modified = prepare()
+      return rendered( page.make(), last_modified )
+    if not stream:
+      return respond( render_cache.get( key, build ) if cache else build(), mimetype )
+    flight = None
+    if cache:
+      entry, flight = render_cache.claim( key )
+      if entry:
+        return respond( entry, mimetype )
+    try:
+      page, last_modified = prepare()
+    except Exception as e:
+      if flight:
+        render_cache.finish( key, flight, error=e )
+      raise
+
+    def chunks():
+      # Ohne Cache muss die Seite nie ganz im Speicher liegen
+      body = [] if cache else None
+      for chunk in page.make_stream():
+        if cache:
+          body.append( chunk )
+        yield chunk
+      if flight:
+        render_cache.finish( key, flight, rendered( ''.join( body ), last_modified ) )
+
+    if request.accept_encodings['gzip']:
+      response = Response( gzip_stream( chunks() ), mimetype=mimetype )
+      response.headers['Content-Encoding'] = 'gzip'
+    else:
+      response = Response( chunks(), mimetype=mimetype )
+    if last_modified:
+      response.last_modified = last_modified
+    response.vary.add( 'Accept-Encoding' )
+    response.cache_control.no_cache = True
+    # Sonst sammelt make_conditional() die Stücke, um Content-Length zu setzen
+    response.implicit_sequence_conversion = False
+    if flight:
+      # Wird die Seite nicht zu Ende gelesen (304, Abbruch), warten die anderen
+      # Anfragen nicht ewig. Nach dem finish() in chunks() wirkungslos.
+      response.call_on_close( lambda : render_cache.finish( key, flight ) )
+    return response.make_conditional( request )
+  
+  @app.route('/')
+  def index():
+    '''
+    Die Überblicksseite mit den links zu den Ausgaben
+    '''
+    def build():
+      issues_page = Page(
+          template_name = tpl_entry_page,
+          charset = "utf8",
+          stylesheet = asset_url('css/index_styles.css'), 
+          logo = asset_url('logo.png'),
+          articles = content['issues'],
+          years = year_links() )
+      return rendered( issues_page.make() )
+    return respond( render_cache.get( request.path, build ) )
+
+  def year_links():
+    return [ dict( year=year, href='/archiv/%d' % year ) for year in issue_calendar.years() ]
+
+  @app.route('/archiv')
+  def browse_current():
+    return redirect( '/archiv/%d' % get_current_issue_date().year )
+
+  @app.route('/archiv/<int:year>')
+  def browse(year):
+    '''
+    Archiv: alle Ausgaben eines Jahres, mit Links zu den übrigen Jahren
+    '''
+    if year not in issue_calendar.years():
+      abort( 404 )
+    def build():
+      issues_page = Page(
+          template_name = tpl_entry_page,
+          charset = "utf8",
+          stylesheet = asset_url('css/index_styles.css'),
+          logo = asset_url('logo.png'),
+          articles = [ issue_calendar.links[ issue_calendar.find( entry['date'] ) ] for entry in issue_calendar.published( year ) ],
+          years = year_links(),
+          year = year )
+      return rendered( issues_page.make() )
+    return respond( render_cache.get( request.path, build ) )
+
+  @app.route('/issues')
+  def list_issues():
+    '''
+    Alle Ausgaben seit der ersten als JSON, die neueste zuerst, seitenweise:
+    /issues?page=n&per_page=m (24, höchstens 120), mit year=JJJJ nur die
+    eines Jahres. Jede Ausgabe mit Links und ihren Nachbarn.
+    '''
+    page = max( 1, request.args.get( 'page', 1, type=int ) )
+    per_page = min( 120, max( 1, request.args.get( 'per_page', 24, type=int ) ) )
+    year = request.args.get( 'year', None, type=int )
+    # Erst prüfen, damit nicht jede Seitenzahl und jedes Jahr einen eigenen
+    # Eintrag im render_cache bekommt
+    if year is not None and year not in issue_calendar.years():
+      abort( 404 )
+    entries = issue_calendar.published( year )
+    pages = ( len( entries ) + per_page - 1 ) // per_page
+    if page > max( 1, pages ):
+      abort( 404 )
+    def build():
+      start = ( page - 1 ) * per_page
+      return rendered( json.dumps( dict( total=len( entries ), page=page, per_page=per_page,
+          pages=pages, issues=entries[ start:start + per_page ] ) ) )
+    key = '/issues?year=%s&page=%d&per_page=%d' % ( year, page, per_page )
+    return respond( render_cache.get( key, build ), 'application/json' )
+
+  @app.route('/issues/<date>')
+  def find_issue(date):
+    '''
+    Die Ausgabe, die am Tag date (JJJJ-MM-TT) aktuell war, als JSON
+    '''
+    day = issue_datetime( date )
+    # Vor der ersten Ausgabe gibt es nichts zu rechnen, sonst landet etwa
+    # 0001-01-01 beim Vormonat im Jahr 0
+    if not day or day.date() < issue_calendar.dates[0]:
+      abort( 404 )
+    issue = issue_calendar.issue_for( day.date() )
+    i = issue_calendar.find( issue )
+    if i is None or issue > get_current_issue_date():
+      abort( 404 )
+    entry = issue_calendar.entries[i]
+    if issue == get_current_issue_date():
+      entry = dict( entry, next=None )
+    return jsonify( entry )
+
+  @app.route('/res/<path>')
+  def static_proxy(path):
+    '''
+    Alles unterhalb template_ressources
+    '''
+    # send_static_file will guess the correct MIME type
+    return app.send_static_file( path )
+  
+  def published_issue( date ):
+    '''
+    abort(404), wenn an date (JJJJ-MM-TT) keine Ausgabe erschienen ist. Sonst
+    holte jeder beliebige Pfad eine Seite von monde-diplomatique.de und
+    landete im render_cache und im store.
+    '''
+    i = issue_calendar.find( date )
+    if i is None or issue_calendar.dates[i] > get_current_issue_date():
+      abort( 404 )
+
+  @app.route('/rss/<date>')
+  def get_rss(date):
+    '''
+    Gibt einen Feed zurück
+    '''
+    published_issue( date )
+    def prepare():
+      logo = asset_url('logo.png')
+      issue_path = "%s/archiv-text?text=%s" % (src_root, date)
+      issue = IndexPage(template_name='%s/rss.xml' % dirname_templates )
+      # Je Ausgabe gleich, damit sich der Feed nur mit seinem Inhalt ändert
+      pubdate = http_date( issue_datetime( date ) )
+      issue.dic.update( logo = logo, pubdate = pubdate, builtdate = pubdate )
+      issue.load( issue_path )
+      return issue, issue.last_modified()
+    return serve( request.path, prepare, 'application/rss+xml' )
+  
+  @app.route('/<date>')
+  def get_issue(date):
+    '''
+    Gibt die Indexseite der Ausgabe mit Datum date zurück
+    '''
+    published_issue( date )
+    def prepare():
+      stylesheet = asset_url('css/index_styles.css')
+      logo = asset_url('logo.png')
+      issue_path = "%s/archiv-text?text=%s" % (src_root, date)
+      issue = IndexPage()
+      issue.dic.update( stylesheet = stylesheet, logo = logo )
+      issue.load( issue_path )
+      # Links zum jeweils nächsten Artikel
+      links = dict()
+      article_refs = map( lambda entry : entry['href'], issue.get_content()['articles'] )
+      i=0
+      while i < len(article_refs):
+        next_target = article_refs[ (i+1) % len(article_refs) ]
+        links[article_refs[i]] = p.basename( next_target )
+        i+=1
+      store.put_issue( date, issue.issue( date ), links )
+      return issue, issue.last_modified()
+    return serve( request.path, prepare )
+  
+  @app.route('/artikel/<article>')
+  def get_article(article):
+    '''
+    Liefert eine Artikelseite aus
+    '''
+    def prepare():
+      current, next_article = Issue(), ''
+      link = store.get_article( 'artikel/' + article )
+      if link:
+        current = store.get_issue( link[0] ) or current
+        next_article = link[1]
+      stylesheet = asset_url('css/article_styles.css')
+      stylesheet_content = asset_url('css/index_styles.css')
+      stylesheet_foundation = asset_url('css/foundation.css')
+      js_foundation = asset_url('js/vendor/foundation.js')
+      js_jquery = asset_url('js/vendor/jquery.js')
+      js_what_input = asset_url('js/vendor/what-input.js')
+      js_app = asset_url('js/app.js')
+      article_path = "%s/artikel/%s" % (src_root,article)
+      article_i = ArticlePage( )   
+      article_i.dic.update(
+          logo = asset_url("logofficiel-enlong.png"),
+          issues = content['issues'],
+          current = current,
+          next=next_article,
+          home = url_for('index',filename = pubdate),
+          stylesheet = stylesheet,
+          stylesheet_content = stylesheet_content,
+          stylesheet_foundation = stylesheet_foundation,
+          js_foundation = js_foundation,
+          js_jquery = js_jquery,
+          js_what_input = js_what_input,
+          js_app = js_app )
+      article_i.load( article_path )
+      # Die Navigation listet die letzten Ausgaben, mit jeder neuen ändert sich
+      # also auch die Seite
+      changed = article_i.last_modified()
+      if changed and content['issue_dates']:
+        changed = max( changed, dt.datetime.combine( max( content['issue_dates'] ), dt.time() ) )
+      return article_i, changed
+    # Ohne bekannte Ausgabe fehlt die Navigation, dann nicht zwischenspeichern
+    return serve( request.path, prepare, cache=bool( store.get_article( 'artikel/' + article ) ) )
+
+  search_index = SearchIndex( search_index_name() )
+
+  @app.route('/search')
+  def search():
+    '''
+    Volltextsuche in den archivierten Ausgaben, /search?q=Begriffe&page=n,
+    mit format=json als JSON. Der Index entsteht mit lmd.py sync.
+    '''
+    query = request.args.get( 'q', u'' )
+    page = max( 1, request.args.get( 'page', 1, type=int ) )
+    total, hits = search_index.search( query, 20, 20 * ( page - 1 ) )
+    docs = dict()
+    if hits:
+      rows = archive.db().execute( 'select id, key, date, title, author, abstract from search_docs where id in (%s)'
+          % ','.join( '?' * len( hits ) ), [ doc for doc, score in hits ] )
+      docs = dict( ( row[0], row[1:] ) for row in rows )
+    results = [ dict( href='/' + key, date=date, title=title, author=author, abstract=abstract, score=round( score, 3 ) )
+        for key, date, title, author, abstract in ( docs[doc] for doc, score in hits if doc in docs ) ]
+    if request.args.get( 'format' ) == 'json':
+      return jsonify( query=query, total=total, page=page, results=results )
+    articles = [ dict( href=r['href'], title=escape( r['title'] ), author=escape( r['author'] ),
+        description=escape( u'%s (%s)' % ( r['abstract'], r['date'] ) ) ) for r in results ]
+    return Page( template_name = tpl_index,
+        charset = 'utf8',
+        date = escape( u'%d Treffer für „%s“, Seite %d' % ( total, query, page ) ),
+        stylesheet = asset_url('css/index_styles.css'),
+        logo = asset_url('logo.png'),
+        articles = articles ).make()
+
+  @app.route('/admin/invalidate', methods=['POST'])
+  def invalidate():
+    '''
+    Entfernt Seiten aus dem render_cache, deren Pfad mit key beginnt, zB
+    key=/2016-05-12 oder key=/artikel/. Ohne key wird alles entfernt. Über
+    den store erfahren auch alle anderen Prozesse davon. Nur mit dem
+    admin_token im Header X-Admin-Token oder als token=...
+    '''
+    token = app.config.get('ADMIN_TOKEN')
+    given = request.headers.get( 'X-Admin-Token' ) or request.values.get( 'token' ) or u''
+    if not token or not hmac.compare_digest( unicode( token ).encode('utf8'), given.encode('utf8') ):
+      abort( 403 )
+    prefix = request.values.get( 'key', '' )
+    generation = store.invalidate( prefix )
+    keys = render_cache.invalidate( prefix )
+    return jsonify( invalidated = keys, generation = generation )
+
+  @app.route('/admin/warmer')
+  def warmer_progress():
+    '''
+    Fortschritt des Vorwärmens
+    '''
+    return jsonify( warmer.status() if warmer else dict( state='off' ) )
+  
+  @app.route('/metrics')
+  def get_metrics():
+    '''
+    Laufzeiten, Cache-Treffer und Fehler beim Holen im Textformat von
+    Prometheus. Die Werte gelten für diesen Prozess.
+    '''
+    counters = [ ( 'http_cache_total', [('result', k)], v ) for k, v in http_cache.stats.items() ] \
+        + [ ( 'render_cache_total', [('result', k)], v ) for k, v in render_cache.stats.items() ]
+    gauges = [ ( 'render_cache_entries', [], len( render_cache.entries ) ),
+               ( 'render_cache_bytes', [], render_cache.size ),
+               ( 'upstream_circuit_open', [], int( time.time() < http_client.open_until ) ) ]
+    return Response( metrics.prometheus( counters, gauges ), mimetype='text/plain; version=0.0.4' )
+
+  @app.route('/assets/<path:fname>')
+  def get_asset(fname):
+    '''
+    Liefert gebaute Ressourcen aus, komprimiert, wenn der Browser das versteht.
+    Ihr Name ändert sich mit dem Inhalt, sie dürfen also für immer im Cache
+    des Browsers bleiben.
+    '''
+    mimetype = mimetypes.guess_type( fname )[0]
+    for encoding, ext in ( ('br', '.br'), ('gzip', '.gz') ):
+      if request.accept_encodings[encoding] and p.isfile( p.join( asset_folder, fname + ext ) ):
+        response = send_from_directory( asset_folder, fname + ext, mimetype=mimetype )
+        response.headers['Content-Encoding'] = encoding
+        break
+    else:
+      response = send_from_directory( asset_folder, fname, mimetype=mimetype )
+    response.vary.add( 'Accept-Encoding' )
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+  @app.route('/fonts/<fname>')
+  def get_fonts(fname):
+    return send_from_directory( font_folder, fname )
+
+  # Die Seiten der letzten Ausgaben im Hintergrund vorwärmen. Erscheint eine
+  # neue Ausgabe, ändert sich die Liste der Ausgaben auf allen Seiten.
+  def on_new_issue():
+    update_issues()
+    render_cache.invalidate()
+  warmer = None
+  if warm:
+    warmer = Warmer( app, store, lambda : content['issue_dates'], on_new_issue, warm )
+    warmer.start()
+
+  app.logger.setLevel(ERROR)
+
+  # Laufzeit und Ergebnis jeder Anfrage zählen
+  @app.before_request
+  def start_timer():
+    g.start = time.time()
+
+  @app.before_request
+  def apply_invalidations():
+    '''
+    Leert den render_cache um das, was andere Prozesse (oder Threads) seit der
+    letzten Anfrage über /admin/invalidate invalidiert haben
+    '''
+    generation, prefixes = store.invalidated_since( invalidations['generation'] )
+    for prefix in prefixes:
+      render_cache.invalidate( prefix )
+    invalidations['generation'] = max( invalidations['generation'], generation )
+
+  @app.after_request
+  def count_request(response):
+    if 'start' in g:
+      metrics.observe( 'request', time.time() - g.start )
+    metrics.count( 'requests_total', endpoint=request.endpoint or 'none', status=response.status_code )
+    return response
+
+  # log Flask events
+  @app.after_request
+  def write_access_log(response):
+      app.logger.debug(u"%s %s -> %s" % (asctime(), request.path, response.status_code))
+      return response
+
+  return app
+
+################################################################################
+#
+# Statischer Export
+#
+################################################################################
+
+def write_if_changed( fname, data ):
+  '''
+  Schreibt data nach fname, falls sich der Inhalt geändert hat. Gibt True
+  zurück, wenn geschrieben wurde.
+  '''
+  if file_digest( fname ) == digest( data ):
+    return False
+  if not p.isdir( p.dirname( fname ) ):
+    os.makedirs( p.dirname( fname ) )
+  with open( fname, 'wb' ) as f:
+    f.write( data )
+  return True
+
+def sync_tree( src, target ):
+  '''
+  Kopiert alle Dateien unterhalb src nach target, die dort fehlen oder sich in
+  Größe oder Änderungszeit unterscheiden
+  '''
+  for root, dnames, fnames in os.walk( src ):
+    for name in fnames:
+      s = p.join( root, name )
+      t = p.join( target, p.relpath( s, src ) )
+      if not p.exists( t ) or os.stat( s ).st_size != os.stat( t ).st_size \
+          or os.stat( s ).st_mtime > os.stat( t ).st_mtime:
+        if not p.isdir( p.dirname( t ) ):
+          os.makedirs( p.dirname( t ) )
+        shutil.copy2( s, t )
+
+def export_site( app, target, issues, jobs=8, force=False ):
+  '''
+  Schreibt die Webapp als statische Seiten nach target, so dass ein Webserver
+  wie nginx sie ohne Python ausliefern kann. Jede Seite liegt unter dem Pfad
+  ihrer Route (/2016-05-12, /artikel/!5301234, /rss/2016-05-12, /archiv/2016),
+  die Übersichtsseite als index.html, template_ressources unter dem Pfad, auf
+  den url_for('static') in den Seiten verweist (app.static_url_path), und die
+  Ausgabe von build_assets() unter assets. Für nginx etwa:
+
+    root <target>;
+    default_type text/html;
+    location /rss/ { default_type application/rss+xml; }
+    location /assets/ { gzip_static on; add_header Cache-Control "public, max-age=31536000, immutable"; }
+    location / { try_files $uri $uri/index.html =404; }
+
+  Die Seiten werden von jobs Threads über den test_client der App erzeugt und
+  nur geschrieben, wenn sie sich geändert haben. Artikel vergangener Ausgaben,
+  die schon in target liegen, werden nicht neu erzeugt, außer bei force.
+  app:    die Flask-App aus create_app(), am besten mit warm=0
+  issues: Liste der Ausgabedaten (datetime.date-Objekte)
+  '''
+  stats = dict( written=0, unchanged=0, skipped=0, failed=0 )
+  lock = threading.Lock()
+
+  def export( path ):
+    fname = p.join( target, 'index.html' if path == '/' else path.lstrip('/') )
+    response = app.test_client().get( path )
+    with lock:
+      if response.status_code != 200:
+        log.error( "Exporting %s failed with %d", path, response.status_code )
+        stats['failed'] += 1
+      elif write_if_changed( fname, response.get_data() ):
+        stats['written'] += 1
+      else:
+        stats['unchanged'] += 1
+
+  sync_tree( dirname_tpl_res, p.join( target, app.static_url_path.lstrip('/') ) )
+  if p.isdir( dirname_assets ):
+    sync_tree( dirname_assets, p.join( target, 'assets' ) )
+  current = get_current_issue_date()
+  pool = ThreadPool( max( 1, jobs ) )
+  try:
+    export( '/' )
+    pool.map( export, [ '/archiv/%d' % year for year in issue_calendar.years() ] )
+    for issue in sorted( issues, reverse=True ):
+      date = issue.strftime('%Y-%m-%d')
+      # Der Index zuerst, er legt die Artikel der Ausgabe im store ab
+      pool.map( export, [ '/%s' % date, '/rss/%s' % date ] )
+      content = app.store.get_issue( date ) or Issue()
+      paths = [ '/' + article['href'] for article in content['articles'] ]
+      if issue < current and not force:
+        todo = [ path for path in paths if not p.exists( p.join( target, path.lstrip('/') ) ) ]
+        stats['skipped'] += len( paths ) - len( todo )
+        paths = todo
+      pool.map( export, paths )
+  finally:
+    pool.close()
+    pool.join()
+  return stats
+
+if __name__=='__main__':
+  '''
+  Appserver starten
+  '''
+  from logging import FileHandler, DEBUG
+  from time import asctime
+    
+  # allow for server options
+  import argparse
+
+  server = argparse.ArgumentParser(description="Startet den Appserver oder exportiert die Seiten statisch")
+  server.add_argument("mode", help="serve startet den Appserver, export schreibt statische Seiten, assets baut die Ressourcen, sync füllt das Archiv", nargs='?', choices=['serve', 'export', 'assets', 'sync'], default='serve')
+  server.add_argument("-p", "--port", help="Port des Servers", type=int, default=8000)
+  server.add_argument("--options", help="Weitere Flask-Server-Optionen als kommaseparierte key=value-Paare", type=str, default=None)
+  server.add_argument("-d", "--debug", help="Schaltet debug mode ein", action='store_true')
+  server.add_argument("-o", "--open", help="Öffnet den Server für LAN und ggf. WAN", action='store_true')
+  server.add_argument("--cache-entries", help="Maximale Anzahl zwischengespeicherter Seiten", type=int, default=512)
+  server.add_argument("--cache-size", help="Maximale Größe des Seiten-Caches in MB", type=int, default=64)
+  server.add_argument("--state", help="Speicher für den Zustand: memory oder sqlite:<Pfad>", type=str, default='memory')
+  server.add_argument("--warm", help="Gleichzeitige Anfragen beim Vorwärmen der letzten Ausgaben, 0 schaltet es ab", type=int, default=2)
+  server.add_argument("--stream", help="Seiten schon während des Renderns schicken", action='store_true')
+  server.add_argument("--admin-token", help="Geheimnis für /admin/invalidate, default ist $LMD_ADMIN_TOKEN", type=str, default=None)
+  server.add_argument("--target", help="Zielverzeichnis für export", type=str, default='site')
+  server.add_argument("--from", dest="start", help="export/sync: alle Ausgaben ab Monat JJJJ-MM", type=year_month, default=None)
+  server.add_argument("-j", "--jobs", help="export/sync: Anzahl gleichzeitig erzeugter bzw. geholter Seiten", type=int, default=8)
+  server.add_argument("--force", help="export: auch schon exportierte Artikel neu erzeugen", action='store_true')
+  server.add_argument("--to", dest="end", help="sync: bis einschließlich Monat JJJJ-MM", type=year_month, default=None)
+  server.add_argument("--archive", help="Pfad des lokalen Archivs", type=str, default=None)
+  server.add_argument("--offline", help="Seiten nur aus dem Archiv holen", action='store_true')
+  opts = server.parse_args()
+  if opts.mode == 'assets':
+    manifest = build_assets()
+    print "%d Dateien nach %s gebaut%s" % ( len( manifest ), dirname_assets, '' if brotli else ' (ohne brotli)' )
+    sys.exit()
+  if opts.archive or opts.mode == 'sync':
+    open_archive( opts.archive )
+  if opts.mode == 'sync':
+    logging.basicConfig( format='%(asctime)s[%(threadName)s]%(levelname)s: %(message)s',
+        level=logging.DEBUG if opts.debug else logging.ERROR )
+    current = get_current_issue_date()
+    end = opts.end or ( current.year, current.month )
+    if opts.start:
+      issues = filter( lambda issue : issue <= current, get_issue_range( opts.start, end ) )
+    else:
+      issues = get_issue_list( end[1], end[0] )
+    start = time.time()
+    stats = sync_archive( issues, opts.jobs )
+    print "%d Ausgaben nach %s gespiegelt: %d Seiten geholt, %d unverändert, %d übersprungen, %d fehlgeschlagen in %.1f s" % (
+        len( issues ), archive.fname, stats['fetched'], stats['unchanged'], stats['skipped'], stats['failed'], time.time() - start )
+    start = time.time()
+    indexed = update_search_index()
+    print "Suchindex %s: %d Artikel neu, %d geändert, %d unverändert in %.1f s" % (
+        search_index_name(), indexed['added'], indexed['updated'], indexed['unchanged'], time.time() - start )
+    sys.exit( 1 if stats['failed'] else 0 )
+  server_opts = dict(debug=opts.debug,port=opts.port)
+  port = opts.port
+  if opts.open: 
+    server_opts.update(host='0.0.0.0')
+  ignored = []
+  if opts.options:
+    key_value_pattern = re.compile('[a-zA-Z0-9_]*=.*')
+    kvs=opts.options.split(',')
     for kv in kvs:
       if key_value_pattern.match( kv ):
-        key, value = kv.split('=')
+        key, value = kv.split('=', 1)
         if value.isdigit(): value = int( value )
         if value=='True': value = True 
         if value=='False': value = False 
         server_opts.update({key:value})
       else:
-        app.logger.error('%s will be ignored, because it is not a key value pair!',kv)
+        ignored.append( kv )
+  # Die Optionen des HTTP-Clients sind nicht für Flask bestimmt. Der Client
+  # muss konfiguriert sein, bevor create_app() den Warmer startet.
+  http_client.configure( **dict( (key, server_opts.pop( key )) for key in HttpClient.options if key in server_opts ) )
+  app = create_app( opts.state, opts.cache_entries, opts.cache_size, opts.warm if opts.mode == 'serve' else 0, opts.offline,
+      opts.stream and opts.mode == 'serve', opts.admin_token )
 
-  # log Flask events
-  from time import asctime
-  app.logger.debug(u"Flask server started " + asctime())
-  @app.after_request
-  def write_access_log(response):
-      app.logger.debug(u"%s %s -> %s" % (asctime(), request.path, response.status_code))
-      return response
+  # configure Flask logging
+  app.logger.addHandler( FileHandler('error.log') )
+  if opts.debug:
+    app.logger.setLevel( DEBUG )
+  for kv in ignored:
+    app.logger.error('%s will be ignored, because it is not a key value pair!',kv)
 
-  app.run( **server_opts )
+  if opts.mode == 'export':
+    logging.basicConfig( format='%(asctime)s[%(threadName)s]%(levelname)s: %(message)s',
+        level=logging.DEBUG if opts.debug else logging.ERROR )
+    current = get_current_issue_date()
+    if opts.start:
+      issues = filter( lambda issue : issue <= current, get_issue_range( opts.start, ( current.year, current.month ) ) )
+    else:
+      issues = get_issue_list( current.month, current.year )
+    start = time.time()
+    stats = export_site( app, opts.target, issues, opts.jobs, opts.force )
+    print "%d Ausgaben nach %s exportiert: %d Seiten geschrieben, %d unverändert, %d übersprungen, %d fehlgeschlagen in %.1f s" % (
+        len( issues ), opts.target, stats['written'], stats['unchanged'], stats['skipped'], stats['failed'], time.time() - start )
+    sys.exit( 1 if stats['failed'] else 0 )
 
-  
+  app.logger.debug(u"Flask server started " + asctime())
+  app.run( **server_opts )